@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -38,19 +40,27 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'rest_framework.authtoken',
+    'store',
 ]
 
 MIDDLEWARE = [
+    'store.middleware.ReplicaRoutingMiddleware',
+    'store.middleware.MetricsMiddleware',
+    'store.middleware.AccessLogMiddleware',
+    'store.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'store.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'store.middleware.ResponseCacheMiddleware',
 ]
 
-ROOT_URLCONF = 'backend.urls'
+ROOT_URLCONF = 'settings.urls'
 
 TEMPLATES = [
     {
@@ -68,19 +78,84 @@ TEMPLATES = [
     },
 ]
 
-WSGI_APPLICATION = 'backend.wsgi.application'
+WSGI_APPLICATION = 'settings.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLITE_PROFILE=tuned (the default) is the high-concurrency profile: WAL so
+# readers never block the writer, writers queue on busy_timeout instead of
+# failing with "database is locked", BEGIN IMMEDIATE so a transaction takes
+# the write lock up front rather than failing when it upgrades, and
+# persistent connections checked before reuse. SQLITE_PROFILE=default is
+# Django's stock configuration (compare with `manage.py bench_sqlite_writes`).
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'tuned')
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # Durable across application crashes; WAL keeps it consistent on power loss
+    'busy_timeout': 5000,  # ms
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # KiB, per connection
+    'temp_store': 'MEMORY',
+}
+SQLITE_TUNED = {
+    'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', 600)),
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 5,  # Seconds; Python's own wait, matching busy_timeout
+        'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+    },
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        **(SQLITE_TUNED if SQLITE_PROFILE == 'tuned' else {}),
     }
 }
 
+# Read replicas for catalog, search and order-history reads (store/routers.py).
+# DATABASE_REPLICAS is a comma-separated list of SQLite files, e.g. copies kept
+# fresh by `manage.py sync_sqlite_replicas`; production points these at Postgres.
+DATABASE_REPLICA_ALIASES = []
+for index, name in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), start=1):
+    alias = f'replica{index}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name.strip(),
+        'TEST': {'MIRROR': 'default'},
+        **(SQLITE_TUNED if SQLITE_PROFILE == 'tuned' else {}),
+    }
+    DATABASE_REPLICA_ALIASES.append(alias)
+
+DATABASE_ROUTERS = ['store.routers.PrimaryReplicaRouter']
+
+# Reads stay on the primary this long (seconds) after a client writes
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# CACHE_URL (e.g. redis://localhost:6379/0) gives every worker and management
+# command one shared Redis cache, which response cache purges and coupon
+# invalidation rely on (store/responsecache.py, store/coupons.py). Without it
+# each process has a LocMemCache of its own, and purges only reach the
+# process that makes them.
+CACHE_URL = os.environ.get('CACHE_URL', '')
+if CACHE_URL:
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL},
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},  # Django's default of 300 culls response entries constantly
+        },
+    }
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -122,3 +197,86 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Stripe
+# https://docs.stripe.com/webhooks#verify-events
+
+STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY', '')
+STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', '')
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
+# Empty for Stripe's own API; `manage.py loadtest` points it at a local stub
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE', '')
+
+# Shopify Admin API root, {shop} being the shop name (store/shopify.py)
+SHOPIFY_API_BASE = os.environ.get('SHOPIFY_API_BASE', 'https://{shop}.myshopify.com/admin/api/2024-07')
+
+# Inventory reservations are held this long (seconds) for an unpaid checkout.
+# Stripe Checkout sessions expire with the hold, and Stripe needs at least 30 minutes.
+INVENTORY_RESERVATION_TTL = 60 * 60
+
+# Product views are buffered in process and written in batches (store/viewlog.py)
+VIEW_LOG_BUFFERED = True
+
+# Co-occurrence counts kept between incremental recommendation builds
+RECOMMENDATIONS_STATE_PATH = BASE_DIR / 'var' / 'recommendations.npz'
+
+# Absolute links in generated feeds and sitemaps
+SITE_NAME = os.environ.get('SITE_NAME', 'Store')
+SITE_URL = os.environ.get('SITE_URL', 'http://localhost:8000')
+
+# Google Shopping feed written by `manage.py build_google_feed` and served by store.views.google_base
+GOOGLE_FEED_PATH = BASE_DIR / 'var' / 'feeds' / 'google_base.xml.gz'
+
+# Sitemap shards and index written by `manage.py build_sitemaps`
+SITEMAP_ROOT = BASE_DIR / 'var' / 'sitemaps'
+
+# orjson-backed JSON rendering (store/renderers.py); falls back to DRF's renderer without orjson
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'store.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Per-request SQL query counts and time in Server-Timing headers, and warnings
+# for views over their query_budget (store/queries.py)
+QUERY_INSTRUMENTATION = os.environ.get('QUERY_INSTRUMENTATION', str(DEBUG)).lower() in ('1', 'true', 'yes')
+
+# Bearer token required to scrape /metrics (store/metrics.py); when empty only
+# logged-in staff can read it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# On-demand request profiling (store/profiler.py): sampling interval in seconds,
+# lifetime of X-Profile-Token headers from `manage.py profile_token`, and how
+# many RequestProfiles to keep
+PROFILER_INTERVAL = 0.005  # The GIL switch interval; sampling faster gains nothing
+PROFILE_TOKEN_MAX_AGE = 60 * 60
+REQUEST_PROFILE_KEEP = 200
+
+# JSON logs to stdout, written by a background thread so a slow stdout never
+# blocks a request (store/logs.py). Records beyond LOG_QUEUE_SIZE waiting to
+# be written are dropped and counted. Successful requests to hot endpoints are
+# sampled in the access log; those slower than ACCESS_LOG_SLOW_MS never are.
+LOGGING_CONFIG = 'store.logs.configure'
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'store.logs.JsonFormatter'},
+    },
+    'handlers': {
+        'stdout': {'class': 'logging.StreamHandler', 'stream': 'ext://sys.stdout', 'formatter': 'json'},
+    },
+    'root': {'handlers': ['stdout'], 'level': os.environ.get('LOG_LEVEL', 'INFO')},
+    'loggers': {
+        # Through the root logger's queue instead of Django's own console handlers
+        'django': {'level': 'INFO', 'propagate': True},
+        'django.server': {'level': 'INFO', 'propagate': True},
+    },
+}
+if sys.argv[1:2] == ['test']:
+    # One INFO line per request would bury the test runner's output
+    LOGGING['loggers']['store.access'] = {'level': 'WARNING'}
+LOG_QUEUE_SIZE = 10000
+ACCESS_LOG_SLOW_MS = 500
@@ -1,7 +1,12 @@
 from django.contrib import admin, messages
+from django.db.models import Sum
 from .shopify import ShopifyAPI
-from django.http import HttpResponseRedirect
-from django.urls import path
+from .responsecache import category_key, response_cache
+from .signals import purge_products
+from django.http import HttpResponse, HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 from .models import (
     Product,
     ProductReview,
@@ -13,9 +18,11 @@ from .models import (
     Cart,
     SearchTerm,
     StripeCharge,
+    StripeEvent,
     Refund,
     Return,
     UserProfile,
+    RequestProfile,
 )
 
 #########################################
@@ -57,14 +64,17 @@ class ProductAdmin(admin.ModelAdmin):
 
     def make_featured(self, request, queryset):
         queryset.update(is_featured=True)
+        purge_products(queryset.values_list('pk', flat=True))
     make_featured.short_description = "Mark selected products as featured"
 
     def make_bestseller(self, request, queryset):
         queryset.update(is_bestseller=True)
+        purge_products(queryset.values_list('pk', flat=True))
     make_bestseller.short_description = "Mark selected products as bestsellers"
 
     def make_inactive(self, request, queryset):
         queryset.update(is_active=False)
+        purge_products(queryset.values_list('pk', flat=True))
     make_inactive.short_description = "Mark selected products as inactive"
 
     # Define the custom action
@@ -105,6 +115,7 @@ admin.site.register(Product, ProductAdmin)
 
 class ProductReviewAdmin(admin.ModelAdmin):
     list_display = ('product', 'user', 'rating', 'is_approved', 'date')
+    list_select_related = ('product', 'user')
     list_filter = ('is_approved', 'rating', 'date')
     search_fields = ('user__username', 'product__name', 'rating', 'content')
     list_per_page = 20
@@ -154,9 +165,11 @@ class CategoryAdmin(admin.ModelAdmin):
 
     def make_active(self, request, queryset):
         queryset.update(is_active=True)
+        response_cache.purge(category_key(slug) for slug in queryset.values_list('slug', flat=True))
 
     def make_inactive(self, request, queryset):
         queryset.update(is_active=False)
+        response_cache.purge(category_key(slug) for slug in queryset.values_list('slug', flat=True))
 
     make_active.short_description = 'Mark selected categories as active'
     make_inactive.short_description = 'Mark selected categories as inactive'
@@ -171,6 +184,7 @@ admin.site.register(Category, CategoryAdmin)
 class SubcategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     list_display = ('name', 'category', 'created_at')
+    list_select_related = ('category',)
     list_filter = ('category',)
     search_fields = ('name', 'description')
 
@@ -237,6 +251,7 @@ class OrderAdmin(admin.ModelAdmin):
 
 class ProductViewLogAdmin(admin.ModelAdmin):
     list_display = ('user', 'product', 'viewed_at', 'ip_address', 'tracking_id')
+    list_select_related = ('user', 'product')
     list_filter = ('user', 'product')
     search_fields = ('user__username', 'product__name', 'ip_address')
 
@@ -249,16 +264,21 @@ admin.site.register(ProductViewLog, ProductViewLogAdmin)
 
 class CartAdmin(admin.ModelAdmin):
     list_display = ('get_product_name', 'get_quantity', 'get_user')
+    list_select_related = ('user',)
     list_filter = ('user',)
-    search_fields = ('product__name',)
+    search_fields = ('items__product__name',)
+
+    def get_queryset(self, request):
+        # Names and quantities for the whole page in two queries, not two per cart
+        return super().get_queryset(request).annotate(quantity=Sum('items__quantity')).prefetch_related('items__product')
 
     def get_product_name(self, obj):
-        return obj.product.name if obj.product else 'No Product'
+        return ', '.join(item.product.name for item in obj.items.all() if item.product) or 'No Product'
 
     get_product_name.short_description = 'Product'
 
     def get_quantity(self, obj):
-        return obj.quantity
+        return obj.quantity or 0
 
     get_quantity.short_description = 'Quantity'
 
@@ -275,6 +295,7 @@ admin.site.register(Cart, CartAdmin)
 
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'email')
+    list_select_related = ('user',)
     search_fields = ('user__username', 'email')
 
 admin.site.register(UserProfile, UserProfileAdmin)
@@ -286,6 +307,7 @@ admin.site.register(UserProfile, UserProfileAdmin)
 
 class SearchTermAdmin(admin.ModelAdmin):
     list_display = ('query', 'search_date', 'user')
+    list_select_related = ('user',)
     list_filter = ('user',)
     search_fields = ('query',)
     readonly_fields = ('search_date', 'user')
@@ -305,12 +327,21 @@ class StripeChargeAdmin(admin.ModelAdmin):
     readonly_fields = ('stripe_charge_id', 'amount', 'currency', 'description', 'paid', 'status', 'details')
 
 
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'received_at')
+    list_filter = ('event_type',)
+    search_fields = ('event_id',)
+    readonly_fields = ('event_id', 'event_type', 'received_at')
+
+
 #########################################
 #               Refund Admin            #
 #########################################
 
 class RefundAdmin(admin.ModelAdmin):
     list_display = ('id', 'order', 'refund_amount', 'reason_for_refund', 'refund_date')
+    list_select_related = ('order',)
     list_filter = ('refund_date',)
     search_fields = ('order__id', 'reason_for_refund')
 
@@ -323,8 +354,49 @@ admin.site.register(Refund, RefundAdmin)
 
 class ReturnAdmin(admin.ModelAdmin):
     list_display = ('id', 'order', 'return_date', 'reason_for_return', 'notes')
+    list_select_related = ('order',)
     list_filter = ('order', 'return_date')
     search_fields = ('order__id', 'reason_for_return')
     ordering = ('-return_date',)
 
-admin.site.register(Return, ReturnAdmin)
\ No newline at end of file
+admin.site.register(Return, ReturnAdmin)
+
+
+#########################################
+#           Request Profile Admin       #
+#########################################
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'view_name', 'status_code', 'duration_ms', 'samples', 'user', 'download')
+    list_select_related = ('user',)
+    list_filter = ('view_name', 'status_code')
+    search_fields = ('path', 'view_name')
+    date_hierarchy = 'created_at'
+    exclude = ('collapsed_stacks',)
+    readonly_fields = ('created_at', 'method', 'path', 'view_name', 'status_code', 'duration_ms', 'samples',
+                       'interval_ms', 'user', 'download')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def download(self, obj):
+        url = reverse('admin:store_requestprofile_download', args=[obj.pk])
+        return format_html('<a href="{}">profile-{}.folded</a>', url, obj.pk)
+
+    download.short_description = 'Collapsed stacks'
+
+    def download_view(self, request, pk):
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(profile.collapsed_stacks + '\n', content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile.pk}.folded"'
+        return response
+
+    def get_urls(self):
+        custom_urls = [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view), name='store_requestprofile_download'),
+        ]
+        return custom_urls + super().get_urls()
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        import stripe
+        from django.conf import settings
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .queries import install
+
+        connection_created.connect(install, dispatch_uid='store.queries.install')
+        if settings.STRIPE_API_BASE:
+            stripe.api_base = settings.STRIPE_API_BASE
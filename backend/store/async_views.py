@@ -0,0 +1,163 @@
+"""
+Async variants of the hot read endpoints and of checkout, for ASGI.
+
+They return the same JSON as their DRF counterparts in views.py. The catalog
+reads use the async ORM, with prefetches done as part of the async query, so
+serializing touches no database. Checkout waits on Stripe through its async
+HTTP client, and the transactional inventory work runs via sync_to_async.
+Under WSGI these views still work, each on its own event loop.
+
+Checkout applies CSRF checks as DRF's SessionAuthentication does for the sync
+CheckoutAPIView: only to users logged in with the session cookie. Anonymous
+clients identified by the Session-Key header are not checked.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .checkout import acreate_checkout_session, get_line_items
+from .inventory import InsufficientStock, release_orders, reserve_order
+from .logs import access_log_sample
+from .models import Category, Order, Product
+from .queries import query_budget
+from .renderers import FastJSONRenderer
+from .responsecache import category_key, product_ids, product_key
+from .routers import replica_reads
+from .serializers import ProductDetailSerializer, ProductSerializer, prefetch_active_recommendations
+from .viewlog import arecord_view
+
+PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+renderer = FastJSONRenderer()
+
+
+def json_response(data, status=200, surrogate_keys=None):
+    response = HttpResponse(renderer.render(data), status=status, content_type='application/json')
+    if surrogate_keys is not None:
+        response.surrogate_keys = surrogate_keys  # Cacheable by ResponseCacheMiddleware
+    return response
+
+
+async def serialize_products(request, queryset):
+    products = [product async for product in queryset.prefetch_related('categories')]
+    return ProductSerializer(products, many=True, context={'request': request}).data
+
+
+def page_bounds(request):
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    try:
+        size = min(max(int(request.GET.get('page_size', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        size = PAGE_SIZE
+    return page, size
+
+
+async def paginate(request, queryset):
+    """ The StandardResultsSetPagination page shape: count, next, previous, results """
+    page, size = page_bounds(request)
+    count = await queryset.acount()
+    results = await serialize_products(request, queryset[(page - 1) * size:page * size])
+    url = request.build_absolute_uri()
+    return {
+        'count': count,
+        'next': replace_query_param(url, 'page', page + 1) if page * size < count else None,
+        'previous': (
+            None if page == 1 else
+            remove_query_param(url, 'page') if page == 2 else replace_query_param(url, 'page', page - 1)
+        ),
+        'results': results,
+    }
+
+
+@replica_reads
+@query_budget(4)
+@access_log_sample(0.1)
+@require_GET
+async def product_list(request):
+    data = await paginate(request, Product.objects.filter(is_active=True))
+    return json_response(data, surrogate_keys=[product_key(pk) for pk in product_ids(data)] + ['products'])
+
+
+@replica_reads
+@query_budget(3)
+@access_log_sample(0.1)
+@require_GET
+async def featured_products(request):
+    data = await serialize_products(request, Product.objects.filter(is_featured=True, is_active=True))
+    return json_response(data, surrogate_keys=[product_key(pk) for pk in product_ids(data)] + ['featured'])
+
+
+@replica_reads
+@query_budget(6)
+@access_log_sample(0.1)
+@require_GET
+async def category_products(request, slug):
+    category = await aget_object_or_404(Category, slug=slug)
+    products = await serialize_products(request, Product.objects.filter(categories=category, is_active=True))
+    featured = await serialize_products(request, Product.objects.filter(is_featured=True))
+    data = {
+        'results': products,
+        'category': {'id': category.id, 'name': category.name, 'description': category.description},
+        'featured_products': featured,
+    }
+    keys = [product_key(pk) for pk in product_ids(products) + product_ids(featured)]
+    return json_response(data, surrogate_keys=keys + [category_key(slug), 'featured'])
+
+
+@replica_reads
+@query_budget(5)
+@access_log_sample(0.1)
+@require_GET
+async def product_detail(request, slug):
+    products = Product.objects.prefetch_related('categories', prefetch_active_recommendations())
+    product = await aget_object_or_404(products, slug=slug)
+    data = ProductDetailSerializer(product, context={'request': request}).data
+    await arecord_view(request, product.pk)
+    keys = [product_key(pk) for pk in [product.pk] + product_ids(data.get('recommendations', []))]
+    response = json_response(data, surrogate_keys=keys)
+    response.viewed_product_id = product.pk  # Still logged when served from the response cache
+    return response
+
+
+def session_csrf_protect(view):
+    """ CSRF checks for session-authenticated users only, as on the DRF views """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if user.is_authenticated:
+            try:
+                SessionAuthentication().enforce_csrf(request)
+            except PermissionDenied as e:
+                return JsonResponse({"detail": str(e.detail)}, status=403)
+        return await view(request, *args, **kwargs)
+    return csrf_exempt(wrapper)
+
+
+@session_csrf_protect
+@require_POST
+async def checkout(request):
+    order = await Order.objects.filter(session=request.session.session_key, ordered=False).afirst()
+    line_items = await sync_to_async(get_line_items)(order) if order else None
+    if not line_items:
+        return JsonResponse({"error": "You do not have an active order"}, status=400)
+    try:
+        expires_at = await sync_to_async(reserve_order)(order)
+    except InsufficientStock:
+        return JsonResponse({"error": "Some items in your cart are out of stock"}, status=409)
+    try:
+        session = await acreate_checkout_session(request, order, line_items, expires_at)
+    except Exception as e:
+        await sync_to_async(release_orders)([order])
+        return JsonResponse({"error": str(e)}, status=500)
+    return JsonResponse({"checkout_url": session.url}, status=303)
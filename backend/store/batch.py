@@ -0,0 +1,167 @@
+"""
+Composite GET requests for page bootstrap.
+
+run_batch() resolves each path against the URLconf and calls its view
+in-process with a sub-request that shares the outer request's user, session,
+cookies and headers, less those describing the outer POST's body. The
+middleware stack runs once, for the outer request. Views using
+SurrogateKeyMixin are pure catalog reads and run concurrently on a thread
+pool. Everything else (session, cart and profile views) runs in order on the
+request thread. Every sub-request passes through
+ResponseCacheMiddleware, so cached catalog responses are reused here too.
+Only DRF API views are run; other paths (feeds, sitemaps, /metrics) get a
+400 without their view being called, and a sub-response that streams or is
+not JSON gets a 415 instead of being read.
+Concurrent sub-requests get their own database routing state, so views
+marked use_replica read from a replica unless the client is pinned to the
+primary. Pool threads close their database connections after each
+sub-request; with persistent connections (CONN_MAX_AGE) they would otherwise
+stay open in threads that no request cycle ever closes.
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.handlers.exception import response_for_exception
+from django.db import connections
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, get_resolver
+from rest_framework.views import APIView
+
+from . import routers
+from .middleware import ResponseCacheMiddleware
+from .responsecache import SurrogateKeyMixin
+
+BATCH_MAX_REQUESTS = 10
+BATCH_MAX_WORKERS = 4
+
+# The outer request is a POST; its sub-requests are body-less GETs
+BODY_META_KEYS = ('CONTENT_LENGTH', 'CONTENT_TYPE', 'HTTP_CONTENT_ENCODING', 'HTTP_TRANSFER_ENCODING', 'wsgi.input')
+
+
+class BatchError(ValueError):
+    pass
+
+
+def build_subrequest(request, path):
+    parts = urlsplit(path)
+    sub = HttpRequest()
+    sub.method = 'GET'
+    sub.path = sub.path_info = parts.path
+    sub.META = {key: value for key, value in request.META.items() if key not in BODY_META_KEYS}
+    sub.META.update(REQUEST_METHOD='GET', PATH_INFO=parts.path, QUERY_STRING=parts.query)
+    sub.GET = QueryDict(parts.query)
+    sub.COOKIES = request.COOKIES
+    sub.session = request.session
+    sub.user = request.user
+    sub.urlconf = getattr(request, 'urlconf', None)
+    return sub
+
+
+def view_class(match):
+    view_class = getattr(match.func, 'view_class', None) or getattr(match.func, 'cls', None)
+    return view_class if isinstance(view_class, type) else None
+
+
+def is_api_view(match):
+    """ Class-based DRF views, and function views wrapped by @api_view """
+    return issubclass(view_class(match) or object, APIView)
+
+
+def is_concurrent(match):
+    return issubclass(view_class(match) or object, SurrogateKeyMixin)
+
+
+def call_view(sub, match):
+    def get_response(request):
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+        return response
+
+    started = time.perf_counter()
+    try:
+        response = ResponseCacheMiddleware(get_response)(sub)
+    except Exception as exc:
+        response = response_for_exception(sub, exc)
+    return response, (time.perf_counter() - started) * 1000
+
+
+def run_concurrent(sub, match, outer_state):
+    pinned = outer_state is not None and (outer_state.pinned or outer_state.wrote)
+    token = routers.begin_request(pinned=pinned)
+    routers.current_state().use_replica = outer_state is not None and routers.view_uses_replica(match.func)
+    try:
+        return call_view(sub, match)
+    finally:
+        routers.end_request(token)
+        connections.close_all()  # This thread's connections, whatever CONN_MAX_AGE says
+
+
+def response_result(response):
+    """ The status and body to report for a sub-response """
+    if response.streaming:
+        response.close()  # Never iterated, so release whatever it streams from
+        return 415, {'error': 'Streaming responses cannot be batched'}
+    if hasattr(response, 'data'):
+        return response.status_code, response.data
+    if response.get('Content-Type', '').startswith('application/json'):  # Served by the response cache
+        return response.status_code, json.loads(response.content)
+    if response.status_code >= 400:
+        return response.status_code, None
+    return 415, {'error': 'Only JSON responses can be batched'}
+
+
+def run_batch(request, paths, exclude=()):
+    """
+    Run GET sub-requests for paths and return one result dict per path, in order:
+    {path, status, body, duration_ms, cache}. Paths in exclude are refused.
+    """
+    if not isinstance(paths, list) or not all(isinstance(path, str) and path.startswith('/') for path in paths):
+        raise BatchError('requests must be a list of absolute paths')
+    if len(paths) > BATCH_MAX_REQUESTS:
+        raise BatchError(f'At most {BATCH_MAX_REQUESTS} requests per batch')
+
+    resolver = get_resolver(getattr(request, 'urlconf', None))
+    results = [None] * len(paths)
+    pending = []
+    for position, path in enumerate(paths):
+        sub = build_subrequest(request, path)
+        try:
+            if sub.path in exclude:
+                raise Resolver404
+            match = resolver.resolve(sub.path_info)
+        except Resolver404:
+            results[position] = {'path': path, 'status': 404, 'body': None, 'duration_ms': 0.0, 'cache': None}
+            continue
+        if not is_api_view(match):
+            results[position] = {
+                'path': path, 'status': 400, 'body': {'error': 'Only API views can be batched'},
+                'duration_ms': 0.0, 'cache': None,
+            }
+            continue
+        sub.resolver_match = match
+        pending.append((position, path, sub, match))
+
+    def record(position, path, outcome):
+        response, duration = outcome
+        status, body = response_result(response)
+        results[position] = {
+            'path': path, 'status': status, 'body': body,
+            'duration_ms': round(duration, 2), 'cache': response.get('X-Cache'),
+        }
+
+    request.user.is_authenticated  # Resolve the lazy user here, not in several threads at once
+    outer_state = routers.current_state()
+    with ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as pool:
+        futures = [
+            (position, path, pool.submit(run_concurrent, sub, match, outer_state))
+            for position, path, sub, match in pending if is_concurrent(match)
+        ]
+        for position, path, sub, match in pending:
+            if not is_concurrent(match):
+                record(position, path, call_view(sub, match))
+        for position, path, future in futures:
+            record(position, path, future.result())
+    return results
@@ -0,0 +1,232 @@
+"""
+Stripe Checkout session building.
+
+An order's lines only change through the cart views, which bump
+Order.last_updated, so (order id, last_updated) identifies a version of the
+cart. The Stripe line-item payload is cached per version and per last change
+to the cart's products, so a price change is charged at once. The version,
+the expiry of the order's stock hold and a digest of the line items and
+discounts make up the Stripe idempotency key, so a retried POST gets the
+session that was already created instead of a new one.
+
+A coupon attached to the order (ApplyCouponView) is charged as an amount-off
+Stripe coupon made once per coupon and amount, and only while the coupon can
+still be redeemed.
+"""
+import hashlib
+import json
+from decimal import Decimal
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Prefetch, prefetch_related_objects
+from django.urls import reverse
+
+from .coupons import resolve_coupon
+from .metrics import track_upstream
+from .models import CartItem, Order
+
+try:
+    import httpx  # Stripe's async client
+except ImportError:  # Optional: async views then call Stripe from a worker thread
+    httpx = None
+
+LINE_ITEMS_TIMEOUT = 60 * 30
+STRIPE_COUPON_KEY = 'checkout:stripe_coupon:'
+
+# Lines, their products and product images in two queries, whatever the cart size
+CART_ITEMS_PREFETCH = Prefetch(
+    'cart_items',
+    queryset=CartItem.objects.select_related('product').prefetch_related('product__images'),
+)
+
+SHIPPING_OPTIONS = [
+    {
+        'shipping_rate_data': {
+            'type': 'fixed_amount',
+            'fixed_amount': {'amount': 0, 'currency': 'usd'},
+            'display_name': 'Free shipping',
+            'delivery_estimate': {
+                'minimum': {'unit': 'business_day', 'value': 5},
+                'maximum': {'unit': 'business_day', 'value': 7},
+            },
+        }
+    },
+    {
+        'shipping_rate_data': {
+            'type': 'fixed_amount',
+            'fixed_amount': {'amount': 15 * 100, 'currency': 'usd'},
+            'display_name': 'Next day air',
+            'delivery_estimate': {
+                'minimum': {'unit': 'business_day', 'value': 1},
+                'maximum': {'unit': 'business_day', 'value': 1},
+            },
+        }
+    },
+]
+
+
+def get_open_order(session_key):
+    """ The session's unpaid order, or None """
+    return Order.objects.filter(session=session_key, ordered=False).first()
+
+
+def order_version(order):
+    return f"{order.pk}-{int(order.last_updated.timestamp() * 1000000)}"
+
+
+def build_line_items(order):
+    """ Stripe line items for an order, loading its lines in one prefetch """
+    prefetch_related_objects([order], CART_ITEMS_PREFETCH)
+    line_items = []
+    for item in order.cart_items.all():
+        product = item.product
+        if product is None:
+            continue
+        product_data = {'name': product.name}
+        if product.description:
+            product_data['description'] = product.description
+        images = [image.image_url for image in product.images.all()]
+        if images:
+            product_data['images'] = images[:1]
+        line_items.append({
+            'price_data': {
+                'currency': 'usd',
+                'unit_amount': int(product.price * 100),
+                'product_data': product_data,
+            },
+            'quantity': item.quantity,
+            'adjustable_quantity': {
+                'enabled': True,
+                'minimum': 1,
+                'maximum': 10,
+            },
+        })
+    return line_items
+
+
+def get_line_items(order):
+    """ Cached build_line_items, keyed by order version and the last change to its products """
+    products_updated = order.cart_items.aggregate(updated=Max('product__updated_at'))['updated']
+    key = f"checkout:line_items:{order_version(order)}:{products_updated.timestamp() if products_updated else ''}"
+    line_items = cache.get(key)
+    if line_items is None:
+        line_items = build_line_items(order)
+        cache.set(key, line_items, LINE_ITEMS_TIMEOUT)
+    return line_items
+
+
+def line_items_total(line_items):
+    """ What Stripe charges for line_items before shipping, in dollars """
+    return Decimal(sum(line['price_data']['unit_amount'] * line['quantity'] for line in line_items)) / 100
+
+
+def order_coupon(order):
+    """ The order's coupon while it can still be redeemed, else None """
+    return resolve_coupon(order.coupon.code) if order.coupon_id else None
+
+
+def coupon_discount(coupon, subtotal):
+    """ The coupon's discount off subtotal, in dollars """
+    return min(Decimal(str(coupon.discount)), subtotal) if coupon else Decimal(0)
+
+
+def stripe_coupon_params(coupon):
+    amount_off = int(Decimal(str(coupon.discount)) * 100)
+    return dict(
+        api_key=settings.STRIPE_SECRET_KEY,
+        id=f'store-{coupon.pk}-{amount_off}',  # A changed discount is a new Stripe coupon
+        amount_off=amount_off,
+        currency='usd',
+        duration='once',
+        name=coupon.code[:40],
+    )
+
+
+def stripe_discounts(coupon):
+    """ Checkout Session discounts for coupon, creating its Stripe coupon the first time """
+    if coupon is None or coupon.discount <= 0:
+        return []
+    params = stripe_coupon_params(coupon)
+    if not cache.get(STRIPE_COUPON_KEY + params['id']):
+        with track_upstream('stripe', 'coupon.create'):
+            try:
+                stripe.Coupon.create(**params)
+            except stripe.InvalidRequestError as e:
+                if e.code != 'resource_already_exists':  # Made by another worker, or before the cache was cleared
+                    raise
+        cache.set(STRIPE_COUPON_KEY + params['id'], True, None)
+    return [{'coupon': params['id']}]
+
+
+async def astripe_discounts(coupon):
+    """ stripe_discounts() for async views """
+    if coupon is None or coupon.discount <= 0:
+        return []
+    params = stripe_coupon_params(coupon)
+    if not await cache.aget(STRIPE_COUPON_KEY + params['id']):
+        with track_upstream('stripe', 'coupon.create'):
+            try:
+                if httpx is not None:
+                    await stripe.Coupon.create_async(**params)
+                else:
+                    await sync_to_async(stripe.Coupon.create, thread_sensitive=False)(**params)
+            except stripe.InvalidRequestError as e:
+                if e.code != 'resource_already_exists':
+                    raise
+        await cache.aset(STRIPE_COUPON_KEY + params['id'], True, None)
+    return [{'coupon': params['id']}]
+
+
+def checkout_session_params(request, order, line_items, expires_at=None, discounts=()):
+    extra = {'expires_at': int(expires_at.timestamp())} if expires_at else {}
+    if discounts:
+        extra['discounts'] = list(discounts)
+    # Stripe rejects a reused key with different parameters: a new hold brings a new expiry, a price change new lines
+    lines_digest = hashlib.sha1(
+        json.dumps([line_items, extra.get('discounts', [])], sort_keys=True).encode()
+    ).hexdigest()[:16]
+    idempotency_key = f"checkout-{order_version(order)}-{extra.get('expires_at', '')}-{lines_digest}"
+    success_url = request.build_absolute_uri(reverse('store:order_success')) + '?session_id={CHECKOUT_SESSION_ID}'
+    return dict(
+        api_key=settings.STRIPE_SECRET_KEY,
+        idempotency_key=idempotency_key,
+        billing_address_collection="required",
+        customer_creation="always",
+        payment_method_types=['card'],
+        mode='payment',
+        line_items=line_items,
+        client_reference_id=str(order.pk),
+        metadata={'session_number': order.session},
+        success_url=success_url,
+        cancel_url=request.build_absolute_uri(reverse('store:checkout')),
+        shipping_options=SHIPPING_OPTIONS,
+        **extra
+    )
+
+
+def create_checkout_session(request, order, line_items, expires_at=None):
+    """ Create (or, on retry, get back) the Stripe Checkout Session for this order version """
+    discounts = stripe_discounts(order_coupon(order))
+    params = checkout_session_params(request, order, line_items, expires_at, discounts)
+    with track_upstream('stripe', 'checkout.session.create'):
+        session = stripe.checkout.Session.create(**params)
+    if order.stripe_session_id != session.id:
+        Order.objects.filter(pk=order.pk).update(stripe_session_id=session.id)
+    return session
+
+
+async def acreate_checkout_session(request, order, line_items, expires_at=None):
+    """ create_checkout_session() for async views; waits on Stripe without holding a thread """
+    discounts = await astripe_discounts(await sync_to_async(order_coupon)(order))
+    params = checkout_session_params(request, order, line_items, expires_at, discounts)
+    with track_upstream('stripe', 'checkout.session.create'):
+        if httpx is not None:
+            session = await stripe.checkout.Session.create_async(**params)
+        else:
+            session = await sync_to_async(stripe.checkout.Session.create, thread_sensitive=False)(**params)
+    if order.stripe_session_id != session.id:
+        await Order.objects.filter(pk=order.pk).aupdate(stripe_session_id=session.id)
+    return session
@@ -0,0 +1,84 @@
+"""
+Reaper for abandoned carts.
+
+Every visit that adds to cart leaves an unordered Order, its M2M links and its
+CartItems behind. reap_abandoned_carts() removes those older than a cut-off in
+small batches. Each batch is picked by walking the (ordered, last_updated)
+index and runs in its own short transaction, so the write lock is never held
+for long. Held inventory is returned before an order is deleted. Orders can
+optionally be archived as JSON lines first.
+"""
+import json
+import time
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .inventory import release_orders
+from .models import CartItem, Order
+
+REAP_BATCH_SIZE = 500
+
+
+def reap_abandoned_carts(max_age=timedelta(days=30), batch_size=REAP_BATCH_SIZE, max_batches=None,
+                         pause=0.0, archive=None, now=None):
+    """
+    Delete unordered orders not touched for max_age, with their cart items.
+    archive is an open text file that receives one JSON line per order.
+    Returns a dict of counts and the elapsed time.
+    """
+    cutoff = (now or timezone.now()) - max_age
+    stats = {'batches': 0, 'orders': 0, 'cart_items': 0, 'links': 0, 'seconds': 0.0}
+    started = time.perf_counter()
+
+    while max_batches is None or stats['batches'] < max_batches:
+        order_ids = list(Order.objects.filter(ordered=False, last_updated__lt=cutoff)
+                         .order_by('last_updated').values_list('pk', flat=True)[:batch_size])
+        if not order_ids:
+            break
+        reap_batch(order_ids, cutoff, stats, archive)
+        stats['batches'] += 1
+        if pause:
+            time.sleep(pause)  # Give other writers a turn at the lock
+
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+@transaction.atomic
+def reap_batch(order_ids, cutoff, stats, archive=None):
+    # Re-check under lock: a cart touched since the batch was picked survives
+    order_ids = list(Order.objects.filter(pk__in=order_ids, ordered=False, last_updated__lt=cutoff)
+                     .select_for_update().values_list('pk', flat=True))
+    links = Order.cart_items.through.objects.filter(order_id__in=order_ids)
+    item_ids = set(links.values_list('cartitem_id', flat=True))
+    # Keep items that also belong to an order outside this batch
+    item_ids -= set(Order.cart_items.through.objects.filter(cartitem_id__in=item_ids)
+                    .exclude(order_id__in=order_ids).values_list('cartitem_id', flat=True))
+
+    if archive is not None:
+        write_archive(archive, order_ids)
+
+    release_orders(order_ids)
+    stats['links'] += links.delete()[0]
+    stats['cart_items'] += CartItem.objects.filter(pk__in=item_ids, ordered=False).delete()[1].get(CartItem._meta.label, 0)
+    stats['orders'] += Order.objects.filter(pk__in=order_ids).delete()[1].get(Order._meta.label, 0)
+
+
+def write_archive(archive, order_ids):
+    lines = {}
+    for row in Order.cart_items.through.objects.filter(order_id__in=order_ids).values(
+        'order_id', 'cartitem__product_id', 'cartitem__variant_id', 'cartitem__quantity'
+    ):
+        lines.setdefault(row['order_id'], []).append({
+            'product_id': row['cartitem__product_id'],
+            'variant_id': row['cartitem__variant_id'],
+            'quantity': row['cartitem__quantity'],
+        })
+    for order in Order.objects.filter(pk__in=order_ids).values(
+        'id', 'session', 'user_id', 'created_at', 'last_updated', 'total', 'coupon_id'
+    ):
+        order['items'] = lines.get(order['id'], [])
+        archive.write(json.dumps(order, cls=DjangoJSONEncoder) + '\n')
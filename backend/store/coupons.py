@@ -0,0 +1,139 @@
+"""
+Coupon lookup with a small in-process LRU/TTL cache.
+
+Approved, unexpired coupons are cached by normalized code until the earlier of
+COUPON_CACHE_TTL and the coupon's own expiration_date. Unknown, unapproved and
+expired codes are cached as misses for COUPON_NEGATIVE_TTL, so brute-force
+probing of bogus codes does not reach the database on every attempt. Misses
+are kept in a separate, smaller LRU: a stream of bogus codes only evicts other
+misses, never the real coupons that checkouts look up.
+
+Saving or deleting a Coupon (see signals.py) drops its entries in this
+process at once and, when the transaction commits, replaces the coupon
+generation kept in the shared cache. Every lookup reads that generation and
+a process that sees a new one empties its caches, so other workers stop
+serving a deleted or expired coupon on their next lookup. That takes the
+shared cache of CACHE_URL: with the per-process LocMemCache default, other
+workers only see the change once their entries expire, within
+COUPON_CACHE_TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import Coupon
+
+COUPON_CACHE_SIZE = 1024
+COUPON_CACHE_TTL = 60 * 5
+COUPON_NEGATIVE_CACHE_SIZE = 256
+COUPON_NEGATIVE_TTL = 30
+GENERATION_CACHE_ALIAS = 'default'
+GENERATION_KEY = 'coupons:generation'
+
+
+def normalize_code(code):
+    return (code or '').strip().upper()
+
+
+class CouponCache:
+    """ Thread-safe LRU of code -> (Coupon, or None for a miss, expires at as a UNIX timestamp) """
+
+    def __init__(self, max_size=COUPON_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.generation = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def sync(self, generation):
+        """ Empty the cache if coupons changed, in any process, since the last lookup """
+        with self._lock:
+            if generation != self.generation:
+                self._entries.clear()
+                self.generation = generation
+
+    def get(self, code):
+        """ Return (found, coupon); coupon is None for a cached miss """
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is not None:
+                coupon, expires = entry
+                if expires > time.time():
+                    self._entries.move_to_end(code)
+                    self.hits += 1
+                    return True, coupon
+                del self._entries[code]
+            self.misses += 1
+            return False, None
+
+    def set(self, code, coupon, expires):
+        with self._lock:
+            self._entries[code] = (coupon, expires)
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, coupon):
+        """ Drop the coupon's code and any entry still holding it under an old code """
+        with self._lock:
+            self._entries.pop(normalize_code(coupon.code), None)
+            for code, (cached, _) in list(self._entries.items()):
+                if cached is not None and cached.pk == coupon.pk:
+                    del self._entries[code]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+coupon_cache = CouponCache()
+negative_cache = CouponCache(COUPON_NEGATIVE_CACHE_SIZE)
+
+
+def current_generation():
+    cache = caches[GENERATION_CACHE_ALIAS]
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:  # First use, or evicted: either way no process may trust its entries
+        cache.add(GENERATION_KEY, uuid4().hex[:12], None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def invalidate(coupon):
+    """ Forget coupon here now, and in every process once the change is committed """
+    coupon_cache.invalidate(coupon)
+    negative_cache.invalidate(coupon)  # A code probed before the coupon existed or was approved
+    transaction.on_commit(lambda: caches[GENERATION_CACHE_ALIAS].set(GENERATION_KEY, uuid4().hex[:12], None))
+
+
+def resolve_coupon(code):
+    """ The approved, unexpired Coupon for code, or None """
+    code = normalize_code(code)
+    if not code:
+        return None
+
+    generation = current_generation()
+    coupon_cache.sync(generation)
+    negative_cache.sync(generation)
+    found, coupon = coupon_cache.get(code)
+    if not found:
+        found, coupon = negative_cache.get(code)
+    metrics.count_cache('coupon', hits=found, misses=not found)
+    if found:
+        return coupon
+
+    now = timezone.now()
+    coupon = Coupon.objects.filter(code=code, is_approved=True, expiration_date__gt=now).first()
+    if coupon is None:
+        negative_cache.set(code, None, time.time() + COUPON_NEGATIVE_TTL)
+    else:
+        expires = min(time.time() + COUPON_CACHE_TTL, coupon.expiration_date.timestamp())
+        coupon_cache.set(code, coupon, expires)
+    return coupon
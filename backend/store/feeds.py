@@ -0,0 +1,86 @@
+"""
+Google Shopping (Google Base) product feed.
+
+iter_feed() renders the RSS feed piece by piece from an iterator over active
+products, so memory stays flat however large the catalog is.
+write_google_feed() runs it into a gzip file on disk, and the google_base
+view serves that file. The view streams iter_feed() directly only until the
+first build exists.
+"""
+import re
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils.html import strip_tags
+
+from .files import atomic_gzip_writer
+from .models import Product, ProductImage, ProductVariant
+
+FEED_CHUNK_SIZE = 2000
+
+# Characters XML 1.0 does not allow, which turn up in pasted product copy
+INVALID_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+FEED_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0">\n'
+    '<channel>\n'
+    '<title>{title}</title>\n'
+    '<link>{link}</link>\n'
+    '<description>{title} products</description>\n'
+)
+FEED_FOOTER = '</channel>\n</rss>\n'
+
+
+def text(value):
+    return escape(INVALID_XML_RE.sub('', value or ''))
+
+
+def feed_products():
+    return Product.objects.active().order_by('pk').prefetch_related(
+        Prefetch('images', queryset=ProductImage.objects.only('product_id', 'image_url').order_by('pk')),
+        Prefetch('variants', queryset=ProductVariant.objects.only('product_id', 'inventory_quantity')),
+    ).iterator(chunk_size=FEED_CHUNK_SIZE)
+
+
+def render_item(product, site_url):
+    images = [image.image_url for image in product.images.all()]
+    in_stock = any(variant.inventory_quantity > 0 for variant in product.variants.all())
+    parts = [
+        '<item>\n',
+        f'<g:id>{product.pk}</g:id>\n',
+        f'<title>{text(product.name)}</title>\n',
+        f'<description>{text(strip_tags(product.description))}</description>\n',
+        f'<link>{text(site_url + product.get_absolute_url())}</link>\n',
+        f'<g:price>{product.price} USD</g:price>\n',
+        f'<g:availability>{"in stock" if in_stock else "out of stock"}</g:availability>\n',
+        '<g:condition>new</g:condition>\n',
+    ]
+    if product.sale_price() != product.price:
+        parts.append(f'<g:sale_price>{product.sale_price()} USD</g:sale_price>\n')
+    if product.vendor:
+        parts.append(f'<g:brand>{text(product.vendor)}</g:brand>\n')
+    if images:
+        parts.append(f'<g:image_link>{text(images[0])}</g:image_link>\n')
+        parts.extend(f'<g:additional_image_link>{text(url)}</g:additional_image_link>\n' for url in images[1:10])
+    parts.append('</item>\n')
+    return ''.join(parts)
+
+
+def iter_feed(site_url=None):
+    """ Yield the feed document in pieces, one product at a time """
+    site_url = (site_url or settings.SITE_URL).rstrip('/')
+    yield FEED_HEADER.format(title=text(settings.SITE_NAME), link=text(site_url))
+    for product in feed_products():
+        yield render_item(product, site_url)
+    yield FEED_FOOTER
+
+
+def write_google_feed(path=None):
+    """ Build the gzip-compressed feed file and return its path """
+    path = path or settings.GOOGLE_FEED_PATH
+    with atomic_gzip_writer(path) as fh:
+        for piece in iter_feed():
+            fh.write(piece)
+    return path
@@ -0,0 +1,88 @@
+"""
+Helpers for files built ahead of time by background jobs (feeds, sitemaps):
+atomic gzip writes and conditional, range-aware serving.
+"""
+import gzip
+import os
+import re
+from contextlib import contextmanager
+
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+FILE_CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+@contextmanager
+def atomic_gzip_writer(path):
+    """ Text handle that gzips into a temp file and replaces path only on success """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp'
+    try:
+        with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=6) as fh:
+            yield fh
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def read_chunks(fh, length, chunk_size=FILE_CHUNK_SIZE):
+    with fh:
+        while length > 0:
+            chunk = fh.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def gunzip_chunks(path, chunk_size=FILE_CHUNK_SIZE):
+    """ Decompressed content of a gzip file, for clients that do not accept gzip """
+    with gzip.open(path, 'rb') as fh:
+        while chunk := fh.read(chunk_size):
+            yield chunk
+
+
+def serve_file(request, path, content_type, content_encoding=None):
+    """
+    Stream a file with Last-Modified, If-Modified-Since and single byte-range
+    support, without reading it into memory.
+    """
+    stat = os.stat(path)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), int(stat.st_mtime)):
+        return HttpResponseNotModified()
+
+    size = stat.st_size
+    start, end, status = 0, size - 1, 200
+    match = RANGE_RE.match(request.META.get('HTTP_RANGE', ''))
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(size - int(last), 0)  # Suffix range: the last N bytes
+        if start > end or start >= size:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        status = 206
+
+    fh = open(path, 'rb')
+    fh.seek(start)
+    response = StreamingHttpResponse(read_chunks(fh, end - start + 1), status=status, content_type=content_type)
+    response['Content-Length'] = str(end - start + 1)
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+        response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def accepts_gzip(request):
+    return 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
@@ -1,3 +1,5 @@
+import logging
+
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm, PasswordResetForm, UserCreationForm #,UserChangeForm, PasswordChangeForm
 from django.contrib.auth.models import User
@@ -5,6 +7,8 @@ from .models import Return, SearchTerm, Coupon, ProductReview #UserProfile,
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+logger = logging.getLogger(__name__)
+
 
 ###################################################
 #               UserProfile  Form                 #
@@ -103,7 +107,7 @@ class CustomPasswordResetForm(PasswordResetForm):
         except User.DoesNotExist:
             #print("<========", self.request.META.get('HTTP_X_REAL_IP') , "tried email:", email, "========>")
             #raise forms.ValidationError("==> This email address is not associated with any account. <==")
-            print("Non Exsistent Email Form")
+            logger.info('Password reset requested for an email with no account')
         return email
 
 ###################################################
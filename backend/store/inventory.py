@@ -0,0 +1,147 @@
+"""
+Inventory reservations.
+
+Stock is taken off ProductVariant.inventory_quantity with a single guarded
+statement, UPDATE ... SET inventory_quantity = inventory_quantity - n
+WHERE id = %s AND inventory_quantity >= n, so concurrent checkouts can never
+drive a variant below zero and no row lock is held between read and write.
+Each hold is recorded as an InventoryReservation in the same transaction. It
+is committed when Stripe confirms payment, or released when it expires, when
+the Stripe session expires or when the order is reaped.
+
+Because held stock is already off inventory_quantity, an upstream stock count
+(the Shopify sync) is written with set_stock(), which subtracts the open
+holds. Writing the count as is would hand held units out again and a later
+release would inflate the stock.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import InventoryReservation, ProductVariant
+
+RELEASE_BATCH_SIZE = 1000
+
+
+class InsufficientStock(Exception):
+    def __init__(self, variant_id, quantity):
+        self.variant_id = variant_id
+        self.quantity = quantity
+        super().__init__(f"Not enough stock to reserve {quantity} of variant {variant_id}")
+
+
+@transaction.atomic
+def reserve(variant_id, quantity, order, expires_at):
+    """ Take quantity off a variant for order, or raise InsufficientStock """
+    updated = ProductVariant.objects.filter(pk=variant_id, inventory_quantity__gte=quantity).update(
+        inventory_quantity=F('inventory_quantity') - quantity
+    )
+    if not updated:
+        raise InsufficientStock(variant_id, quantity)
+    return InventoryReservation.objects.create(
+        variant_id=variant_id, order=order, quantity=quantity, expires_at=expires_at
+    )
+
+
+def order_variant_quantities(order):
+    """ Quantity wanted per variant; lines without a variant use the product's first one """
+    items = list(order.cart_items.filter(product__isnull=False).values_list('product_id', 'variant_id', 'quantity'))
+    missing = {product_id for product_id, variant_id, _ in items if variant_id is None}
+    defaults = {}
+    if missing:
+        for product_id, variant_id in (ProductVariant.objects.filter(product_id__in=missing)
+                                       .order_by('pk').values_list('product_id', 'pk')):
+            defaults.setdefault(product_id, variant_id)
+
+    wanted = defaultdict(int)
+    for product_id, variant_id, quantity in items:
+        variant_id = variant_id or defaults.get(product_id)
+        if variant_id is not None:
+            wanted[variant_id] += quantity
+    return dict(wanted)
+
+
+@transaction.atomic
+def reserve_order(order, ttl=None):
+    """
+    Hold stock for every line of order and return when the hold expires.
+    Calling it again for an unchanged cart keeps the existing hold; a changed
+    cart, or a hold that has expired but not been released yet, is released
+    and reserved afresh. Any shortfall raises InsufficientStock and rolls back
+    every reservation made for the order.
+    """
+    wanted = order_variant_quantities(order)
+    held = InventoryReservation.objects.filter(order=order, status=InventoryReservation.HELD)
+    current = dict(held.values_list('variant_id', 'quantity'))
+    if current and current == wanted:
+        expires_at = held.earliest('expires_at').expires_at
+        if expires_at > timezone.now():
+            return expires_at
+
+    release(held)
+    expires_at = timezone.now() + (ttl or timedelta(seconds=settings.INVENTORY_RESERVATION_TTL))
+    # A stable variant order keeps two orders from deadlocking each other
+    for variant_id in sorted(wanted):
+        reserve(variant_id, wanted[variant_id], order, expires_at)
+    return expires_at
+
+
+def set_stock(variant_id, quantity):
+    """ Set a variant's stock from an upstream count, less its open holds, in one statement """
+    held = (InventoryReservation.objects.filter(variant_id=OuterRef('pk'), status=InventoryReservation.HELD)
+            .values('variant_id').annotate(total=Sum('quantity')).values('total'))
+    # May go below zero when upstream has less than is held: reservations then fail until holds are released
+    return ProductVariant.objects.filter(pk=variant_id).update(
+        inventory_quantity=Value(quantity) - Coalesce(Subquery(held), 0)
+    )
+
+
+def commit_orders(orders):
+    """ Paid orders keep their stock for good """
+    return InventoryReservation.objects.filter(order__in=orders, status=InventoryReservation.HELD).update(
+        status=InventoryReservation.COMMITTED
+    )
+
+
+@transaction.atomic
+def release(reservations):
+    """ Return the stock of held reservations to their variants and mark them released """
+    rows = list(reservations.filter(status=InventoryReservation.HELD)
+                .select_for_update().values_list('pk', 'variant_id', 'quantity'))
+    if not rows:
+        return 0
+
+    totals = defaultdict(int)
+    for _, variant_id, quantity in rows:
+        totals[variant_id] += quantity
+    # One statement for the whole batch, whatever the number of variants
+    ProductVariant.objects.filter(pk__in=totals).update(inventory_quantity=F('inventory_quantity') + Case(
+        *[When(pk=variant_id, then=Value(quantity)) for variant_id, quantity in totals.items()],
+        default=Value(0), output_field=IntegerField(),
+    ))
+    InventoryReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(
+        status=InventoryReservation.RELEASED
+    )
+    return len(rows)
+
+
+def release_orders(orders):
+    return release(InventoryReservation.objects.filter(order__in=orders))
+
+
+def release_expired(now=None, batch_size=RELEASE_BATCH_SIZE):
+    """ Release expired holds in bounded batches and return how many were released """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        batch = list(InventoryReservation.objects.filter(
+            status=InventoryReservation.HELD, expires_at__lte=now
+        ).order_by('expires_at').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return released
+        released += release(InventoryReservation.objects.filter(pk__in=batch))
@@ -0,0 +1,174 @@
+"""
+Structured, non-blocking logging.
+
+configure() is the LOGGING_CONFIG callable. It applies settings.LOGGING with
+dictConfig and then puts the configured handlers behind a queue. The loggers
+get a NonBlockingQueueHandler that only appends the record to a bounded
+queue. A QueueListener thread formats the records and writes them out. A slow
+stdout, such as a full pipe to a container log driver, then stalls the
+listener instead of the request threads. When the queue is full, records are
+dropped and counted, never waited for. A warning with the count is logged
+once there is room again.
+
+JsonFormatter writes one JSON object per line. Fields passed with extra=
+become keys of the object.
+
+The access log (logger "store.access", AccessLogMiddleware) is sampled per
+view. Hot read endpoints declare access_log_sample_rate = 0.1 as a class
+attribute, or use @access_log_sample(0.1) on function views. Every logged line
+carries its sample_rate so counts can be scaled back up. Errors and requests
+slower than ACCESS_LOG_SLOW_MS are always logged.
+"""
+import atexit
+import json
+import logging
+import logging.config
+import os
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # Optional: the json module is used instead
+    orjson = None
+
+access_logger = logging.getLogger('store.access')
+
+# Attributes every LogRecord has; anything else on a record came from extra=
+RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_listeners = []
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRS)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        if orjson is not None:
+            return orjson.dumps(entry, default=str).decode()
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0  # In total
+        self.unreported = 0  # Since the last "dropped" warning
+
+    def prepare(self, record):
+        # The stock prepare() runs the record through this handler's formatter
+        # and keeps only the text, which would hide the extra= fields from
+        # JsonFormatter. Only what cannot outlive the call is resolved here.
+        copied = object.__new__(type(record))  # Other handlers may still see the original; no __init__ needed
+        copied.__dict__.update(record.__dict__)
+        record = copied
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self.unreported += 1
+            return
+        if self.unreported:
+            unreported, self.unreported = self.unreported, 0
+            try:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f'Log queue full, dropped {unreported} records',
+                }))
+            except queue.Full:
+                self.unreported += unreported
+
+
+class DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # Waits for room: stopping drains the queue rather than dropping the sentinel
+
+
+def configure(config):
+    """
+    dictConfig(config), then move the handlers of the root logger and of each
+    logger named in config behind a queue. Loggers that share the same
+    handlers share one queue and listener thread.
+    """
+    logging.config.dictConfig(config)
+    loggers = [logging.getLogger()] + [logging.getLogger(name) for name in config.get('loggers', {})]
+    queued = {}
+    for logger in loggers:
+        if not logger.handlers or any(isinstance(handler, QueueHandler) for handler in logger.handlers):
+            continue
+        handlers = tuple(logger.handlers)
+        if handlers not in queued:
+            queued[handlers] = start_listener(handlers)
+        logger.handlers = [queued[handlers]]
+
+
+def start_listener(handlers):
+    handler = NonBlockingQueueHandler(queue.Queue(getattr(settings, 'LOG_QUEUE_SIZE', 10000)))
+    listener = DrainingQueueListener(handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    handler.listener = listener
+    _listeners.append(handler)
+    return handler
+
+
+def stop_listener(handler):
+    """ Write out what is still queued behind handler and stop its thread """
+    if handler in _listeners:
+        _listeners.remove(handler)
+        handler.listener.stop()
+
+
+def stop_listeners():
+    for handler in list(_listeners):
+        stop_listener(handler)
+
+
+def _restart_after_fork():
+    # Only the forking thread survives a fork, and the queue's lock may have
+    # been held by a listener that no longer exists: start over with new ones.
+    for handler in _listeners:
+        handler.queue = handler.listener.queue = queue.Queue(handler.queue.maxsize)
+        handler.listener._thread = None
+        handler.listener.start()
+
+
+atexit.register(stop_listeners)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def access_log_sample(rate):
+    """ Declare the share of successful requests to a function view that are access logged """
+    def decorator(view):
+        view.access_log_sample_rate = rate
+        return view
+    return decorator
+
+
+def sample_rate_of(view_func):
+    if getattr(view_func, 'access_log_sample_rate', None) is not None:
+        return view_func.access_log_sample_rate
+    view_class = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None)
+    return getattr(view_class, 'access_log_sample_rate', 1.0)
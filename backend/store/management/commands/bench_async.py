@@ -0,0 +1,167 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+
+import stripe
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import RequestFactory, override_settings
+
+from store import async_views
+from store.models import CartItem, InventoryReservation, Order, Product, ProductVariant
+from store.views import ActiveProductListView, CheckoutAPIView
+
+
+class SlowStripeHandler(BaseHTTPRequestHandler):
+    """ Answers every Checkout Session create after a fixed delay """
+    delay = 0.2
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.delay)
+        session_id = f'cs_bench_{uuid4().hex}'
+        body = json.dumps({
+            'id': session_id, 'object': 'checkout.session', 'url': f'https://checkout.stripe.com/c/pay/{session_id}',
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the sync views on a fixed thread pool (WSGI workers) with the async views on one event loop '
+        '(ASGI) under a mix of catalog reads and checkouts against a slow Stripe stub'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help='Requests per mode')
+        parser.add_argument('--clients', type=int, default=32, help='Concurrent clients')
+        parser.add_argument('--threads', type=int, default=8, help='Sync worker threads')
+        parser.add_argument('--checkout-share', type=float, default=0.2, help='Share of requests that check out')
+        parser.add_argument('--upstream-delay', type=float, default=0.2, help='Stripe stub latency in seconds')
+
+    def handle(self, *args, **options):
+        product = Product.objects.filter(is_active=True).first()
+        if product is None:
+            self.stderr.write('No products; run generate_catalog or load products first')
+            return
+
+        SlowStripeHandler.delay = options['upstream_delay']
+        upstream = ThreadingHTTPServer(('127.0.0.1', 0), SlowStripeHandler)
+        threading.Thread(target=upstream.serve_forever, daemon=True).start()
+        variant, sessions = self.create_carts(product, options['clients'])
+        random.seed(0)
+        workload = [
+            'checkout' if random.random() < options['checkout_share'] else 'list' for _ in range(options['requests'])
+        ]
+        api_base, stripe.api_base = stripe.api_base, f'http://127.0.0.1:{upstream.server_port}'
+        try:
+            # RequestFactory requests come from "testserver", as in tests
+            with override_settings(STRIPE_SECRET_KEY='sk_test_bench', ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                results = [('sync', self.run_sync(workload, sessions, options)),
+                           ('async', asyncio.run(self.run_async(workload, sessions, options)))]
+        finally:
+            stripe.api_base = api_base
+            upstream.shutdown()
+            self.delete_carts(variant, sessions)
+
+        for label, (elapsed, latencies, statuses) in results:
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000
+            self.stdout.write(
+                f'{label:>6}: {len(latencies) / elapsed:7.1f} req/s, p50 {p50:7.1f} ms, p99 {p99:7.1f} ms, '
+                f'statuses {dict(sorted(statuses.items()))}'
+            )
+
+    def create_carts(self, product, count):
+        variant = ProductVariant.objects.create(
+            product=product, variant_id=f'bench-{time.time_ns()}', title='bench', price=product.price,
+            inventory_quantity=10 ** 9,
+        )
+        sessions = []
+        for i in range(count):
+            key = f'benchasync{i:08d}'
+            order = Order.objects.create(session=key, ip_address='127.0.0.1', order_number=f'BENCH-{key}')
+            order.cart_items.add(CartItem.objects.create(product=product, variant=variant, quantity=1))
+            sessions.append(key)
+        return variant, sessions
+
+    def delete_carts(self, variant, sessions):
+        InventoryReservation.objects.filter(variant=variant).delete()
+        CartItem.objects.filter(variant=variant).delete()
+        Order.objects.filter(session__in=sessions).delete()
+        variant.delete()
+
+    def make_request(self, kind, session_key):
+        factory = RequestFactory()
+        request = factory.post('/api/checkout/') if kind == 'checkout' else factory.get('/api/products/')
+        request.session = SessionStore(session_key)
+        request.user = AnonymousUser()
+
+        async def auser():
+            return request.user
+        request.auser = auser
+        return request
+
+    def run_sync(self, workload, sessions, options):
+        views = {'list': ActiveProductListView.as_view(), 'checkout': CheckoutAPIView.as_view()}
+        workers = threading.BoundedSemaphore(options['threads'])
+        latencies, statuses, queue = [], {}, list(enumerate(workload))
+        lock = threading.Lock()
+
+        def client(session_key):
+            try:
+                while True:
+                    with lock:
+                        if not queue:
+                            return
+                        _, kind = queue.pop()
+                    request = self.make_request(kind, session_key)
+                    started = time.perf_counter()
+                    with workers:
+                        response = views[kind](request)
+                        response.render()
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+                        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=client, args=(key,)) for key in sessions[:options['clients']]]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started, latencies, statuses
+
+    async def run_async(self, workload, sessions, options):
+        views = {'list': async_views.product_list, 'checkout': async_views.checkout}
+        latencies, statuses, queue = [], {}, list(enumerate(workload))
+
+        async def client(session_key):
+            while queue:
+                _, kind = queue.pop()
+                request = self.make_request(kind, session_key)
+                started = time.perf_counter()
+                response = await views[kind](request)
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(key) for key in sessions[:options['clients']]))
+        return time.perf_counter() - started, latencies, statuses
@@ -0,0 +1,101 @@
+import io
+import logging
+import subprocess
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+
+from django.core.management.base import BaseCommand
+
+from store.logs import JsonFormatter, NonBlockingQueueHandler, start_listener, stop_listener
+
+MODES = ('print', 'sync', 'queued')
+
+# Reads the pipe in 64 KiB chunks and pauses after each, like a log driver
+# that falls behind now and then
+SLOW_READER = '''
+import sys, time
+stall = float(sys.argv[1])
+while sys.stdin.buffer.read1(65536):
+    time.sleep(stall)
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare per-request logging through print(), a synchronous JSON StreamHandler and the queued handler of '
+        'store/logs.py, from several threads writing to a pipe drained by a slow reader'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per thread')
+        parser.add_argument('--lines', type=int, default=5, help='Log lines per request, as the old views printed')
+        parser.add_argument('--stall-ms', type=float, default=5, help='Reader pause after each 64 KiB; 0 drains at full speed')
+        parser.add_argument('--mode', choices=MODES, action='append', help='Modes to run (default: all)')
+
+    def handle(self, *args, **options):
+        for mode in options['mode'] or MODES:
+            reader = subprocess.Popen(
+                [sys.executable, '-c', SLOW_READER, str(options['stall_ms'] / 1000)], stdin=subprocess.PIPE,
+            )
+            stream = io.TextIOWrapper(reader.stdin, encoding='utf-8', line_buffering=True)
+            try:
+                latencies, elapsed, dropped = self.run(mode, stream, options)
+            finally:
+                stream.close()
+                reader.wait()
+            self.report(mode, latencies, elapsed, dropped)
+
+    def run(self, mode, stream, options):
+        logger = logging.getLogger(f'store.bench_logging.{mode}')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        sink = logging.StreamHandler(stream)
+        sink.setFormatter(JsonFormatter())
+        handler = start_listener((sink,)) if mode == 'queued' else sink
+        logger.handlers = [handler]
+
+        def request(i):
+            if mode == 'print':
+                print(50 * '8', '\n', '127.0.0.1', 'Just Visited US', '\n', 50 * '8')
+                for _ in range(options['lines'] - 1):
+                    print('pure user ==>', 'shopper', i)
+            else:
+                for _ in range(options['lines']):
+                    logger.info('GET /api/products/ 200', extra={'ip': '127.0.0.1', 'user_id': i, 'duration_ms': 1.5})
+
+        latencies = []
+
+        def worker():
+            own = []
+            for i in range(options['requests']):
+                started = time.perf_counter()
+                request(i)
+                own.append(time.perf_counter() - started)
+            latencies.extend(own)
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        with redirect_stdout(stream):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+
+        dropped = 0
+        if isinstance(handler, NonBlockingQueueHandler):
+            dropped = handler.dropped
+            stop_listener(handler)  # Writes out the backlog, outside the measured time
+        stream.flush()
+        return sorted(latencies), elapsed, dropped
+
+    def report(self, mode, latencies, elapsed, dropped):
+        p50 = latencies[len(latencies) // 2] * 1e6
+        p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1e6
+        self.stdout.write(self.style.SUCCESS(
+            f'{mode:>7}: {len(latencies) / elapsed:9.0f} req/s, p50 {p50:8.1f} us, p99 {p99:9.1f} us, '
+            f'{dropped} lines dropped'
+        ))
@@ -0,0 +1,84 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.utils import timezone
+
+from store.inventory import InsufficientStock, reserve
+from store.models import InventoryReservation, Order, Product, ProductVariant
+
+
+class Command(BaseCommand):
+    help = 'Contention benchmark: many workers reserving one hot SKU until it sells out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--stock', type=int, default=2000)
+        parser.add_argument('--quantity', type=int, default=1, help='Units per reservation')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark product and orders')
+
+    def handle(self, *args, **options):
+        workers, stock, quantity = options['workers'], options['stock'], options['quantity']
+
+        product = Product.objects.create(name='Benchmark hot SKU', slug='benchmark-hot-sku', description='', price=1)
+        variant = ProductVariant.objects.create(
+            product=product, variant_id='benchmark-hot-sku', title='Default', price=1, inventory_quantity=stock
+        )
+        Order.objects.bulk_create([
+            Order(session=f'benchmark-{n}', ip_address='127.0.0.1', order_number=f'BENCH{n:07d}')
+            for n in range(workers)
+        ])
+        orders = list(Order.objects.filter(session__startswith='benchmark-').order_by('pk'))
+        expires_at = timezone.now() + timedelta(hours=1)
+
+        results = [{'reserved': 0, 'rejected': 0, 'retries': 0} for _ in range(workers)]
+        start_gate = threading.Barrier(workers + 1)
+
+        def worker(index):
+            counts = results[index]
+            start_gate.wait()
+            try:
+                while True:
+                    try:
+                        reserve(variant.pk, quantity, orders[index], expires_at)
+                        counts['reserved'] += 1
+                    except InsufficientStock:
+                        counts['rejected'] += 1
+                        break
+                    except OperationalError:
+                        counts['retries'] += 1  # SQLite "database is locked"
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(workers)]
+        for thread in threads:
+            thread.start()
+        start_gate.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        reserved = sum(r['reserved'] for r in results)
+        retries = sum(r['retries'] for r in results)
+        variant.refresh_from_db()
+        held = InventoryReservation.objects.filter(variant=variant).count()
+
+        self.stdout.write(f'workers={workers} stock={stock} quantity={quantity}')
+        self.stdout.write(f'reserved={reserved} held_rows={held} remaining={variant.inventory_quantity} retries={retries}')
+        self.stdout.write(f'elapsed={elapsed:.3f}s reservations/sec={reserved / elapsed:.0f}')
+
+        consistent = (
+            variant.inventory_quantity >= 0
+            and held == reserved
+            and variant.inventory_quantity == stock - reserved * quantity
+            and variant.inventory_quantity < quantity
+        )
+        if not options['keep']:
+            Order.objects.filter(pk__in=[order.pk for order in orders]).delete()
+            product.delete()
+        if not consistent:
+            raise CommandError('Inventory counts are inconsistent')
+        self.stdout.write(self.style.SUCCESS('Counts are consistent: no oversell'))
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from store.models import Product
+from store.renderers import FastJSONRenderer, orjson
+from store.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Time ProductSerializer plus JSON rendering of a product page, full and with ?fields='
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=10, help='Best of this many runs is reported')
+        parser.add_argument('--fields', default='id,name,price,slug')
+
+    def handle(self, *args, **options):
+        products = list(Product.objects.prefetch_related('categories')[:options['products']])
+        if len(products) < options['products']:
+            self.stderr.write(f"Only {len(products)} products; run generate_catalog for a full-size run")
+        if not products:
+            return
+        if orjson is None:
+            self.stderr.write('orjson is not installed; FastJSONRenderer falls back to the stock renderer')
+
+        factory = RequestFactory()
+        cases = [('all fields', ''), (f"fields={options['fields']}", f"?fields={options['fields']}")]
+        for label, query in cases:
+            context = {'request': Request(factory.get(f'/api/products/{query}'))}
+            serialize = self.best(options['repeat'], lambda: ProductSerializer(products, many=True, context=context).data)
+            data = ProductSerializer(products, many=True, context=context).data
+            for renderer in (JSONRenderer(), FastJSONRenderer()):
+                render = self.best(options['repeat'], lambda: renderer.render(data))
+                self.stdout.write(
+                    f'{label:>24} {type(renderer).__name__:>16}: serialize {serialize * 1000:7.1f} ms, '
+                    f'render {render * 1000:6.1f} ms, {len(renderer.render(data))} bytes'
+                )
+
+    def best(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
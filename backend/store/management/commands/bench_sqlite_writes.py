@@ -0,0 +1,137 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import SUPPRESS
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import RequestFactory
+
+from store.models import Product
+from store.views import AddToCartView, FeaturedProductListView
+
+PROFILES = ('default', 'tuned')
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the stock SQLite configuration with the tuned profile (SQLITE_PROFILE in settings) by running '
+        'add-to-cart writes and catalog reads from several processes against a scratch database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=300, help='Requests per process')
+        parser.add_argument('--write-share', type=float, default=0.5, help='Share of requests that add to cart')
+        parser.add_argument('--profile', choices=PROFILES, action='append', help='Profiles to run (default: both)')
+        # Internal: what the child processes run
+        parser.add_argument('--role', choices=('seed', 'worker'), help=SUPPRESS)
+        parser.add_argument('--worker-id', type=int, default=0, help=SUPPRESS)
+        parser.add_argument('--start-at', type=float, default=0, help=SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['role'] == 'seed':
+            return self.seed()
+        if options['role'] == 'worker':
+            return self.work(options)
+        if settings.DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('The default database is not SQLite')
+
+        for profile in options['profile'] or PROFILES:
+            with tempfile.TemporaryDirectory() as scratch:
+                env = {
+                    **os.environ,
+                    'SQLITE_PROFILE': profile,
+                    'SQLITE_PATH': os.path.join(scratch, 'bench.sqlite3'),
+                    'PYTHONPATH': os.pathsep.join(path for path in sys.path if path),
+                }
+                self.child(env, 'migrate', '--run-syncdb', '--verbosity', '0')
+                self.child(env, 'bench_sqlite_writes', '--role', 'seed')
+                results = self.run_workers(env, options)
+            self.report(profile, results)
+
+    def child(self, env, *args):
+        completed = subprocess.run([sys.executable, '-m', 'django', *args], env=env, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(completed.stderr.strip())
+        return completed.stdout
+
+    def run_workers(self, env, options):
+        start_at = time.time() + 2  # Let every process finish starting up first
+        workers = [
+            subprocess.Popen(
+                [sys.executable, '-m', 'django', 'bench_sqlite_writes', '--role', 'worker', '--worker-id', str(i),
+                 '--start-at', str(start_at), '--requests', str(options['requests']),
+                 '--write-share', str(options['write_share'])],
+                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+            )
+            for i in range(options['processes'])
+        ]
+        results = []
+        for worker in workers:
+            out, err = worker.communicate()
+            if worker.returncode:
+                raise CommandError(err.strip())
+            results.append(json.loads(out.strip().splitlines()[-1]))
+        return results
+
+    def report(self, profile, results):
+        latencies = sorted(latency for result in results for latency in result['latencies'])
+        elapsed = max(result['seconds'] for result in results)
+        errors = {}
+        for result in results:
+            for message, count in result['errors'].items():
+                errors[message] = errors.get(message, 0) + count
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+        p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000 if latencies else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{profile:>8}: {len(latencies) / elapsed:7.1f} ok req/s, p50 {p50:6.1f} ms, p99 {p99:7.1f} ms, '
+            f'{sum(errors.values())} errors'
+        ))
+        for message, count in sorted(errors.items(), key=lambda item: -item[1]):
+            self.stdout.write(f'          {count:5d} x {message}')
+
+    def seed(self):
+        Product.objects.bulk_create([
+            Product(name=f'Bench product {i}', slug=f'bench-product-{i}', description='', price=10, is_featured=i < 10)
+            for i in range(50)
+        ])
+
+    def work(self, options):
+        add_to_cart, featured = AddToCartView.as_view(), FeaturedProductListView.as_view()
+        factory = RequestFactory()
+        slugs = list(Product.objects.values_list('slug', flat=True))
+        session_key = f'bench{options["worker_id"]:04d}'
+        close_old_connections()
+        rng = random.Random(options['worker_id'])
+        latencies, errors = [], {}
+
+        time.sleep(max(options['start_at'] - time.time(), 0))
+        started = time.perf_counter()
+        for _ in range(options['requests']):
+            close_old_connections()  # request_started
+            request_started = time.perf_counter()
+            try:
+                if rng.random() < options['write_share']:
+                    slug = rng.choice(slugs)
+                    request = factory.post(
+                        f'/add-to-cart/{slug}/', HTTP_SESSION_KEY=session_key, HTTP_X_REAL_IP='127.0.0.1',
+                    )
+                    response = add_to_cart(request, slug=slug)
+                else:
+                    response = featured(factory.get('/api/products/featured/'))
+                response.render()
+                latencies.append(time.perf_counter() - request_started)
+            except Exception as e:
+                message = f'{type(e).__name__}: {e}'
+                errors[message] = errors.get(message, 0) + 1
+            finally:
+                close_old_connections()  # request_finished
+        self.stdout.write(json.dumps({
+            'seconds': time.perf_counter() - started, 'latencies': latencies, 'errors': errors,
+        }))
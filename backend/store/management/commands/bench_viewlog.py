@@ -0,0 +1,63 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory, override_settings
+
+from store.models import Product, ProductViewLog
+from store.viewlog import view_log_buffer
+from store.views import ProductDetailView
+
+
+class Command(BaseCommand):
+    help = 'Compare product detail throughput with direct and buffered view logging'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per mode')
+
+    def handle(self, *args, **options):
+        product = Product.objects.first()
+        if product is None:
+            self.stderr.write('No products; run generate_catalog or load products first')
+            return
+
+        view = ProductDetailView.as_view()
+        factory = RequestFactory()
+        threads, total = options['threads'], options['requests']
+
+        def run(buffered):
+            per_thread = total // threads
+            errors = []
+
+            def worker():
+                try:
+                    for _ in range(per_thread):
+                        request = factory.get(f'/api/products/{product.slug}/', HTTP_X_REAL_IP='127.0.0.1')
+                        view(request, slug=product.slug)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    connection.close()
+
+            before = ProductViewLog.objects.count()
+            workers = [threading.Thread(target=worker) for _ in range(threads)]
+            with override_settings(VIEW_LOG_BUFFERED=buffered):
+                started = time.perf_counter()
+                for thread in workers:
+                    thread.start()
+                for thread in workers:
+                    thread.join()
+                elapsed = time.perf_counter() - started
+                view_log_buffer.flush()
+            logged = ProductViewLog.objects.count() - before
+            return per_thread * threads / elapsed, logged, errors
+
+        for label, buffered in (('direct', False), ('buffered', True)):
+            rate, logged, errors = run(buffered)
+            self.stdout.write(f'{label:>9}: {rate:8.0f} req/s, {logged} views logged, {len(errors)} errors')
+        self.stdout.write(
+            f'buffer: written={view_log_buffer.written} sampled_out={view_log_buffer.sampled_out} '
+            f'dropped={view_log_buffer.dropped}'
+        )
@@ -0,0 +1,20 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.feeds import write_google_feed
+
+
+class Command(BaseCommand):
+    help = 'Write the gzip-compressed Google Shopping feed served at google_base (schedule hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Output file (default: settings.GOOGLE_FEED_PATH)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        path = write_google_feed(options['path'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {path} ({os.path.getsize(path)} bytes) in {time.perf_counter() - started:.2f}s'
+        ))
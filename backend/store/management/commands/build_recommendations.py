@@ -0,0 +1,31 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from store.recommendations import METRICS, MIN_SUPPORT, TOP_K, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Build "frequently bought together" recommendations from paid orders (needs numpy and scipy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild from all paid orders instead of new ones')
+        parser.add_argument('--metric', choices=METRICS, default='lift')
+        parser.add_argument('--top-k', type=int, default=TOP_K)
+        parser.add_argument('--min-support', type=int, default=MIN_SUPPORT)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            stats = build_recommendations(
+                full=options['full'], metric=options['metric'],
+                top_k=options['top_k'], min_support=options['min_support'],
+            )
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Folded {stats['pairs']} order lines ({stats['orders']} orders, {stats['products']} products), "
+            f"rescored {stats['rescored']} products, wrote {stats['written']} recommendations "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.sitemaps import build_sitemaps
+
+
+class Command(BaseCommand):
+    help = 'Rewrite the sitemap shards whose products or categories changed (schedule hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rewrite every shard')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        stats = build_sitemaps(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['written']} of {stats['shards']} shards written, {stats['removed']} removed "
+            f"in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,377 @@
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from store.models import (
+    CartItem, Category, Order, Product, ProductImage, ProductReview, ProductVariant, ProductViewLog, Subcategory,
+)
+from store.responsecache import response_cache
+
+# Slugs, usernames and sessions of generated rows start with this, so --flush
+# removes exactly what this command made
+MARKER = 'gen-'
+ORDER_MARKER = 'GEN-'
+
+# Row counts at --scale 1; --scale 50 gives about a million products and 50 million views
+BASE_COUNTS = {
+    'categories': 100,
+    'subcategories': 500,
+    'products': 20000,
+    'users': 20000,
+    'reviews': 50000,
+    'views': 1000000,
+    'orders': 40000,
+}
+VARIANTS_PER_PRODUCT = 3  # Means; the counts per product are skewed around them
+IMAGES_PER_PRODUCT = 2
+ITEMS_PER_ORDER = 2.5
+
+ADJECTIVES = (
+    'Classic', 'Vintage', 'Modern', 'Slim', 'Relaxed', 'Everyday', 'Premium', 'Lightweight', 'Heavy', 'Soft',
+    'Rugged', 'Essential', 'Organic', 'Waterproof', 'Quilted', 'Cropped', 'Oversized', 'Tailored', 'Recycled', 'Stretch',
+)
+MATERIALS = (
+    'Cotton', 'Linen', 'Wool', 'Denim', 'Leather', 'Suede', 'Canvas', 'Fleece', 'Silk', 'Cashmere', 'Corduroy', 'Nylon',
+)
+NOUNS = (
+    'Shirt', 'Tee', 'Jacket', 'Coat', 'Hoodie', 'Sweater', 'Jeans', 'Chinos', 'Shorts', 'Dress', 'Skirt', 'Boots',
+    'Sneakers', 'Loafers', 'Scarf', 'Beanie', 'Cap', 'Belt', 'Backpack', 'Tote', 'Wallet', 'Socks', 'Blazer', 'Vest',
+)
+VENDORS = tuple(f'{word} & Co' for word in ('Northwind', 'Fjord', 'Harbor', 'Atlas', 'Juniper', 'Copper', 'Ember', 'Saltwater'))
+SIZES = ('XS', 'S', 'M', 'L', 'XL', 'XXL', '28', '30', '32', '34', '36', '38')
+RATING_WEIGHTS = {5: 50, 4: 25, 3: 10, 2: 6, 1: 9}  # J-shaped, as review ratings are
+ORDER_STATUS_WEIGHTS = {'D': 70, 'S': 12, 'C': 8, 'P': 5, 'R': 5}
+
+
+def zipf_cum_weights(n, exponent):
+    """ Cumulative weights for random.choices: item i (0-based) is picked in proportion to 1 / (i + 1) ** exponent """
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def skewed_count(rng, mean, maximum):
+    """ At least 1, mean about mean, with a long tail up to maximum """
+    return min(1 + int(rng.expovariate(1 / (mean - 1))) if mean > 1 else 1, maximum)
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """ Keep the created_at-style values set on instances instead of auto_now(_add) overwriting them with now """
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with a synthetic catalog and its activity (categories, subcategories, products, variants, '
+        'images, users, reviews, product views, orders and cart items) for performance work. Popularity is Zipfian, '
+        'so a few products and categories get most of the views, reviews and orders. The same --seed gives the same '
+        'data, with timestamps relative to the day of the run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1, help='Multiplies every row count below')
+        for name, count in BASE_COUNTS.items():
+            parser.add_argument(f'--{name}', type=int, help=f'Number of {name} (default {count:,} x scale)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--zipf', type=float, default=1.1, help='Popularity skew; higher concentrates activity')
+        parser.add_argument('--days', type=int, default=365, help='Span of history to spread timestamps over')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--flush', action='store_true', help='Delete previously generated rows first')
+
+    def handle(self, *args, **options):
+        counts = {
+            name: options[name] if options[name] is not None else max(int(count * options['scale']), 1)
+            for name, count in BASE_COUNTS.items()
+        }
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.zipf = options['zipf']
+        self.days = options['days']
+        self.now = timezone.now()
+
+        if options['flush']:
+            self.flush()
+        elif Product.objects.filter(slug__startswith=MARKER).exists():
+            raise CommandError('Generated data is already present; add --flush to replace it')
+
+        started = time.perf_counter()
+        try:
+            with explicit_timestamps(Category, Subcategory, Product, ProductReview, ProductViewLog, Order):
+                categories = self.generate_categories(counts['categories'], counts['subcategories'])
+                products = self.generate_products(counts['products'], categories)
+                users = self.generate_users(counts['users'])
+                self.generate_reviews(counts['reviews'], products, users)
+                self.generate_views(counts['views'], products, users)
+                self.generate_orders(counts['orders'], products, users)
+        except IntegrityError as e:
+            raise CommandError(f'{e}; rows from an earlier run may clash, try --flush')
+        response_cache.purge(['products', 'featured'])  # bulk_create sends no signals
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated the catalog in {time.perf_counter() - started:.1f}s. '
+            'Run rollup_popular and build_recommendations to derive the rest.'
+        ))
+
+    def insert(self, label, model, rows, keep=True):
+        """ bulk_create rows (a lazy iterable) in batches, one transaction each; the created instances if keep """
+        created, count, started = [], 0, time.perf_counter()
+        rows = iter(rows)
+        while batch := list(itertools.islice(rows, self.batch_size)):
+            with transaction.atomic():
+                batch = model.objects.bulk_create(batch)
+            count += len(batch)
+            if keep:
+                created.extend(batch)
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(f'{label:>22}: {count:>11,} rows in {elapsed:7.1f}s ({count / elapsed:>9,.0f}/s)')
+        return created
+
+    def past(self, days=None):
+        """ A moment in the last `days` days """
+        return self.now - timedelta(seconds=self.rng.uniform(0, (days or self.days) * 86400))
+
+    def recent(self):
+        """ A moment in the history, most of them recent """
+        return self.now - timedelta(seconds=min(self.rng.expovariate(6 / self.days), self.days) * 86400)
+
+    def popular(self, population, cum_weights, k):
+        return self.rng.choices(population, cum_weights=cum_weights, k=k)
+
+    def generate_categories(self, count, subcategory_count):
+        rng = self.rng
+
+        def categories():
+            for i in range(count):
+                name = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}s {i}'
+                created = self.past()
+                yield Category(
+                    name=name, slug=f'{MARKER}category-{i}', description=f'All {name.lower()}',
+                    meta_keywords=name.lower().replace(' ', ','), meta_description=name,
+                    created_at=created, updated_at=created,
+                )
+
+        created = self.insert('categories', Category, categories())
+        # Bigger categories also have more subcategories
+        weights = zipf_cum_weights(len(created), self.zipf)
+        parents = self.popular(created, weights, subcategory_count)
+
+        def subcategories():
+            for i, parent in enumerate(parents):
+                name = f'{rng.choice(MATERIALS)} {parent.name.split()[1]}'[:45] + f' {i}'
+                created_at = self.past()
+                yield Subcategory(
+                    name=name, slug=f'{MARKER}subcategory-{i}', description=f'{name} in {parent.name}',
+                    meta_keywords=name.lower().replace(' ', ','), meta_description=name, category=parent,
+                    is_active=rng.random() < 0.95, created_at=created_at, updated_at=created_at,
+                )
+
+        self.insert('subcategories', Subcategory, subcategories(), keep=False)
+        return created
+
+    def generate_products(self, count, categories):
+        rng = self.rng
+
+        def products():
+            for i in range(count):
+                name = f'{rng.choice(ADJECTIVES)} {rng.choice(MATERIALS)} {rng.choice(NOUNS)} {i}'
+                price = Decimal(f'{min(max(rng.lognormvariate(3.6, 0.7), 3), 2000):.2f}')
+                discounted = rng.random() < 0.2
+                created = self.past()
+                yield Product(
+                    name=name, slug=f'{MARKER}{name.lower().replace(" ", "-")}', vendor=rng.choice(VENDORS),
+                    description=' '.join(rng.choices(ADJECTIVES + MATERIALS + NOUNS, k=rng.randint(20, 80))).lower(),
+                    price=price, discount_price=(price * Decimal('0.8')).quantize(Decimal('0.01')) if discounted else 0,
+                    is_active=rng.random() < 0.95, is_featured=rng.random() < 0.01,
+                    meta_description=name, meta_keywords=','.join(name.split()),
+                    created_at=created, updated_at=created + timedelta(seconds=rng.uniform(0, (self.now - created).total_seconds())),
+                )
+
+        created = self.insert('products', Product, products())
+        # Popularity is by rank in a shuffled order, so it is unrelated to creation order
+        rng.shuffle(created)
+
+        # Each product's main category is drawn with a long tail; some are also in a second one
+        weights = zipf_cum_weights(len(categories), self.zipf)
+        main_categories = self.popular(categories, weights, len(created))
+        Link = Product.categories.through
+
+        def links():
+            for product, category in zip(created, main_categories):
+                yield Link(product_id=product.pk, category_id=category.pk)
+                if rng.random() < 0.3:
+                    other = rng.choice(categories)
+                    if other.pk != category.pk:
+                        yield Link(product_id=product.pk, category_id=other.pk)
+
+        self.insert('product categories', Link, links(), keep=False)
+
+        def variants():
+            for product in created:
+                sizes = rng.sample(SIZES, skewed_count(rng, VARIANTS_PER_PRODUCT, 6))
+                for size in sizes:
+                    yield ProductVariant(
+                        product_id=product.pk, variant_id=f'{MARKER}{product.pk}-{size}', title=size,
+                        price=product.price, compare_at_price=product.discount_price or None,
+                        inventory_quantity=0 if rng.random() < 0.05 else int(rng.paretovariate(1.5) * 10),
+                    )
+
+        first_variants = {}
+        for variant in self.insert('variants', ProductVariant, variants()):
+            first_variants.setdefault(variant.product_id, variant.pk)
+
+        def images():
+            for product in created:
+                for n in range(skewed_count(rng, IMAGES_PER_PRODUCT, 8)):
+                    yield ProductImage(product_id=product.pk, image_url=f'https://cdn.example.com/products/{product.pk}/{n}.jpg')
+
+        self.insert('images', ProductImage, images(), keep=False)
+        return {
+            'ids': [product.pk for product in created],
+            'prices': [product.price for product in created],
+            'variants': [first_variants.get(product.pk) for product in created],
+            'weights': zipf_cum_weights(len(created), self.zipf),
+        }
+
+    def generate_users(self, count):
+        rng = self.rng
+        password = make_password(None)  # Unusable, and hashed once rather than per user
+
+        def users():
+            for i in range(count):
+                yield User(
+                    username=f'{MARKER}user-{i:07d}', email=f'user{i}@example.com', password=password,
+                    first_name=rng.choice(('Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Riley', 'Casey', 'Jamie')),
+                    last_name=rng.choice(('Smith', 'Jones', 'Garcia', 'Chen', 'Okafor', 'Novak', 'Silva', 'Kim')),
+                    date_joined=self.past(),
+                )
+
+        created = [user.pk for user in self.insert('users', User, users())]
+        rng.shuffle(created)  # A few users are much more active than the rest
+        return {'ids': created, 'weights': zipf_cum_weights(len(created), self.zipf)}
+
+    def generate_reviews(self, count, products, users):
+        rng = self.rng
+        ratings, rating_weights = zip(*RATING_WEIGHTS.items())
+
+        def reviews():
+            remaining = count
+            while remaining > 0:
+                k = min(self.batch_size, remaining)
+                remaining -= k
+                reviewers = self.popular(users['ids'], users['weights'], k)
+                for product_id, user_id in zip(self.popular(products['ids'], products['weights'], k), reviewers):
+                    yield ProductReview(
+                        product_id=product_id, user_id=user_id, rating=rng.choices(ratings, rating_weights)[0],
+                        is_approved=rng.random() < 0.95, date=self.recent(),
+                        content=' '.join(rng.choices(ADJECTIVES + NOUNS, k=rng.randint(5, 40))).lower(),
+                    )
+
+        self.insert('reviews', ProductReview, reviews(), keep=False)
+
+    def generate_views(self, count, products, users):
+        rng = self.rng
+
+        def views():
+            remaining = count
+            while remaining > 0:
+                k = min(self.batch_size, remaining)
+                remaining -= k
+                viewers = self.popular(users['ids'], users['weights'], k)
+                for product_id, user_id in zip(self.popular(products['ids'], products['weights'], k), viewers):
+                    yield ProductViewLog(
+                        product_id=product_id, user_id=user_id if rng.random() < 0.3 else None,
+                        ip_address=f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}',
+                        viewed_at=self.recent(),
+                    )
+
+        self.insert('product views', ProductViewLog, views(), keep=False)
+
+    def generate_orders(self, count, products, users):
+        rng = self.rng
+        statuses, status_weights = zip(*ORDER_STATUS_WEIGHTS.items())
+        positions = range(len(products['ids']))
+        Link = Order.cart_items.through
+        orders_made = items_made = 0
+        started = time.perf_counter()
+
+        for first in range(0, count, self.batch_size):
+            orders, lines = [], []
+            for i in range(first, min(first + self.batch_size, count)):
+                ordered = rng.random() < 0.92  # The rest are open carts
+                created = self.past() if ordered else self.past(days=30)
+                session = f'{MARKER}session-{i}'
+                picks = dict.fromkeys(self.popular(positions, products['weights'], skewed_count(rng, ITEMS_PER_ORDER, 10)))
+                items = [
+                    CartItem(
+                        product_id=products['ids'][p], variant_id=products['variants'][p],
+                        quantity=1 if rng.random() < 0.8 else rng.randint(2, 3), session=session, ordered=ordered,
+                    )
+                    for p in picks
+                ]
+                total = sum(products['prices'][p] * item.quantity for p, item in zip(picks, items))
+                orders.append(Order(
+                    user_id=self.popular(users['ids'], users['weights'], 1)[0] if rng.random() < 0.8 else None,
+                    email=f'buyer{i}@example.com', order_number=f'{ORDER_MARKER}{i:09d}', session=session,
+                    ip_address=f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}',
+                    ordered=ordered, status=rng.choices(statuses, status_weights)[0] if ordered else 'P',
+                    payment_status='paid' if ordered else None, total=total, created_at=created,
+                    last_updated=created + timedelta(minutes=rng.uniform(1, 60)), ordered_at=created if ordered else None,
+                ))
+                lines.append(items)
+
+            with transaction.atomic():
+                orders = Order.objects.bulk_create(orders)
+                items = CartItem.objects.bulk_create([item for items in lines for item in items])
+                item_ids = iter(item.pk for item in items)
+                Link.objects.bulk_create([
+                    Link(order_id=order.pk, cartitem_id=next(item_ids)) for order, items in zip(orders, lines) for _ in items
+                ])
+            orders_made += len(orders)
+            items_made += len(items)
+
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(
+            f'{"orders":>22}: {orders_made:>11,} rows in {elapsed:7.1f}s ({orders_made / elapsed:>9,.0f}/s), '
+            f'with {items_made:,} cart items'
+        )
+
+    def flush(self):
+        """ Delete what earlier runs generated, leaves first so the large tables go in single statements """
+        products = Product.objects.filter(slug__startswith=MARKER)
+        orders = Order.objects.filter(order_number__startswith=ORDER_MARKER)
+        started = time.perf_counter()
+        with transaction.atomic():
+            for queryset in (
+                ProductViewLog.objects.filter(product__in=products),
+                ProductReview.objects.filter(product__in=products),
+                Order.cart_items.through.objects.filter(order__in=orders),
+                CartItem.objects.filter(session__startswith=MARKER),
+                orders,
+                ProductImage.objects.filter(product__in=products),
+                ProductVariant.objects.filter(product__in=products),
+                Product.categories.through.objects.filter(product__in=products),
+                products,
+                Subcategory.objects.filter(slug__startswith=MARKER),
+                Category.objects.filter(slug__startswith=MARKER),
+                User.objects.filter(username__startswith=MARKER),
+            ):
+                queryset.delete()
+        self.stdout.write(f'Deleted the previously generated data in {time.perf_counter() - started:.1f}s')
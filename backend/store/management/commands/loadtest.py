@@ -0,0 +1,433 @@
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+from uuid import uuid4
+
+import requests
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.urls import reverse
+
+from store.inventory import release_orders
+from store.models import CartItem, Category, Order, Product, ProductVariant
+
+JOURNEYS = {'browse': 45, 'search': 20, 'add_to_cart': 15, 'checkout': 10, 'order_history': 10}
+
+# A step's response counts as an error unless its status is one of these
+EXPECTED_STATUS = {'checkout.create': {303}}
+
+CUSTOMERS = 20  # Seeded users for the order history journey, each with ORDERS_PER_CUSTOMER past orders
+ORDERS_PER_CUSTOMER = 5
+SAMPLE_PRODUCTS = 10000  # Products the virtual users pick from, most popular first
+
+
+class UpstreamStubHandler(BaseHTTPRequestHandler):
+    """ Stands in for Stripe (Checkout Session create) and the Shopify Admin API """
+    delay = 0.1
+
+    def do_GET(self):
+        if self.path.split('?')[0].endswith('/products.json'):
+            return self.reply(200, {'products': []})
+        self.reply(404, {'error': {'message': f'No stub for GET {self.path}'}})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.delay)
+        if self.path == '/v1/checkout/sessions':
+            session_id = f'cs_loadtest_{uuid4().hex}'
+            return self.reply(200, {
+                'id': session_id, 'object': 'checkout.session', 'url': f'https://checkout.stripe.com/c/pay/{session_id}',
+            })
+        if self.path.endswith('/orders.json'):
+            return self.reply(201, {'order': {'id': int(time.time() * 1000)}})
+        self.reply(404, {'error': {'message': f'No stub for POST {self.path}'}})
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class VirtualUser:
+    """ One simulated shopper: a keep-alive HTTP session and its own seeded random stream """
+
+    def __init__(self, command, base_url, catalog, rng):
+        self.command = command
+        self.base_url = base_url
+        self.catalog = catalog
+        self.rng = rng
+        self.http = requests.Session()
+        self.samples = []
+
+    def step(self, name, method, url, session_key=None, **kwargs):
+        headers = {'X-Real-IP': '127.0.0.1'}
+        if session_key:
+            headers['Session-Key'] = session_key
+            headers['Cookie'] = f'{settings.SESSION_COOKIE_NAME}={session_key}'
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + url, headers=headers, allow_redirects=False,
+                                         timeout=30, **kwargs)
+            status = response.status_code
+        except requests.RequestException as e:
+            response, status = None, type(e).__name__
+        elapsed = time.perf_counter() - started
+        expected = EXPECTED_STATUS.get(name)
+        ok = status in expected if expected else isinstance(status, int) and status < 400
+        self.samples.append((name, started, elapsed, status, ok))
+        return response if ok else None
+
+    def product(self, in_stock=False):
+        products = 'in_stock' if in_stock else 'products'
+        return self.rng.choices(self.catalog[products], cum_weights=self.catalog[f'{products}_weights'])[0]
+
+    def browse(self):
+        self.step('browse.products', 'GET', reverse('store:active_products'))
+        category = self.rng.choices(self.catalog['categories'], cum_weights=self.catalog['category_weights'])[0]
+        self.step('browse.category', 'GET', reverse('store:category_products', kwargs={'slug': category}))
+        for _ in range(self.rng.randint(1, 3)):
+            self.step('product.detail', 'GET', reverse('store:product_detail', kwargs={'slug': self.product()}))
+
+    def search(self):
+        term = self.rng.choice(self.catalog['terms'])
+        response = self.step('search', 'GET', reverse('store:search'), params={'q': term})
+        results = response.json() if response is not None else None
+        if isinstance(results, dict):
+            results = results.get('results')
+        if results and isinstance(results[0], dict) and results[0].get('slug'):
+            self.step('product.detail', 'GET', reverse('store:product_detail', kwargs={'slug': results[0]['slug']}))
+
+    def add_to_cart(self, lines=None, in_stock=False):
+        session_key = self.command.new_session()
+        for _ in range(lines or self.rng.randint(1, 3)):
+            slug = self.product(in_stock)
+            self.step('product.detail', 'GET', reverse('store:product_detail', kwargs={'slug': slug}))
+            self.step('cart.add', 'POST', reverse('store:add_to_cart', kwargs={'slug': slug}), session_key)
+        return session_key
+
+    def checkout(self):
+        # Sold-out products are answered with a 409, which is right but not the path being measured
+        session_key = self.add_to_cart(lines=self.rng.randint(1, 2), in_stock=True)
+        self.step('checkout.view', 'GET', reverse('store:checkout_api'), session_key)
+        self.step('checkout.create', 'POST', reverse('store:checkout_api'), session_key)
+
+    def order_history(self):
+        session_key, order_numbers = self.rng.choice(self.catalog['customers'])
+        self.step('orders.list', 'GET', reverse('store:order_history'), session_key)
+        self.step('orders.detail', 'GET', reverse('store:order_detail', kwargs={
+            'order_number': self.rng.choice(order_numbers),
+        }), session_key)
+
+    def run(self, journeys, deadline, think):
+        names, weights = zip(*journeys.items())
+        try:
+            while time.perf_counter() < deadline:
+                journey = self.rng.choices(names, weights=weights)[0]
+                started = time.perf_counter()
+                getattr(self, journey)()
+                self.samples.append((f'journey.{journey}', started, time.perf_counter() - started, None, True))
+                if think:
+                    time.sleep(self.rng.expovariate(1 / think))
+        finally:
+            connection.close()  # new_session() ran queries on this thread
+
+
+class Command(BaseCommand):
+    help = (
+        'Run scripted browse, search, add-to-cart, checkout and order history journeys against a local server, '
+        'with Stripe and Shopify answered by local stubs, and report throughput and latency percentiles per step. '
+        'Results can be saved as JSON and compared with a baseline; regressions make the command fail.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', help='Server to test, which must use this database; by default runserver is started with the stubs wired in',
+        )
+        parser.add_argument('--users', type=int, default=16, help='Concurrent virtual users')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds of measured load')
+        parser.add_argument('--warmup', type=float, default=5, help='Seconds of load before measuring')
+        parser.add_argument('--think-ms', type=float, default=0, help='Mean pause between journeys')
+        parser.add_argument('--mix', help='Journey weights, e.g. browse=45,search=20,add_to_cart=15,checkout=10,order_history=10')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--stripe-delay', type=float, default=0.1, help='Stripe stub latency in seconds')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', help='Results JSON to compare with')
+        parser.add_argument('--compare', help='Compare this results JSON with --baseline instead of running')
+        parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative change before a regression')
+        parser.add_argument('--min-delta-ms', type=float, default=2, help='Ignore latency changes smaller than this')
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            if not options['baseline']:
+                raise CommandError('--compare needs --baseline')
+            return self.compare(self.load(options['compare']), self.load(options['baseline']), options)
+
+        journeys = self.parse_mix(options['mix'])
+        self.sessions, self.users = [], []  # Created for the run and deleted after it
+        upstream = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamStubHandler)
+        UpstreamStubHandler.delay = options['stripe_delay']
+        threading.Thread(target=upstream.serve_forever, daemon=True).start()
+        server = None
+        try:
+            catalog = self.seed(options['seed'])
+            base_url = options['url']
+            if not base_url:
+                server, base_url = self.start_server(f'http://127.0.0.1:{upstream.server_port}')
+            results = self.run(base_url, catalog, journeys, options)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+            upstream.shutdown()
+            self.clean_up()
+
+        results['meta'].update(url=options['url'] or 'runserver', mix=journeys, commit=self.git_commit())
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(f'Results written to {options["output"]}')
+        if options['baseline']:
+            self.compare(results, self.load(options['baseline']), options)
+
+    def parse_mix(self, mix):
+        if not mix:
+            return dict(JOURNEYS)
+        journeys = {}
+        for part in mix.split(','):
+            name, _, weight = part.partition('=')
+            if name not in JOURNEYS:
+                raise CommandError(f'Unknown journey {name!r}; choose from {", ".join(JOURNEYS)}')
+            journeys[name] = float(weight or 1)
+        return journeys
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read results from {path}: {e}')
+
+    def new_session(self):
+        """ An empty stored session, as the session service would hand out; its key is also the cart key """
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session.create()
+        self.sessions.append(session.session_key)
+        return session.session_key
+
+    def seed(self, seed):
+        """ What the virtual users pick from, with Zipf-like popularity, plus customers who have past orders """
+        products = list(Product.objects.filter(is_active=True).order_by('pk').values_list('slug', 'name')[:SAMPLE_PRODUCTS])
+        categories = list(Category.objects.order_by('pk').values_list('slug', flat=True))
+        if not products or not categories:
+            raise CommandError('No products or categories; run generate_catalog or load products first')
+        shuffled = random.Random(seed)
+        shuffled.shuffle(products)
+        shuffled.shuffle(categories)
+        stock = {}  # Checkout reserves a line's first variant; products without variants need no stock
+        for slug, quantity in ProductVariant.objects.order_by('pk').values_list('product__slug', 'inventory_quantity'):
+            stock.setdefault(slug, quantity)
+        in_stock = [slug for slug, _ in products if stock.get(slug, 1) > 0]
+        if not in_stock:
+            raise CommandError('Every product is out of stock, so no checkout can succeed')
+        terms = sorted({word for _, name in products for word in name.split() if len(word) > 3}) or [products[0][1]]
+        past_order_products = list(
+            Product.objects.filter(slug__in=[slug for slug, _ in products[:3]]).values_list('pk', flat=True)
+        )
+
+        run_id = uuid4().hex[:8]
+        customers = []
+        for i in range(CUSTOMERS):
+            user = User.objects.create_user(f'loadtest-{run_id}-{i}')
+            self.users.append(user)
+            order_numbers = []
+            for _ in range(ORDERS_PER_CUSTOMER):
+                order = Order.objects.create(user=user, ip_address='127.0.0.1', ordered=True)
+                order.cart_items.add(*CartItem.objects.bulk_create([
+                    CartItem(product_id=product_id, quantity=1, ordered=True) for product_id in past_order_products
+                ]))
+                order_numbers.append(order.order_number)
+            session = import_module(settings.SESSION_ENGINE).SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.create()
+            self.sessions.append(session.session_key)
+            customers.append((session.session_key, order_numbers))
+
+        return {
+            'products': [slug for slug, _ in products],
+            'products_weights': list(itertools.accumulate(1 / rank for rank in range(1, len(products) + 1))),
+            'in_stock': in_stock,
+            'in_stock_weights': list(itertools.accumulate(1 / rank for rank in range(1, len(in_stock) + 1))),
+            'categories': categories,
+            'category_weights': list(itertools.accumulate(1 / rank for rank in range(1, len(categories) + 1))),
+            'terms': terms,
+            'customers': customers,
+        }
+
+    def clean_up(self):
+        orders = Order.objects.filter(session__in=self.sessions) | Order.objects.filter(user__in=self.users)
+        release_orders(orders)  # Give held stock back to the variants
+        CartItem.objects.filter(orders__in=orders).delete()
+        CartItem.objects.filter(session__in=self.sessions).delete()
+        orders.delete()
+        User.objects.filter(pk__in=[user.pk for user in self.users]).delete()
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        if hasattr(store, 'get_model_class'):  # Database-backed sessions
+            store.get_model_class().objects.filter(session_key__in=self.sessions).delete()
+        else:
+            for session_key in self.sessions:
+                store().delete(session_key)
+
+    def start_server(self, stub_url):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        env = {
+            **os.environ,
+            'STRIPE_API_BASE': stub_url,
+            'STRIPE_SECRET_KEY': 'sk_test_loadtest',
+            'SHOPIFY_API_BASE': f'{stub_url}/{{shop}}/admin/api/2024-07',
+            'PYTHONPATH': os.pathsep.join(path for path in sys.path if path),
+        }
+        log = tempfile.TemporaryFile(mode='w+')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'django', 'runserver', f'127.0.0.1:{port}', '--noreload'],
+            env=env, stdout=subprocess.DEVNULL, stderr=log,
+        )
+        base_url = f'http://127.0.0.1:{port}'
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            if server.poll() is not None:
+                log.seek(0)
+                raise CommandError(f'The server exited:\n{log.read().strip()}')
+            try:
+                requests.get(base_url + reverse('store:navbar-data'), timeout=1)
+                return server, base_url
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError('The server did not start within 30 seconds')
+
+    def run(self, base_url, catalog, journeys, options):
+        users = [
+            VirtualUser(self, base_url, catalog, random.Random(options['seed'] * 100003 + i))
+            for i in range(options['users'])
+        ]
+        started = time.perf_counter()
+        measure_from = started + options['warmup']
+        deadline = measure_from + options['duration']
+        threads = [
+            threading.Thread(target=user.run, args=(journeys, deadline, options['think_ms'] / 1000)) for user in users
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - measure_from
+
+        by_step = {}
+        for user in users:
+            for name, step_started, seconds, status, ok in user.samples:
+                if step_started >= measure_from:
+                    by_step.setdefault(name, []).append((seconds, status, ok))
+        return {
+            'meta': {
+                'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'users': options['users'], 'duration': elapsed, 'warmup': options['warmup'],
+                'think_ms': options['think_ms'], 'seed': options['seed'], 'stripe_delay': options['stripe_delay'],
+            },
+            'steps': {name: self.summarize(samples, elapsed) for name, samples in sorted(by_step.items())},
+        }
+
+    def summarize(self, samples, elapsed):
+        latencies = sorted(seconds * 1000 for seconds, _, _ in samples)
+
+        def percentile(p):
+            return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)], 2)
+
+        statuses = {}
+        for _, status, _ in samples:
+            if status is not None:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'count': len(samples),
+            'errors': sum(1 for _, _, ok in samples if not ok),
+            'per_second': round(len(samples) / elapsed, 2),
+            'p50_ms': percentile(0.50), 'p95_ms': percentile(0.95), 'p99_ms': percentile(0.99),
+            'max_ms': round(latencies[-1], 2),
+            'statuses': statuses,
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"step":<24} {"count":>7} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+        for name, step in results['steps'].items():
+            line = (
+                f'{name:<24} {step["count"]:>7} {step["per_second"]:>8.1f} {step["p50_ms"]:>8.1f} '
+                f'{step["p95_ms"]:>8.1f} {step["p99_ms"]:>8.1f} {step["errors"]:>7}'
+            )
+            self.stdout.write(self.style.ERROR(line) if step['errors'] else line)
+
+    def compare(self, results, baseline, options):
+        tolerance, min_delta = options['tolerance'], options['min_delta_ms']
+        regressions = []
+        self.stdout.write(f'Compared with the baseline from {baseline["meta"].get("started_at")} '
+                          f'(commit {baseline["meta"].get("commit") or "unknown"}):')
+        differs = [key for key in ('users', 'mix', 'think_ms', 'stripe_delay', 'url')
+                   if results['meta'].get(key) != baseline['meta'].get(key)]
+        if differs:
+            self.stdout.write(self.style.WARNING(f'  The runs differ in {", ".join(differs)}; expect differences'))
+        for name, step in results['steps'].items():
+            base = baseline['steps'].get(name)
+            if base is None:
+                self.stdout.write(f'  {name:<24} new step')
+                continue
+            problems = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+                if step[key] - base[key] > max(base[key] * tolerance, min_delta):
+                    problems.append(f'{key[:3]} {base[key]:.1f} -> {step[key]:.1f} ms')
+            if step['per_second'] < base['per_second'] * (1 - tolerance):
+                problems.append(f'req/s {base["per_second"]:.1f} -> {step["per_second"]:.1f}')
+            error_rate, base_error_rate = step['errors'] / step['count'], base['errors'] / max(base['count'], 1)
+            if error_rate - base_error_rate > 0.01:
+                problems.append(f'errors {base_error_rate:.1%} -> {error_rate:.1%}')
+            if problems:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(f'  {name:<24} REGRESSION: {"; ".join(problems)}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f'  {name:<24} ok (p95 {base["p95_ms"]:.1f} -> {step["p95_ms"]:.1f} ms, '
+                    f'req/s {base["per_second"]:.1f} -> {step["per_second"]:.1f})'
+                ))
+        for name in sorted(set(baseline['steps']) - set(results['steps'])):
+            self.stdout.write(f'  {name:<24} missing from this run')
+        if regressions:
+            raise CommandError(f'{len(regressions)} step(s) regressed: {", ".join(regressions)}')
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+            ).stdout.strip() or None
+        except OSError:
+            return None
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.profiler import make_profile_token
+
+
+class Command(BaseCommand):
+    help = 'Print a token that makes requests carrying it in an X-Profile-Token header get profiled'
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_profile_token())
+        self.stderr.write(
+            f'Valid for {settings.PROFILE_TOKEN_MAX_AGE}s, e.g. curl -H "X-Profile-Token: <token>" <url>; '
+            'profiles are listed under Request profiles in the admin'
+        )
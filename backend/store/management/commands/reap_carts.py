@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from store.cleanup import REAP_BATCH_SIZE, reap_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = 'Delete (or archive and delete) abandoned carts: unordered orders and their cart items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=30, help='Minimum age since the cart was last touched')
+        parser.add_argument('--batch-size', type=int, default=REAP_BATCH_SIZE, help='Orders per transaction')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep between batches')
+        parser.add_argument('--archive', default=None, help='Append reaped orders to this JSON lines file')
+
+    def handle(self, *args, **options):
+        reap = dict(
+            max_age=timedelta(days=options['days']),
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            pause=options['pause'],
+        )
+        if options['archive']:
+            with open(options['archive'], 'a') as archive:
+                stats = reap_abandoned_carts(archive=archive, **reap)
+        else:
+            stats = reap_abandoned_carts(**reap)
+
+        rows = stats['orders'] + stats['cart_items'] + stats['links']
+        rate = rows / stats['seconds'] if stats['seconds'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Reaped {stats['orders']} orders, {stats['cart_items']} cart items and {stats['links']} links "
+            f"in {stats['batches']} batches ({stats['seconds']:.2f}s, {rate:.0f} rows/sec)"
+        ))
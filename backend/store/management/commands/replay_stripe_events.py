@@ -0,0 +1,21 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from store.payments import process_events
+
+
+class Command(BaseCommand):
+    help = 'Apply recorded Stripe webhook events (a JSON list) without signature verification'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='JSON files holding a list of Stripe events')
+
+    def handle(self, *args, **options):
+        events = []
+        for path in options['paths']:
+            with open(path) as fh:
+                events.extend(json.load(fh))
+
+        applied = process_events(events)
+        self.stdout.write(self.style.SUCCESS(f'Applied {applied} of {len(events)} events'))
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.popularity import rollup_popular_products
+
+
+class Command(BaseCommand):
+    help = 'Fold activity since the last run into PopularProduct (schedule every few minutes)'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        touched = rollup_popular_products()
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated popularity of {touched} products in {time.perf_counter() - started:.2f}s'
+        ))
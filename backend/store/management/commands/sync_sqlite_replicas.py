@@ -0,0 +1,55 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database into each SQLite replica in DATABASE_REPLICAS, so replica routing '
+        'can be exercised locally (run again, or with --every, to simulate replication)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=None, help='Keep copying every this many seconds')
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('The primary is not SQLite; replicas are kept in sync by the database')
+        replicas = [
+            alias for alias in settings.DATABASE_REPLICA_ALIASES
+            if settings.DATABASES[alias]['ENGINE'] == 'django.db.backends.sqlite3'
+        ]
+        if not replicas:
+            raise CommandError('No SQLite replicas configured; set DATABASE_REPLICAS=path1.sqlite3,path2.sqlite3')
+
+        while True:
+            started = time.perf_counter()
+            copied = 0
+            for alias in replicas:
+                try:
+                    self.copy(primary['NAME'], alias)
+                    copied += 1
+                except sqlite3.Error as e:
+                    self.stderr.write(f'{alias}: {e}')
+            self.stdout.write(self.style.SUCCESS(
+                f'Copied the primary to {copied} of {len(replicas)} replicas in {time.perf_counter() - started:.2f}s'
+            ))
+            if options['every'] is None:
+                return
+            time.sleep(options['every'])
+
+    def copy(self, source_path, alias):
+        connections[alias].close()  # Do not copy under an open handle of our own
+        source = sqlite3.connect(source_path)
+        try:
+            target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
@@ -0,0 +1,119 @@
+"""
+Prometheus metrics for views, the database, caches, Shopify syncs and
+upstream calls, served at /metrics.
+
+prometheus_client is optional; without it every recording helper is a no-op
+and /metrics returns 503. Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an
+empty directory before the workers start. Each worker then writes its
+samples to mmap'd files there, and /metrics aggregates them across workers.
+Call mark_process_dead(worker.pid) from gunicorn's child_exit hook.
+
+Recording a sample is a label lookup and an in-memory (or mmap) add: a few
+microseconds on the request path.
+"""
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Histogram, multiprocess
+except ImportError:
+    prometheus_client = None
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SYNC_BUCKETS = (.1, .5, 1, 5, 10, 30, 60, 120, 300, 600)
+
+if prometheus_client is not None:
+    REQUEST_SECONDS = Histogram(
+        'store_http_request_duration_seconds', 'Request latency by URL name, method and status',
+        ['view', 'method', 'status'], buckets=LATENCY_BUCKETS,
+    )
+    DB_QUERIES = Counter('store_db_queries', 'SQL queries run by requests, by URL name', ['view'])
+    DB_SECONDS = Counter('store_db_query_seconds', 'Time spent in SQL queries by requests, by URL name', ['view'])
+    CACHE_LOOKUPS = Counter('store_cache_lookups', 'Cache lookups by cache and result (hit or miss)', ['cache', 'result'])
+    UPSTREAM_SECONDS = Histogram(
+        'store_upstream_request_duration_seconds', 'Calls to Stripe and Shopify by operation and outcome',
+        ['service', 'operation', 'outcome'], buckets=LATENCY_BUCKETS,
+    )
+    SYNC_STAGE_SECONDS = Histogram(
+        'store_sync_stage_duration_seconds', 'Time spent in each stage of a sync run', ['source', 'stage'],
+        buckets=SYNC_BUCKETS,
+    )
+    SYNC_STAGE_ROWS = Counter('store_sync_stage_rows', 'Rows handled by each stage of a sync run', ['source', 'stage'])
+
+
+def observe_request(view, method, status, seconds, stats=None):
+    if prometheus_client is None:
+        return
+    REQUEST_SECONDS.labels(view, method, status).observe(seconds)
+    if stats is not None and stats.count:
+        DB_QUERIES.labels(view).inc(stats.count)
+        DB_SECONDS.labels(view).inc(stats.duration)
+
+
+def count_cache(cache, hits=0, misses=0):
+    if prometheus_client is None:
+        return
+    if hits:
+        CACHE_LOOKUPS.labels(cache, 'hit').inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(cache, 'miss').inc(misses)
+
+
+@contextmanager
+def track_upstream(service, operation):
+    """ Time a call to Stripe or Shopify (also around an await); outcome is "error" if it raises """
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        if prometheus_client is not None:
+            UPSTREAM_SECONDS.labels(service, operation, outcome).observe(time.perf_counter() - started)
+
+
+class SyncRun:
+    """
+    Per-stage time and row counts of one sync. Stages may be entered many
+    times (once per product, say); totals are recorded once, by record().
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.seconds = defaultdict(float)
+        self.rows = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - started
+            self.rows[name] += rows
+
+    def record(self):
+        if prometheus_client is None:
+            return
+        for name, seconds in self.seconds.items():
+            SYNC_STAGE_SECONDS.labels(self.source, name).observe(seconds)
+            if self.rows[name]:
+                SYNC_STAGE_ROWS.labels(self.source, name).inc(self.rows[name])
+
+
+def render():
+    """ (body, content type) of the exposition; aggregates worker files in multiprocess mode """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    if prometheus_client is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,365 @@
+"""
+Store middleware.
+"""
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+from . import logs, metrics, profiler, routers
+from .queries import collect_queries, query_budget_of, warn_over_budget
+from .responsecache import response_cache
+from .viewlog import arecord_view, record_view
+
+
+def resolver_match(request):
+    """ The request's ResolverMatch, also for responses made before URL resolution, e.g. cache hits; None if unrouted """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return None
+    return match
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Scope database routing (see routers.py) to the request. Reads go to a
+    replica only inside views marked use_replica. After a request writes, the
+    client gets a cookie that keeps its reads on the primary for
+    REPLICA_PIN_SECONDS. Goes first in MIDDLEWARE so session and auth reads
+    are routed too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = routers.begin_request(pinned=self.is_pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            state = routers.end_request(token)
+        return self.pin(response, state)
+
+    async def __acall__(self, request):
+        token = routers.begin_request(pinned=self.is_pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            state = routers.end_request(token)
+        return self.pin(response, state)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = routers.current_state()
+        if state is not None:
+            state.use_replica = routers.view_uses_replica(view_func)
+
+    def is_pinned(self, request):
+        try:
+            return float(request.COOKIES.get(routers.PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def pin(self, response, state):
+        if state.wrote and routers.replica_aliases():
+            seconds = settings.REPLICA_PIN_SECONDS
+            response.set_cookie(
+                routers.PIN_COOKIE, str(int(time.time()) + seconds), max_age=seconds, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Record each request's latency and SQL query count and time, labelled with
+    its URL name (see metrics.py). Unrouted requests share one label so
+    scanners cannot blow up the label set. Goes before ResponseCacheMiddleware
+    so cache hits are timed too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if metrics.prometheus_client is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with collect_queries() as stats:
+            response = self.get_response(request)
+        self.observe(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with collect_queries() as stats:
+            response = await self.get_response(request)
+        self.observe(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, response, stats, elapsed):
+        metrics.observe_request(self.view_name(request), request.method, str(response.status_code), elapsed, stats)
+
+    def view_name(self, request):
+        match = resolver_match(request)
+        return match.view_name if match is not None else '<unmatched>'
+
+
+class AccessLogMiddleware:
+    """
+    Log one line per request to the "store.access" logger, with its method,
+    path, status, duration, URL name, client IP and user. Successful requests
+    are sampled by their view's access_log_sample_rate (see logs.py); errors
+    and requests over ACCESS_LOG_SLOW_MS always go in.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.log(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.log(request, response, time.perf_counter() - started)
+        return response
+
+    def log(self, request, response, elapsed):
+        duration_ms = elapsed * 1000
+        match = resolver_match(request)
+        if response.status_code >= 400 or duration_ms >= settings.ACCESS_LOG_SLOW_MS:
+            rate = 1.0
+        else:
+            rate = logs.sample_rate_of(match.func) if match is not None else 1.0
+            if rate < 1.0 and random.random() >= rate:
+                return
+        # Only if the request already loaded the user; never a query just to log
+        user = getattr(request, '_cached_user', None) or getattr(request, '_acached_user', None)
+        logs.access_logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2),
+            'view': match.view_name if match is not None else None,
+            'ip': request.META.get('HTTP_X_REAL_IP') or request.META.get('REMOTE_ADDR'),
+            'user_id': user.pk if user is not None else None,
+            'sample_rate': rate,
+        })
+
+
+class ProfilerMiddleware:
+    """
+    Profile requests that ask for it (see profiler.py) and point to the saved
+    RequestProfile in an X-Profile-Id header. Goes after
+    AuthenticationMiddleware, which the staff-only query flag needs.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if profiler.PROFILE_HEADER not in request.META and profiler.PROFILE_PARAM not in request.GET:
+            return self.get_response(request)
+        if not profiler.wants_profile(request, request.user):
+            return self.get_response(request)
+
+        request.profiled = True
+        started = time.perf_counter()
+        sampler = profiler.start_sampler()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+        profile = profiler.save_profile(request, response, sampler, time.perf_counter() - started, request.user)
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
+
+    async def __acall__(self, request):
+        if profiler.PROFILE_HEADER not in request.META and profiler.PROFILE_PARAM not in request.GET:
+            return await self.get_response(request)
+        user = await request.auser()
+        if not profiler.wants_profile(request, user):
+            return await self.get_response(request)
+
+        request.profiled = True
+        started = time.perf_counter()
+        sampler = profiler.start_sampler(skip_caller_frames=False)
+        try:
+            response = await self.get_response(request)
+        finally:
+            sampler.stop()
+        profile = await sync_to_async(profiler.save_profile)(
+            request, response, sampler, time.perf_counter() - started, user,
+        )
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Count each request's SQL queries, their total time and repeated statements
+    (see queries.py), and report them in a Server-Timing header. Requests over
+    their view's query_budget are logged with the most repeated statements.
+    Only installed when QUERY_INSTRUMENTATION is on.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with collect_queries() as stats:
+            response = self.get_response(request)
+        return self.report(request, response, stats, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with collect_queries() as stats:
+            response = await self.get_response(request)
+        return self.report(request, response, stats, time.perf_counter() - started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = query_budget_of(view_func)
+
+    def report(self, request, response, stats, elapsed):
+        request.query_stats = stats
+        if not getattr(request, 'profiled', False):  # Saving the profile adds queries
+            warn_over_budget(request, stats, getattr(request, 'query_budget', None))
+        timing = (
+            f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries, {stats.duplicates} duplicate", '
+            f'app;dur={elapsed * 1000:.2f}'
+        )
+        response['Server-Timing'] = f"{response['Server-Timing']}, {timing}" if response.has_header('Server-Timing') else timing
+        return response
+
+
+class ResponseCacheMiddleware:
+    """
+    Serve anonymous GETs of views using SurrogateKeyMixin from the response
+    cache (see responsecache.py). Must come after AuthenticationMiddleware.
+    Product page views are still logged on hits. Runs natively under both
+    WSGI and ASGI, so it does not force async views onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.is_cacheable(request, request.user):
+            return self.get_response(request)
+
+        entry = response_cache.get(request)
+        if entry is not None:
+            if entry.get('product_id'):
+                record_view(request, entry['product_id'])
+            return self.cached_response(entry)
+
+        response = self.get_response(request)
+        keys = self.keys_to_store(response)
+        if keys is not None:
+            response_cache.set(
+                request, response, keys, replica_read=self.read_replica(),
+                product_id=getattr(response, 'viewed_product_id', None),
+            )
+        return self.tag(response, keys)
+
+    async def __acall__(self, request):
+        if not self.is_cacheable(request, await request.auser()):
+            return await self.get_response(request)
+
+        entry = await response_cache.aget(request)
+        if entry is not None:
+            if entry.get('product_id'):
+                await arecord_view(request, entry['product_id'])
+            return self.cached_response(entry)
+
+        response = await self.get_response(request)
+        keys = self.keys_to_store(response)
+        if keys is not None:
+            await response_cache.aset(
+                request, response, keys, replica_read=self.read_replica(),
+                product_id=getattr(response, 'viewed_product_id', None),
+            )
+        return self.tag(response, keys)
+
+    def is_cacheable(self, request, user):
+        if getattr(request, 'profiled', False):
+            return False  # Profile the view, not a cache hit
+        return request.method == 'GET' and 'HTTP_AUTHORIZATION' not in request.META and not user.is_authenticated
+
+    def read_replica(self):
+        state = routers.current_state()
+        return state is not None and state.read_replica
+
+    def keys_to_store(self, response):
+        keys = getattr(response, 'surrogate_keys', None)
+        if keys is not None and response.status_code == 200 and not response.streaming and not response.cookies:
+            return sorted(set(keys))
+        return None
+
+    def cached_response(self, entry):
+        response = HttpResponse(entry['content'], status=entry['status'])
+        for name, value in entry['headers'].items():
+            response[name] = value
+        response['Surrogate-Key'] = ' '.join(entry['versions'])
+        response['X-Cache'] = 'HIT'
+        return response
+
+    def tag(self, response, keys):
+        if keys is not None:
+            response['Surrogate-Key'] = ' '.join(keys)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,360 @@
+# Generated by Django 5.1 on 2026-10-19 12:47
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('slug', models.SlugField(help_text='URL-friendly version of the category name', unique=True)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('meta_keywords', models.CharField(blank=True, help_text='SEO keywords for meta tag', max_length=255, verbose_name='Meta Keywords')),
+                ('meta_description', models.CharField(blank=True, help_text='Content for description meta tag', max_length=255, verbose_name='Meta Description')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Coupon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50, unique=True)),
+                ('description', models.CharField(max_length=100)),
+                ('discount', models.FloatField(validators=[django.core.validators.MinValueValidator(0)])),
+                ('expiration_date', models.DateTimeField()),
+                ('is_approved', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'Coupon',
+                'verbose_name_plural': 'Coupons',
+                'ordering': ['-expiration_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_cart_item_id', models.BigIntegerField(default=0)),
+                ('last_view_log_id', models.BigIntegerField(default=0)),
+                ('last_ordered_at', models.DateTimeField(blank=True, null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('event_type', models.CharField(max_length=100)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-received_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Cart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='carts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CartItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=1)),
+                ('session', models.CharField(blank=True, default='', max_length=50)),
+                ('ordered', models.BooleanField(default=False)),
+                ('cart', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='store.cart')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, null=True)),
+                ('phone_number', models.CharField(blank=True, max_length=20, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('C', 'Confirmed'), ('S', 'Shipped'), ('D', 'Delivered'), ('R', 'Returned')], default='P', max_length=1)),
+                ('total', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('ip_address', models.GenericIPAddressField()),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('ordered', models.BooleanField(default=False)),
+                ('order_number', models.CharField(blank=True, max_length=50, null=True, unique=True)),
+                ('tracking_number', models.CharField(blank=True, max_length=50, null=True, unique=True)),
+                ('session', models.CharField(blank=True, default='', max_length=50)),
+                ('payment_status', models.CharField(max_length=50, null=True)),
+                ('customer_id', models.CharField(max_length=50, null=True)),
+                ('transaction_id', models.CharField(max_length=50, null=True)),
+                ('customer_name', models.CharField(max_length=50, null=True)),
+                ('shipping_name', models.CharField(max_length=50, null=True)),
+                ('address_line_1', models.CharField(max_length=255, null=True)),
+                ('address_line_2', models.CharField(blank=True, max_length=255, null=True)),
+                ('city', models.CharField(max_length=55, null=True)),
+                ('state', models.CharField(max_length=55, null=True)),
+                ('country', models.CharField(max_length=55, null=True)),
+                ('postal_code', models.CharField(max_length=20, null=True)),
+                ('amount_discount', models.DecimalField(blank=True, decimal_places=2, default=0.0, max_digits=10, null=True)),
+                ('amount_shipping', models.DecimalField(blank=True, decimal_places=2, default=0.0, max_digits=10, null=True)),
+                ('amount_tax', models.DecimalField(blank=True, decimal_places=2, default=0.0, max_digits=10, null=True)),
+                ('stripe_session_id', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('ordered_at', models.DateTimeField(blank=True, null=True)),
+                ('cart_items', models.ManyToManyField(related_name='orders', to='store.cartitem')),
+                ('coupon', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='store.coupon')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Order',
+                'verbose_name_plural': 'Orders',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shopify_id', models.CharField(max_length=50, null=True, unique=True)),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('slug', models.SlugField(help_text='Slug value for the product URL', max_length=100, unique=True)),
+                ('vendor', models.CharField(blank=True, max_length=100)),
+                ('description', models.TextField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('discount_price', models.DecimalField(blank=True, decimal_places=2, default=0.0, max_digits=10, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('is_featured', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('meta_description', models.CharField(blank=True, help_text='Meta tag description', max_length=255)),
+                ('meta_keywords', models.CharField(blank=True, help_text='SEO keywords separated by commas', max_length=255)),
+                ('categories', models.ManyToManyField(blank=True, related_name='products', to='store.category')),
+            ],
+            options={
+                'verbose_name_plural': 'products',
+                'db_table': 'products',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PopularProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(choices=[('24h', 'Last 24 hours'), ('7d', 'Last 7 days'), ('30d', 'Last 30 days')], default='7d', max_length=3, verbose_name='Window')),
+                ('cart_count', models.PositiveIntegerField(default=0, null=True, verbose_name='Cart Count')),
+                ('buys_count', models.PositiveIntegerField(default=0, null=True, verbose_name='Buys Count')),
+                ('view_count', models.PositiveIntegerField(default=0, verbose_name='View Count')),
+                ('score', models.FloatField(default=0, verbose_name='Score')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.product')),
+            ],
+            options={
+                'verbose_name': 'Popular Product',
+                'verbose_name_plural': 'Popular Products',
+            },
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='product',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='store.product'),
+        ),
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='store.product')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product')),
+            ],
+            options={
+                'ordering': ['product', 'rank'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductReview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('rating', models.PositiveSmallIntegerField(choices=[(5, 'Excellent'), (4, 'Good'), (3, 'Average'), (2, 'Poor'), (1, 'Terrible')], default=5)),
+                ('is_approved', models.BooleanField(default=True)),
+                ('content', models.TextField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to='store.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Product Review',
+                'verbose_name_plural': 'Product Reviews',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variant_id', models.CharField(max_length=50, unique=True)),
+                ('title', models.CharField(max_length=100)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('compare_at_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('inventory_quantity', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='store.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image_url', models.URLField(max_length=500)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='store.product')),
+                ('variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='images', to='store.productvariant')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InventoryReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('H', 'Held'), ('C', 'Committed'), ('R', 'Released')], default='H', max_length=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.order')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.productvariant')),
+            ],
+            options={
+                'ordering': ['expires_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='variant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='store.productvariant'),
+        ),
+        migrations.CreateModel(
+            name='ProductViewLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('viewed_at', models.DateTimeField(auto_now_add=True)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('tracking_id', models.CharField(blank=True, default='', max_length=50)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_logs', to='store.product')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='view_logs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Product View Logs',
+                'ordering': ['-viewed_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Refund',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('refund_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('reason_for_refund', models.CharField(max_length=255)),
+                ('refund_date', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.order')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Return',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('return_date', models.DateTimeField(auto_now_add=True)),
+                ('reason_for_return', models.CharField(max_length=255)),
+                ('notes', models.TextField(blank=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.order')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=255)),
+                ('search_date', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-search_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StripeCharge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_charge_id', models.CharField(max_length=255)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('currency', models.CharField(max_length=10)),
+                ('description', models.TextField()),
+                ('paid', models.BooleanField(default=False)),
+                ('status', models.CharField(max_length=255)),
+                ('details', models.CharField(max_length=255)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='charges', to='store.order')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Subcategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('slug', models.SlugField(help_text='URL-friendly version of the subcategory name', unique=True)),
+                ('description', models.TextField()),
+                ('is_active', models.BooleanField(default=True)),
+                ('meta_keywords', models.CharField(help_text='SEO keywords for meta tag', max_length=255, verbose_name='Meta Keywords')),
+                ('meta_description', models.CharField(help_text='Content for description meta tag', max_length=255, verbose_name='Meta Description')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subcategories', to='store.category')),
+            ],
+            options={
+                'verbose_name_plural': 'Subcategories',
+                'db_table': 'subcategories',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserProfile',
+            fields=[
+                ('email', models.EmailField(max_length=254, null=True, unique=True)),
+                ('id', models.IntegerField(default=0, primary_key=True, serialize=False)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('ordered', False)), fields=['last_updated'], name='order_abandoned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='popularproduct',
+            index=models.Index(fields=['window', '-score'], name='popular_window_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='popularproduct',
+            constraint=models.UniqueConstraint(fields=('product', 'window'), name='popular_product_window_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='productrecommendation',
+            constraint=models.UniqueConstraint(fields=('product', 'rank'), name='recommendation_product_rank_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='inventoryreservation',
+            index=models.Index(fields=['status', 'expires_at'], name='reservation_status_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1 on 2026-10-19 12:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(condition=models.Q(('ordered', False)), fields=['session', 'product'], name='cartitem_open_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('ordered', False)), fields=['session'], name='order_open_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at'], name='product_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_featured', True)), fields=['is_active', '-created_at'], name='product_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productreview',
+            index=models.Index(condition=models.Q(('is_approved', True)), fields=['product', '-date'], name='review_product_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productviewlog',
+            index=models.Index(fields=['product', '-viewed_at'], name='viewlog_product_viewed_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-19 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='popularproduct',
+            name='window',
+            field=models.CharField(choices=[('24h', 'Decaying over 24 hours'), ('7d', 'Decaying over 7 days'), ('30d', 'Decaying over 30 days')], default='7d', max_length=3, verbose_name='Window'),
+        ),
+    ]
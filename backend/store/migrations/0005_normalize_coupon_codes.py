@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def normalize_codes(apps, schema_editor):
+    """
+    Coupon.save() stores codes stripped and upper-cased, and lookups only
+    match that form. A code that would collide with one already in that form
+    is left as it was: the unique index allows only one of them.
+    """
+    Coupon = apps.get_model('store', 'Coupon')
+    taken = set(Coupon.objects.values_list('code', flat=True))
+    for coupon in Coupon.objects.order_by('pk').only('code'):
+        code = coupon.code.strip().upper()
+        if code != coupon.code and code not in taken:
+            taken.discard(coupon.code)
+            taken.add(code)
+            coupon.code = code
+            coupon.save(update_fields=['code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_popular_window_labels'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_codes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-19 13:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_normalize_coupon_codes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupcheckpoint',
+            name='seen_cart_item_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='rollupcheckpoint',
+            name='seen_view_log_id',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -6,6 +6,7 @@ from django.core.validators import MinValueValidator
 from django.utils.translation import gettext_lazy as gl
 from django.utils import timezone
 from datetime import datetime
+from decimal import Decimal
 import uuid
 
 
@@ -43,6 +44,9 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    def get_absolute_url(self):
+        return reverse("store:category_products", kwargs={'slug': self.slug})
+
     objects = StoreManager()
 
 ###################################################
@@ -67,7 +71,7 @@ class Subcategory(models.Model):
         return self.name
 
     def get_absolute_url(self):
-        return reverse("store:subcategory_list", kwargs={'slug': self.slug})
+        return reverse("store:subcategory_detail", kwargs={'category_slug': self.category.slug, 'slug': self.slug})
 
     class Meta:
         db_table = 'subcategories'
@@ -102,27 +106,24 @@ class Product(models.Model):
         db_table = 'products'
         ordering = ['-created_at']
         verbose_name_plural = 'products'
-
-    def __str__(self):
-        return f"{self.quantity} of {self.name}"
+        indexes = [
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='product_active_created_idx'),  # Catalog listing
+            models.Index(fields=['is_active', '-created_at'], condition=models.Q(is_featured=True), name='product_featured_idx'),  # Featured sections
+        ]
 
     def get_absolute_url(self):
         return reverse("store:product_detail", kwargs={'slug': self.slug})
 
     def sale_price(self):
-        if self.discount_price > 0.00 and self.price > self.discount_price:
+        # A missing (None) or zero discount means no sale
+        if self.discount_price and self.price > self.discount_price > 0:
             return self.discount_price
         return self.price #return None
 
     def unit_amount(self):
         return int(str(self.sale_price()).replace('.', ''))
 
-    def generate_sku(self):
-        return str(uuid.uuid4().hex)[:10]
-
     def save(self, *args, **kwargs):
-        if not self.sku:
-            self.sku = self.generate_sku()
         self.meta_keywords = ','.join(self.name.split()) # Set the meta_keywords field to a comma-separated string of words in the product name
         self.meta_description = ','.join(self.name.split()) # Set the meta_keywords field to a comma-separated string of words in the product name
         super().save(*args, **kwargs) # Call the superclass save method to save the model instance
@@ -152,6 +153,23 @@ class ProductImage(models.Model):
         return self.image_url
 
 
+class ProductRecommendation(models.Model):
+    """ Precomputed "frequently bought together" neighbour, see store/recommendations.py """
+    product = models.ForeignKey(Product, related_name='recommendations', on_delete=models.CASCADE)
+    recommended = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()  # 1 is the strongest neighbour
+    score = models.FloatField()  # Lift or cosine similarity
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='recommendation_product_rank_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} (#{self.rank})"
+
+
 ###################################################
 #               Product Review                    #
 ###################################################
@@ -175,6 +193,9 @@ class ProductReview(models.Model):
         verbose_name = 'Product Review'
         verbose_name_plural = 'Product Reviews'
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['product', '-date'], condition=models.Q(is_approved=True), name='review_product_approved_idx'),  # Reviews on a product page
+        ]
 
     def __str__(self):
         return f'Review by {self.user.username} on {self.product.name}'
@@ -193,6 +214,9 @@ class ProductViewLog(models.Model):
     class Meta:
         ordering = ['-viewed_at']
         verbose_name_plural = 'Product View Logs'
+        indexes = [
+            models.Index(fields=['product', '-viewed_at'], name='viewlog_product_viewed_idx'),  # Views of a product over time
+        ]
 
     def __str__(self):
         return f'{self.user.username if self.user else "Anonymous"} viewed {self.product.name}'
@@ -215,7 +239,11 @@ class Coupon(models.Model):
 
     def __str__(self):
         return self.code
-    
+
+    def save(self, *args, **kwargs):
+        self.code = self.code.strip().upper()  # Codes are matched case-insensitively through an exact index lookup
+        super().save(*args, **kwargs)
+
 ###################################################
 #               Cart                              #
 ###################################################
@@ -237,10 +265,16 @@ class Cart(models.Model):
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart,null=True, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    variant = models.ForeignKey(ProductVariant, on_delete=models.SET_NULL, null=True, blank=True)  # Defaults to the product's first variant
     quantity = models.IntegerField(default=1)
     session = models.CharField(max_length=50, default='', blank=True)
     ordered = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'product'], condition=models.Q(ordered=False), name='cartitem_open_session_idx'),  # Add to cart
+        ]
+
     def __str__(self):
         return f'{self.product.name} ({self.quantity})'
 
@@ -303,20 +337,30 @@ class Order(models.Model):
     amount_discount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, default=0.00)
     amount_shipping = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, default=0.00)
     amount_tax = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, default=0.00)
+    stripe_session_id = models.CharField(max_length=255, unique=True, blank=True, null=True)  # Stripe Checkout Session ID
+    ordered_at = models.DateTimeField(blank=True, null=True)  # Set when Stripe confirms the payment
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_idx'),  # Order history keyset
+            models.Index(fields=['last_updated'], condition=models.Q(ordered=False), name='order_abandoned_idx'),  # Cart reaper
+            models.Index(fields=['session'], condition=models.Q(ordered=False), name='order_open_session_idx'),  # The session's open cart
+        ]
 
     def __str__(self):
         return f'Order {self.pk}'
 
     def get_total(self):
-        total = sum(item.get_final_price() for item in self.cart_items.all())
+        # An unsaved order cannot have cart items yet
+        total = sum(item.get_final_price() for item in self.cart_items.all()) if self.pk else Decimal(0)
         if self.coupon:
-            total -= self.coupon.discount
-        total += self.amount_shipping + self.amount_tax - self.amount_discount
+            total -= Decimal(str(self.coupon.discount))  # A FloatField, which does not mix with Decimal prices
+        # Fresh instances hold the fields' float defaults until reloaded
+        total += Decimal(str(self.amount_shipping or 0)) + Decimal(str(self.amount_tax or 0))
+        total -= Decimal(str(self.amount_discount or 0))
         return total
 
     def save(self, *args, **kwargs):
@@ -326,6 +370,38 @@ class Order(models.Model):
         super().save(*args, **kwargs)
 
 
+###################################################
+#               Inventory Reservation             #
+###################################################
+
+class InventoryReservation(models.Model):
+    """ Stock taken off a variant for an unpaid order until it is paid or the hold expires """
+    HELD = 'H'
+    COMMITTED = 'C'
+    RELEASED = 'R'
+    STATUS_CHOICES = (
+        (HELD, 'Held'),
+        (COMMITTED, 'Committed'),
+        (RELEASED, 'Released'),
+    )
+
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='reservations')
+    order = models.ForeignKey('Order', on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=HELD)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['expires_at']
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='reservation_status_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x variant {self.variant_id} for Order {self.order_id} ({self.get_status_display()})'
+
+
 ###################################################
 #                Shipping Address                 #
 ###################################################
@@ -379,6 +455,7 @@ class SearchTerm(models.Model):
 ###################################################
 
 class StripeCharge(models.Model):
+    order = models.ForeignKey('Order', on_delete=models.SET_NULL, null=True, blank=True, related_name='charges')
     stripe_charge_id = models.CharField(max_length=255)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=10)
@@ -390,6 +467,19 @@ class StripeCharge(models.Model):
     def __str__(self):
         return f'Stripe Charge {self.stripe_charge_id} - {self.amount} {self.currency}'
 
+
+class StripeEvent(models.Model):
+    """ Webhook events already applied, keyed by Stripe event ID for idempotency """
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-received_at']
+
+    def __str__(self):
+        return f'{self.event_type} ({self.event_id})'
+
 ###################################################
 #                  Refund                         #
 ###################################################
@@ -401,7 +491,7 @@ class Refund(models.Model):
     refund_date = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f'Refund {self.id} for Order {self.order.id}'
+        return f'Refund {self.id} for Order {self.order_id}'
 
 ###################################################
 #                  Return                         #
@@ -414,23 +504,78 @@ class Return(models.Model):
     notes = models.TextField(blank=True)
 
     def __str__(self):
-        return f'Return {self.id} for Order {self.order.id}'
+        return f'Return {self.id} for Order {self.order_id}'
 
 ###################################################
 #                  Popular                        #
 ###################################################
 
 class PopularProduct(models.Model):
+    """ Popularity of a product within a window, maintained by rollup_popular_products() """
+    WINDOW_CHOICES = (
+        ('24h', gl('Decaying over 24 hours')),
+        ('7d', gl('Decaying over 7 days')),
+        ('30d', gl('Decaying over 30 days')),
+    )
+
     product = models.ForeignKey('Product', on_delete=models.CASCADE)
-    cart_count = models.PositiveIntegerField(gl('Cart Count'), null=True)
-    buys_count = models.PositiveIntegerField(gl('Buys Count'), null=True)
-    
+    window = models.CharField(gl('Window'), max_length=3, choices=WINDOW_CHOICES, default='7d')
+    cart_count = models.PositiveIntegerField(gl('Cart Count'), null=True, default=0)  # The counts are lifetime totals
+    buys_count = models.PositiveIntegerField(gl('Buys Count'), null=True, default=0)
+    view_count = models.PositiveIntegerField(gl('View Count'), default=0)
+    score = models.FloatField(gl('Score'), default=0)  # Weighted activity, decayed with the window as time constant
+    updated_at = models.DateTimeField(auto_now=True)
+
     objects = models.Manager()  # Default manager
     active = StoreManager().active
 
     class Meta:
         verbose_name = gl('Popular Product')
         verbose_name_plural = gl('Popular Products')
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'window'], name='popular_product_window_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['window', '-score'], name='popular_window_score_idx'),  # Top-N reads
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} ({self.window}: {self.score:.1f})"
+
+
+class RollupCheckpoint(models.Model):
+    """ High-water marks of the activity already folded into a rollup, and of what the next run folds """
+    name = models.CharField(max_length=50, unique=True)
+    last_cart_item_id = models.BigIntegerField(default=0)
+    last_view_log_id = models.BigIntegerField(default=0)
+    seen_cart_item_id = models.BigIntegerField(default=0)
+    seen_view_log_id = models.BigIntegerField(default=0)
+    last_ordered_at = models.DateTimeField(null=True, blank=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} checkpoint ({self.last_run_at})"
+
+
+###################################################
+#               Request Profile                   #
+###################################################
+
+class RequestProfile(models.Model):
+    """ Sampled call stacks of one profiled request, in collapsed (flamegraph) format """
+    created_at = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    view_name = models.CharField(max_length=100, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    samples = models.PositiveIntegerField()
+    interval_ms = models.FloatField()
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    collapsed_stacks = models.TextField(blank=True)  # "frame;frame;frame count" per line
+
+    class Meta:
+        ordering = ['-created_at']
 
     def __str__(self):
-        return f"{self.product.name} ({self.cart_count} views)"
\ No newline at end of file
+        return f'{self.method} {self.path} ({self.duration_ms:.0f} ms)'
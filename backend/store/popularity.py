@@ -0,0 +1,122 @@
+"""
+Incremental PopularProduct rollup.
+
+Each run folds the activity recorded since the previous run into
+PopularProduct: new cart items and view logs, found by primary key, and
+orders paid since the previous run, found by ordered_at. Activity is counted
+with one aggregate query per source. The windows are decay time constants,
+not cut-offs: scores decay exponentially with a time constant of 24h, 7d or
+30d. A run first multiplies every score of a window by the decay for the
+elapsed time in a single UPDATE, then adds the weighted new activity. The
+"24h" score therefore weighs a view from a day ago at 1/e of a view from now,
+without re-reading old activity. The cart/buy/view counts are lifetime
+totals, the same in every window.
+
+Rows are not committed in primary key or ordered_at order. On Postgres a
+transaction that commits late can add a row below the highest id or
+ordered_at another run has already read. A run therefore folds activity one
+run behind: the ids up to the highest id seen by the previous run, and the
+orders paid before the previous run started. Rows inside that bound had
+started their transaction before the previous run, so they have committed
+by now unless that transaction ran longer than the interval between runs.
+"""
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+
+from .models import CartItem, PopularProduct, ProductViewLog, RollupCheckpoint
+
+CHECKPOINT_NAME = 'popular_products'
+
+# Decay time constant of each window's score
+WINDOWS = {
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+}
+
+VIEW_WEIGHT = 1.0
+CART_WEIGHT = 3.0
+BUY_WEIGHT = 10.0
+
+
+def new_activity(checkpoint):
+    """ Per-product counts of views, cart adds and units bought up to what the previous run saw """
+    # Checkpoints from before seen_* existed have them at 0: fold nothing until the next run
+    last_cart_item_id = max(checkpoint.seen_cart_item_id, checkpoint.last_cart_item_id)
+    last_view_log_id = max(checkpoint.seen_view_log_id, checkpoint.last_view_log_id)
+
+    carts = CartItem.objects.filter(
+        pk__gt=checkpoint.last_cart_item_id, pk__lte=last_cart_item_id, product__isnull=False
+    ).values('product').annotate(n=Count('pk')).values_list('product', 'n')
+    views = ProductViewLog.objects.filter(
+        pk__gt=checkpoint.last_view_log_id, pk__lte=last_view_log_id
+    ).values('product').annotate(n=Count('pk')).values_list('product', 'n')
+    buys = []
+    if checkpoint.last_run_at:
+        paid = {'ordered': True, 'ordered_at__lte': checkpoint.last_run_at}
+        if checkpoint.last_ordered_at:
+            paid['ordered_at__gt'] = checkpoint.last_ordered_at
+        # One filter() call, so every condition applies to the same order through a single join
+        buys = CartItem.objects.filter(
+            product__isnull=False, **{f'orders__{lookup}': value for lookup, value in paid.items()}
+        ).values('product').annotate(n=Sum('quantity')).values_list('product', 'n')
+
+    activity = defaultdict(lambda: {'views': 0, 'carts': 0, 'buys': 0})
+    for key, rows in (('views', views), ('carts', carts), ('buys', buys)):
+        for product_id, n in rows:
+            activity[product_id][key] += n or 0
+
+    checkpoint.last_cart_item_id = last_cart_item_id
+    checkpoint.last_view_log_id = last_view_log_id
+    # Folded by the next run
+    checkpoint.seen_cart_item_id = CartItem.objects.aggregate(last=Max('pk'))['last'] or 0
+    checkpoint.seen_view_log_id = ProductViewLog.objects.aggregate(last=Max('pk'))['last'] or 0
+    checkpoint.last_ordered_at = checkpoint.last_run_at or checkpoint.last_ordered_at
+    return activity
+
+
+@transaction.atomic
+def rollup_popular_products(now=None):
+    """ Fold new activity into PopularProduct and return the number of products touched """
+    now = now or timezone.now()
+    checkpoint, _ = RollupCheckpoint.objects.select_for_update().get_or_create(name=CHECKPOINT_NAME)
+    elapsed = (now - checkpoint.last_run_at).total_seconds() if checkpoint.last_run_at else 0
+    activity = new_activity(checkpoint)
+
+    for window, length in WINDOWS.items():
+        if elapsed > 0:
+            decay = math.exp(-elapsed / length.total_seconds())
+            PopularProduct.objects.filter(window=window).update(score=F('score') * decay)
+        if activity:
+            fold_activity(window, activity, now)
+
+    checkpoint.last_run_at = now
+    checkpoint.save()
+    return len(activity)
+
+
+def fold_activity(window, activity, now):
+    existing = {row.product_id: row for row in PopularProduct.objects.filter(window=window, product_id__in=activity)}
+    created = []
+    for product_id, counts in activity.items():
+        row = existing.get(product_id)
+        if row is None:
+            row = PopularProduct(product_id=product_id, window=window)
+            created.append(row)
+        row.view_count = (row.view_count or 0) + counts['views']
+        row.cart_count = (row.cart_count or 0) + counts['carts']
+        row.buys_count = (row.buys_count or 0) + counts['buys']
+        row.updated_at = now
+        row.score = (row.score or 0) + (
+            VIEW_WEIGHT * counts['views'] + CART_WEIGHT * counts['carts'] + BUY_WEIGHT * counts['buys']
+        )
+
+    PopularProduct.objects.bulk_update(
+        list(existing.values()), ['view_count', 'cart_count', 'buys_count', 'score', 'updated_at'], batch_size=500
+    )
+    PopularProduct.objects.bulk_create(created, batch_size=500)
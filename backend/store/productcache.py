@@ -0,0 +1,90 @@
+"""
+Per-product cache of serialized ProductSerializer data.
+
+Entries are stored with the version of the product's surrogate key
+(responsecache.product_key), so the signals that purge cached responses
+for a product also invalidate its entry here. The version is read before the
+product is, so a purge that lands in between leaves an entry that misses.
+Slugs map to ids through their own entries. A slug entry is trusted only if
+the product it points to still has that slug. Everything that misses is
+loaded with one IN query. Only active products are returned, as on the list
+views.
+"""
+from django.core.cache import caches
+from django.db.models import Q
+
+from . import metrics
+from .models import Product
+from .responsecache import RESPONSE_CACHE_ALIAS, product_key, response_cache
+from .serializers import ProductSerializer
+
+PRODUCT_CACHE_TTL = 60 * 60
+PRODUCT_PREFIX = 'pc:product:'
+SLUG_PREFIX = 'pc:slug:'
+
+
+def cached_entries(ids):
+    """ {id: data} for ids whose cached data is still current """
+    if not ids:
+        return {}
+    cache = caches[RESPONSE_CACHE_ALIAS]
+    entries = cache.get_many([PRODUCT_PREFIX + str(pk) for pk in ids])
+    versions = response_cache.versions([product_key(pk) for pk in ids])
+    found = {}
+    for pk in ids:
+        entry = entries.get(PRODUCT_PREFIX + str(pk))
+        if entry is not None and entry['version'] == versions[product_key(pk)]:
+            found[pk] = entry['data']
+    return found
+
+
+def load_products(ids, slugs, known_ids=()):
+    """
+    Serialize the active products with these ids or slugs in one query and
+    cache them. Products found by a slug whose id was not known beforehand
+    (in ids or known_ids) have no version read in time, so only their slug
+    is cached; the next lookup maps it to the id and caches the data.
+    """
+    if not ids and not slugs:
+        return []
+    versions = response_cache.current_versions([product_key(pk) for pk in {*ids, *known_ids}])
+    products = Product.objects.filter(Q(pk__in=ids) | Q(slug__in=slugs), is_active=True).prefetch_related('categories')
+    loaded, entries = [], {}
+    for item in ProductSerializer(products, many=True).data:
+        item = dict(item)
+        loaded.append(item)
+        entries[SLUG_PREFIX + item['slug']] = item['id']
+        version = versions.get(product_key(item['id']))
+        if version is not None:
+            entries[PRODUCT_PREFIX + str(item['id'])] = {'version': version, 'data': item}
+    caches[RESPONSE_CACHE_ALIAS].set_many(entries, PRODUCT_CACHE_TTL)
+    return loaded
+
+
+def get_products(ids=(), slugs=()):
+    """
+    Serialized products for the given ids and slugs as ({id: data}, {slug: data}).
+    Products that do not exist are absent from both.
+    """
+    ids, slugs = list(ids), list(slugs)
+    slug_ids = caches[RESPONSE_CACHE_ALIAS].get_many([SLUG_PREFIX + slug for slug in slugs])
+    mapped = {slug: slug_ids[SLUG_PREFIX + slug] for slug in slugs if SLUG_PREFIX + slug in slug_ids}
+    found = cached_entries(list(set(ids) | set(mapped.values())))
+
+    missing_ids = [pk for pk in ids if pk not in found]
+    missing_slugs = [
+        slug for slug in slugs if mapped.get(slug) not in found or found[mapped[slug]]['slug'] != slug
+    ]
+    metrics.count_cache(
+        'product', hits=len(ids) + len(slugs) - len(missing_ids) - len(missing_slugs),
+        misses=len(missing_ids) + len(missing_slugs),
+    )
+    known_ids = [mapped[slug] for slug in missing_slugs if slug in mapped]
+    for item in load_products(missing_ids, missing_slugs, known_ids):
+        found[item['id']] = item
+
+    by_slug = {item['slug']: item for item in found.values()}
+    return (
+        {pk: found[pk] for pk in ids if pk in found},
+        {slug: by_slug[slug] for slug in slugs if slug in by_slug},
+    )
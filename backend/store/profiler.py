@@ -0,0 +1,120 @@
+"""
+On-demand request profiling.
+
+ProfilerMiddleware profiles a request when it carries a valid
+X-Profile-Token header (see make_profile_token and
+`manage.py profile_token`), or ?_profile=1 from a staff user. A sampling
+thread records the request thread's call stack every PROFILER_INTERVAL
+seconds. The stacks are saved in collapsed format as a RequestProfile, ready
+for flamegraph.pl or speedscope. Only the newest REQUEST_PROFILE_KEEP
+profiles are kept. Profiled requests bypass the response cache so the
+view itself runs.
+
+Without the header or flag, the cost is one header and one query string
+lookup per request. Under ASGI the event loop thread is sampled, so other
+requests running on the loop can appear in the stacks, and time spent in
+sync_to_async worker threads shows up as the event loop waiting.
+"""
+import sys
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+PROFILE_HEADER = 'HTTP_X_PROFILE_TOKEN'
+PROFILE_PARAM = '_profile'
+TOKEN_SALT = 'store.profiler'
+
+
+def make_profile_token():
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign('profile')
+
+
+def valid_token(token):
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    return f'{module}:{getattr(code, "co_qualname", code.co_name)}'
+
+
+class StackSampler:
+    """ Samples one thread's stack from a background thread """
+
+    def __init__(self, thread_id, interval, skip_frames=0):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.skip_frames = skip_frames  # Outermost frames (server and middleware) left out of every stack
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            stack = stack[:len(stack) - self.skip_frames]
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+
+def stack_depth():
+    depth, frame = 0, sys._getframe(1)
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+def collapsed(stacks):
+    return '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common())
+
+
+def save_profile(request, response, sampler, elapsed, user):
+    from .models import RequestProfile
+
+    match = getattr(request, 'resolver_match', None)
+    profile = RequestProfile.objects.create(
+        method=request.method, path=request.path[:255], view_name=match.view_name[:100] if match else '',
+        status_code=response.status_code, duration_ms=elapsed * 1000, samples=sampler.samples,
+        interval_ms=sampler.interval * 1000, user=user if user is not None and user.is_authenticated else None,
+        collapsed_stacks=collapsed(sampler.stacks),
+    )
+    stale = list(RequestProfile.objects.values_list('pk', flat=True)[settings.REQUEST_PROFILE_KEEP:])
+    if stale:
+        RequestProfile.objects.filter(pk__in=stale).delete()
+    return profile
+
+
+def wants_profile(request, user):
+    token = request.META.get(PROFILE_HEADER)
+    if token:
+        return valid_token(token)
+    return PROFILE_PARAM in request.GET and user is not None and user.is_staff
+
+
+def start_sampler(skip_caller_frames=True):
+    """ Sample the calling thread, leaving out the caller's frame and everything above it """
+    skip = stack_depth() - 1 if skip_caller_frames else 0
+    return StackSampler(threading.get_ident(), settings.PROFILER_INTERVAL, skip_frames=skip).start()
@@ -0,0 +1,129 @@
+"""
+Per-request SQL instrumentation and query budgets.
+
+record_queries is installed as an execute wrapper on every database
+connection. It counts statements only while collect_queries() is active in
+the current context, so outside instrumented requests it costs one context
+variable lookup. The context follows sync_to_async, so the async views'
+ORM calls on worker threads are counted too.
+
+Views declare the most queries a request may take, next to the view:
+query_budget = N as a class attribute, or @query_budget(N) on function
+views. Budgets cover the whole request, including the session and user
+lookups, so public views leave room for one session read.
+QueryInstrumentationMiddleware logs requests that go over it, and
+QueryBudgetTestMixin.assertQueryBudget makes a test fail when they do.
+"""
+import contextvars
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.db import connections
+from django.urls import resolve
+
+from .responsecache import RESPONSE_CACHE_ALIAS
+
+logger = logging.getLogger(__name__)
+
+_active = contextvars.ContextVar('query_stats', default=())
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0  # Seconds
+        self.statements = Counter()
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        """ Statements run again with the same SQL, the mark of an N+1 """
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+    def most_repeated(self, limit=3):
+        return [(sql, count) for sql, count in self.statements.most_common(limit) if count > 1]
+
+
+def record_queries(execute, sql, params, many, context):
+    active = _active.get()
+    if not active:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for stats in active:
+            stats.record(sql, duration)
+
+
+def install(connection, **kwargs):
+    """ connection_created receiver; also safe to call for open connections """
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+@contextmanager
+def collect_queries():
+    """
+    Count the queries run in this context, on every database, into the
+    yielded QueryStats. Nested collectors each count the inner queries.
+    """
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+    stats = QueryStats()
+    token = _active.set(_active.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+
+
+def query_budget(limit):
+    """ Declare the query budget of a function view """
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def warn_over_budget(request, stats, budget):
+    if budget is not None and stats.count > budget:
+        logger.warning(
+            '%s %s ran %d queries, budget %d; most repeated: %s',
+            request.method, request.path, stats.count, budget, stats.most_repeated(),
+        )
+
+
+def query_budget_of(view_func):
+    if getattr(view_func, 'query_budget', None) is not None:
+        return view_func.query_budget
+    view_class = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None)
+    return getattr(view_class, 'query_budget', None)
+
+
+class QueryBudgetTestMixin:
+    """
+    For TestCase: assertQueryBudget(url) requests url with the test client and
+    fails if the view has no query_budget or takes more queries than it.
+    The response cache is cleared first so the view really runs.
+    """
+
+    def assertQueryBudget(self, url, method='get', **kwargs):
+        budget = query_budget_of(resolve(url.split('?')[0]).func)
+        self.assertIsNotNone(budget, f'The view for {url} declares no query_budget')
+        caches[RESPONSE_CACHE_ALIAS].clear()
+        with collect_queries() as stats:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, f'{url} returned {response.status_code}')
+        self.assertLessEqual(stats.count, budget, '\n'.join(
+            [f'{url} ran {stats.count} queries, budget {budget}:'] + [f'  {sql}' for sql in stats.statements.elements()]
+        ))
+        return response
@@ -0,0 +1,206 @@
+"""
+"Frequently bought together" recommendations.
+
+Paid orders form a sparse order x product matrix B, with a 1 where the order
+contains the product. C = B.T @ B is the item-item co-occurrence matrix. Its
+diagonal holds the number of orders per product. Pairs are scored by lift,
+C_ij * N / (n_i * n_j), or cosine, C_ij / sqrt(n_i * n_j). The top-k
+neighbours of each product are kept in ProductRecommendation.
+
+The raw counts, product index and checkpoint are saved to
+RECOMMENDATIONS_STATE_PATH. A later run adds the co-occurrences of orders
+paid since then and rescores only the products those orders touched.
+Products deleted since they were counted stay in the saved counts but are
+never written as a product or a neighbour.
+NumPy and SciPy are needed for the build only, not for serving. Measured
+locally on SQLite, a full build over 184k paid orders (367k lines, 17k
+products) takes about 4s. Larger order volumes have not been measured.
+"""
+import os
+from array import array
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, Product, ProductRecommendation
+from .responsecache import product_key, response_cache
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # Optional: only the batch build needs them
+    np = sparse = None
+
+TOP_K = 10
+MIN_SUPPORT = 2  # Pairs bought together fewer times than this are noise
+METRICS = ('lift', 'cosine')
+FETCH_CHUNK_SIZE = 50000
+WRITE_CHUNK_SIZE = 5000
+
+
+class CooccurrenceState:
+    """ Raw co-occurrence counts over a sorted index of product ids """
+
+    def __init__(self, index, counts, n_orders=0, last_ordered_at=None):
+        self.index = index
+        self.counts = counts
+        self.n_orders = n_orders
+        self.last_ordered_at = last_ordered_at
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0, dtype=np.int64), sparse.csr_matrix((0, 0), dtype=np.int32))
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls.empty()
+        with np.load(path, allow_pickle=False) as data:
+            counts = sparse.csr_matrix(
+                (data['data'], data['indices'], data['indptr']), shape=tuple(data['shape'])
+            )
+            last = str(data['last_ordered_at'])
+            return cls(data['index'], counts, int(data['n_orders']),
+                       datetime.fromisoformat(last) if last else None)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.tmp.npz'
+        np.savez(
+            tmp, index=self.index, data=self.counts.data, indices=self.counts.indices,
+            indptr=self.counts.indptr, shape=np.array(self.counts.shape), n_orders=self.n_orders,
+            last_ordered_at=self.last_ordered_at.isoformat() if self.last_ordered_at else '',
+        )
+        os.replace(tmp, path)
+
+    def add(self, order_ids, product_ids):
+        """ Fold (order, product) pairs into the counts; return the column positions touched """
+        index = np.union1d(self.index, product_ids)
+        counts = self.counts
+        if len(index) != len(self.index):
+            # Re-home the existing counts onto the grown index
+            moved = np.searchsorted(index, self.index)
+            coo = counts.tocoo()
+            counts = sparse.csr_matrix(
+                (coo.data, (moved[coo.row], moved[coo.col])), shape=(len(index), len(index)), dtype=np.int32
+            )
+
+        rows = np.unique(order_ids, return_inverse=True)[1]
+        cols = np.searchsorted(index, product_ids)
+        basket = sparse.csr_matrix(
+            (np.ones(len(cols), dtype=np.int32), (rows, cols)), shape=(rows.max() + 1, len(index))
+        )
+        basket.data[:] = 1  # The same product on two lines of one order counts once
+        self.counts = (counts + (basket.T @ basket)).tocsr()
+        self.index = index
+        self.n_orders += basket.shape[0]
+        return np.unique(cols)
+
+
+def require_numpy():
+    if np is None or sparse is None:
+        raise ImproperlyConfigured('Building recommendations requires numpy and scipy')
+
+
+def fetch_pairs(since, until):
+    """ (order id, product id) arrays for the lines of orders paid after since, up to until """
+    orders = Order.objects.filter(ordered=True).exclude(ordered_at__gt=until)
+    if since:
+        orders = orders.filter(ordered_at__gt=since)
+    pairs = Order.cart_items.through.objects.filter(
+        order__in=orders, cartitem__product__isnull=False
+    ).values_list('order_id', 'cartitem__product_id')
+
+    order_ids, product_ids = array('q'), array('q')
+    for order_id, product_id in pairs.iterator(chunk_size=FETCH_CHUNK_SIZE):
+        order_ids.append(order_id)
+        product_ids.append(product_id)
+    return np.frombuffer(order_ids, dtype=np.int64), np.frombuffer(product_ids, dtype=np.int64)
+
+
+def live_products(index):
+    """ Mask of the positions of index whose product still exists """
+    ids = index.tolist()
+    existing = set()
+    for start in range(0, len(ids), WRITE_CHUNK_SIZE):
+        existing.update(Product.objects.filter(pk__in=ids[start:start + WRITE_CHUNK_SIZE]).values_list('pk', flat=True))
+    return np.fromiter((pk in existing for pk in ids), dtype=bool, count=len(ids))
+
+
+def score_rows(state, rows, metric='lift', top_k=TOP_K, min_support=MIN_SUPPORT, alive=None):
+    """
+    Yield (product id, [(neighbour id, score), ...]) for the given row
+    positions. Positions that are False in alive are never used as neighbours.
+    """
+    totals = state.counts.diagonal().astype(np.float64)
+    block = state.counts[rows].tocsr()
+    row_of = np.repeat(np.asarray(rows), np.diff(block.indptr))
+    cols, hits = block.indices, block.data.astype(np.float64)
+
+    if metric == 'lift':
+        scores = hits * state.n_orders / (totals[row_of] * totals[cols])
+    else:
+        scores = hits / np.sqrt(totals[row_of] * totals[cols])
+    scores[(hits < min_support) | (cols == row_of)] = 0
+    if alive is not None:
+        scores[~alive[cols]] = 0
+
+    for position, row in enumerate(rows):
+        start, end = block.indptr[position], block.indptr[position + 1]
+        row_scores = scores[start:end]
+        keep = np.flatnonzero(row_scores > 0)
+        if len(keep) > top_k:
+            keep = keep[np.argpartition(-row_scores[keep], top_k - 1)[:top_k]]
+        keep = keep[np.argsort(-row_scores[keep], kind='stable')]
+        yield int(state.index[row]), [(int(state.index[cols[start + k]]), float(row_scores[k])) for k in keep]
+
+
+@transaction.atomic
+def write_recommendations(scored):
+    """ Replace the stored neighbours of every scored product """
+    product_ids, rows = [], []
+    for product_id, neighbours in scored:
+        product_ids.append(product_id)
+        rows.extend(
+            ProductRecommendation(product_id=product_id, recommended_id=neighbour, rank=rank, score=score)
+            for rank, (neighbour, score) in enumerate(neighbours, start=1)
+        )
+    for start in range(0, len(product_ids), WRITE_CHUNK_SIZE):
+        ProductRecommendation.objects.filter(product_id__in=product_ids[start:start + WRITE_CHUNK_SIZE]).delete()
+    ProductRecommendation.objects.bulk_create(rows, batch_size=WRITE_CHUNK_SIZE)
+    response_cache.purge(product_key(pk) for pk in product_ids)
+    return len(rows)
+
+
+def build_recommendations(full=False, metric='lift', top_k=TOP_K, min_support=MIN_SUPPORT, path=None):
+    """
+    Fold newly paid orders into the co-occurrence counts and refresh the
+    neighbours of the products they touched; full=True rebuilds from scratch.
+    Returns a dict of counts for reporting.
+    """
+    require_numpy()
+    if metric not in METRICS:
+        raise ValueError(f'metric must be one of {METRICS}')
+    path = path or settings.RECOMMENDATIONS_STATE_PATH
+    state = CooccurrenceState.empty() if full else CooccurrenceState.load(path)
+
+    now = timezone.now()
+    order_ids, product_ids = fetch_pairs(state.last_ordered_at, now)
+    touched = state.add(order_ids, product_ids) if len(order_ids) else np.zeros(0, dtype=np.int64)
+    state.last_ordered_at = now
+
+    # A new order changes the counts of its own products, so only their neighbours move.
+    # Lift also depends on N, which drifts slowly; a periodic full build refreshes the rest.
+    rows = np.arange(len(state.index)) if full else touched
+    # The saved index keeps products deleted since; writing them would break the foreign keys
+    alive = live_products(state.index)
+    rows = rows[alive[rows]]
+    written = write_recommendations(score_rows(state, rows, metric, top_k, min_support, alive)) if len(rows) else 0
+    state.save(path)
+    return {
+        'pairs': len(order_ids), 'orders': state.n_orders, 'products': len(state.index),
+        'rescored': len(rows), 'written': written,
+    }
@@ -0,0 +1,35 @@
+"""
+JSON renderer backed by orjson.
+
+Produces the same output as DRF's compact JSONRenderer about an order of
+magnitude faster on large listings. Types orjson does not encode itself
+(Decimal, lazy strings, querysets) and datetimes, so their format stays
+DRF's, go through DRF's JSONEncoder.default. Indented output (the browsable
+API), ASCII-only or non-compact settings, and installs without orjson fall
+back to the stock renderer.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # Optional: the stock renderer is used instead
+    orjson = None
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+class FastJSONRenderer(JSONRenderer):
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if orjson is None or indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self.encoder.default, option=ORJSON_OPTIONS)
+        # Keep output a strict JavaScript subset, as JSONRenderer does
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
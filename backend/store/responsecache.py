@@ -0,0 +1,229 @@
+"""
+Full-response cache for anonymous catalog GETs, invalidated by surrogate key.
+
+Views opt in with SurrogateKeyMixin and name what their response depends on:
+product:<id> for every product in it, category:<slug> for category pages,
+subcategory:<id>, and the collection keys products and featured, whose
+membership changes whenever a product is added or (un)featured.
+ResponseCacheMiddleware stores each rendered response together with the
+current version of each of its keys and sends the keys in a Surrogate-Key
+header so the CDN can purge by key too.
+
+purge() replaces a key's version, so every entry tagged with it misses on its
+next read. Entries for other keys are untouched. A purge only reaches the
+processes that share the cache: set CACHE_URL so that every worker and the
+management commands (Shopify sync, build_recommendations, generate_catalog)
+use one Redis cache. With the default per-process LocMemCache, a purge made
+in one process leaves the entries of the others stale until RESPONSE_CACHE_TTL.
+
+An entry always records a real version of each of its keys; a key without
+one is given one first. A version key that the cache evicts then reads as a
+purge, never as a match for an entry stored before the key had a version.
+
+Receivers in signals.py purge the keys touched by catalog model changes, and
+its purge_products() covers QuerySet.update() and bulk writes, which send no
+signals. surrogate_keys_purged is sent for a CDN purge hook to connect to. A
+purge that lands while a response is being built can leave that one entry
+stale until RESPONSE_CACHE_TTL expires it.
+
+Purges are made on the primary, but a miss right after one may be answered
+from a replica that has not replayed the change yet. Versions record when
+they were made, and a response read from a replica is not stored while any
+of its keys is younger than REPLICA_PIN_SECONDS, the window routers.py
+allows for replication lag. Otherwise the data from before the change would
+be cached under the new version for the full TTL.
+"""
+import hashlib
+import threading
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.dispatch import Signal
+
+from . import metrics
+
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TTL = 60 * 10
+ENTRY_PREFIX = 'rc:entry:'
+VERSION_PREFIX = 'rc:key:'
+CACHED_HEADERS = ('Content-Type', 'Content-Language', 'Vary', 'Allow')
+
+surrogate_keys_purged = Signal()  # sent with keys=[...]
+
+
+def new_version():
+    """ A fresh key version, starting with when it was made in hex milliseconds """
+    return f'{int(time.time() * 1000):x}-{uuid4().hex[:8]}'
+
+
+def version_age(version):
+    """ Seconds since version was made """
+    made, dated, _ = version.partition('-')
+    return time.time() - int(made, 16) / 1000 if dated else float('inf')  # Made before versions were dated
+
+
+def product_key(product_id):
+    return f'product:{product_id}'
+
+
+def category_key(slug):
+    return f'category:{slug}'
+
+
+def subcategory_key(subcategory_id):
+    return f'subcategory:{subcategory_id}'
+
+
+class ResponseCache:
+    def __init__(self, alias=RESPONSE_CACHE_ALIAS, ttl=RESPONSE_CACHE_TTL):
+        self.alias = alias
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.purges = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def entry_key(self, request):
+        accept = request.META.get('HTTP_ACCEPT', '')
+        digest = hashlib.md5(f'{request.get_full_path()}|{accept}'.encode()).hexdigest()
+        return ENTRY_PREFIX + digest
+
+    def versions(self, keys):
+        found = self.cache.get_many([VERSION_PREFIX + key for key in keys])
+        return {key: found.get(VERSION_PREFIX + key) for key in keys}
+
+    async def aversions(self, keys):
+        found = await self.cache.aget_many([VERSION_PREFIX + key for key in keys])
+        return {key: found.get(VERSION_PREFIX + key) for key in keys}
+
+    def get(self, request):
+        """ The cached entry for this request if none of its keys was purged since, else None """
+        entry = self.cache.get(self.entry_key(request))
+        if entry is not None and self.versions(entry['versions']) != entry['versions']:
+            entry = None
+        return self.count_lookup(entry)
+
+    async def aget(self, request):
+        entry = await self.cache.aget(self.entry_key(request))
+        if entry is not None and await self.aversions(entry['versions']) != entry['versions']:
+            entry = None
+        return self.count_lookup(entry)
+
+    def count_lookup(self, entry):
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.count_cache('response', hits=entry is not None, misses=entry is None)
+        return entry
+
+    def current_versions(self, keys):
+        """ versions() for a new entry, giving keys that have no version yet one """
+        versions = self.versions(keys)
+        missing = [key for key, version in versions.items() if version is None]
+        if missing:
+            version = new_version()
+            for key in missing:
+                self.cache.add(VERSION_PREFIX + key, version, None)  # Never overwrites a concurrent purge
+            versions.update(self.versions(missing))
+        return versions
+
+    async def acurrent_versions(self, keys):
+        versions = await self.aversions(keys)
+        missing = [key for key, version in versions.items() if version is None]
+        if missing:
+            version = new_version()
+            for key in missing:
+                await self.cache.aadd(VERSION_PREFIX + key, version, None)
+            versions.update(await self.aversions(missing))
+        return versions
+
+    def set(self, request, response, keys, replica_read=False, **extra):
+        """ Store response unless replica_read and a replica may not have its keys' last purge yet """
+        versions = self.current_versions(keys)
+        if replica_read and self.recently_purged(versions):
+            return False
+        self.cache.set(self.entry_key(request), self.make_entry(response, versions, extra), self.ttl)
+        return True
+
+    async def aset(self, request, response, keys, replica_read=False, **extra):
+        versions = await self.acurrent_versions(keys)
+        if replica_read and self.recently_purged(versions):
+            return False
+        await self.cache.aset(self.entry_key(request), self.make_entry(response, versions, extra), self.ttl)
+        return True
+
+    def recently_purged(self, versions):
+        return any(version_age(version) < settings.REPLICA_PIN_SECONDS for version in versions.values())
+
+    def make_entry(self, response, versions, extra):
+        with self._lock:
+            self.stores += 1
+        return {
+            'versions': versions,
+            'status': response.status_code,
+            'content': response.content,
+            'headers': {name: response[name] for name in CACHED_HEADERS if response.has_header(name)},
+            **extra,
+        }
+
+    def purge(self, keys):
+        """ Invalidate every entry tagged with any of keys, once the current transaction commits """
+        keys = sorted(set(keys))
+        if keys:
+            transaction.on_commit(lambda: self._purge(keys))
+
+    def _purge(self, keys):
+        version = new_version()
+        self.cache.set_many({VERSION_PREFIX + key: version for key in keys}, None)
+        with self._lock:
+            self.purges += len(keys)
+        surrogate_keys_purged.send(sender=self.__class__, keys=keys)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits, 'misses': self.misses, 'stores': self.stores, 'purges': self.purges,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+response_cache = ResponseCache()
+
+
+def product_ids(data):
+    """ Ids of the products in serialized data: an object, a list or a paginated page """
+    if isinstance(data, dict):
+        if 'results' in data:
+            data = data['results']
+        elif 'id' in data:
+            data = [data]
+        else:
+            return []
+    return [item['id'] for item in data if isinstance(item, dict) and 'id' in item]
+
+
+class SurrogateKeyMixin:
+    """
+    Marks a DRF view's successful responses as cacheable by ResponseCacheMiddleware.
+    Override get_surrogate_keys() to add the keys the response depends on.
+    """
+
+    def get_surrogate_keys(self, response):
+        return [product_key(pk) for pk in product_ids(response.data)]
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method == 'GET' and response.status_code == 200:
+            response.surrogate_keys = self.get_surrogate_keys(response)
+        return response
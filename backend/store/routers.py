@@ -0,0 +1,151 @@
+"""
+Primary/replica database routing.
+
+Writes always go to the primary ('default'). Reads go to a read replica only
+while a request is being handled by a view that opts in with
+use_replica = True (a class attribute on DRF views, or @replica_reads on
+function views). Those are the catalog, search and order-history reads.
+Everything else, including session and auth lookups made before the view
+runs, reads from the primary.
+
+Read-your-writes: once a request writes, the rest of it reads from the
+primary. ReplicaRoutingMiddleware also sets a short-lived cookie so the same
+client's reads stay on the primary for REPLICA_PIN_SECONDS, longer than
+replication normally lags.
+
+Replica choice is health-aware. A replica is probed at most every
+REPLICA_HEALTH_INTERVAL seconds by reading PROBE_MODEL's table; merely
+connecting proves nothing for SQLite, which opens a missing file as a new,
+empty database. If that read fails, or Postgres replay lag is over
+REPLICA_MAX_LAG, the replica is skipped for REPLICA_RETRY_SECONDS.
+With no healthy replica, reads fall back to the primary.
+"""
+import contextvars
+import random
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+PRIMARY = 'default'
+PIN_COOKIE = 'db_pin'
+
+REPLICA_HEALTH_INTERVAL = 5
+REPLICA_RETRY_SECONDS = 30
+REPLICA_MAX_LAG = 10  # Seconds of replay lag tolerated on Postgres replicas
+PROBE_MODEL = 'store.Product'  # Every replica-routed view reads it
+
+
+class RoutingState:
+    """ Per-request routing flags; mutable so copies of the context share it """
+
+    def __init__(self, pinned=False):
+        self.use_replica = False
+        self.pinned = pinned
+        self.wrote = False
+        self.read_replica = False  # Some read went to a replica
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+def replica_reads(view):
+    """ Mark a function view as safe to serve from a read replica """
+    view.use_replica = True
+    return view
+
+
+def view_uses_replica(view_func):
+    view_class = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None)
+    return bool(getattr(view_func, 'use_replica', False) or getattr(view_class, 'use_replica', False))
+
+
+def begin_request(pinned=False):
+    """ Start routing a request; returns the token for end_request() """
+    return _state.set(RoutingState(pinned))
+
+
+def end_request(token):
+    state = _state.get()
+    _state.reset(token)
+    return state
+
+
+def current_state():
+    return _state.get()
+
+
+class ReplicaHealth:
+    def __init__(self):
+        self.down_until = {}
+        self.checked_at = {}
+        self._lock = threading.Lock()
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        if self.down_until.get(alias, 0) > now:
+            return False
+        if now - self.checked_at.get(alias, 0) < REPLICA_HEALTH_INTERVAL:
+            return True
+        with self._lock:
+            self.checked_at[alias] = now
+        try:
+            healthy = self.probe(alias)
+        except DatabaseError:
+            healthy = False
+        if not healthy:
+            self.mark_down(alias)
+        return healthy
+
+    def probe(self, alias):
+        connection = connections[alias]
+        table = connection.ops.quote_name(apps.get_model(PROBE_MODEL)._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT 1 FROM {table} LIMIT 1')  # "no such table" on an empty SQLite file
+            if connection.vendor != 'postgresql':
+                return True
+            cursor.execute(
+                'SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)'
+            )
+            return cursor.fetchone()[0] <= REPLICA_MAX_LAG
+
+    def mark_down(self, alias):
+        with self._lock:
+            self.down_until[alias] = time.monotonic() + REPLICA_RETRY_SECONDS
+
+
+replica_health = ReplicaHealth()
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICA_ALIASES', ())
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.pinned or state.wrote:
+            return PRIMARY
+        healthy = [alias for alias in replica_aliases() if replica_health.is_healthy(alias)]
+        if not healthy:
+            return PRIMARY
+        state.read_replica = True
+        return random.choice(healthy)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db == PRIMARY
@@ -6,13 +6,50 @@ Validation: Validate incoming data before saving it to the database.
 from rest_framework import serializers
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
 from .models import UserProfile, Order, Product
 from .models import (
     Category, Subcategory, Product, ProductVariant, ProductImage,
     ProductReview, Cart, CartItem, Order, Coupon, UserProfile, SearchTerm,
-    StripeCharge, Refund, Return, PopularProduct
+    StripeCharge, Refund, Return, PopularProduct, ProductRecommendation
 )
 
+###################################################
+#               Sparse Fieldsets                  #
+###################################################
+def requested_fields(request):
+    """ Field names listed in ?fields=, or None when the parameter is absent """
+    params = getattr(request, 'query_params', request.GET)
+    raw = params.get('fields')
+    return {name.strip() for name in raw.split(',') if name.strip()} if raw else None
+
+
+class SparseFieldsetMixin:
+    """
+    ?fields=name,price limits the top-level serializer to the listed fields.
+    id is always kept (the response cache tags entries by it) and unknown
+    names are ignored. Nested serializers are returned whole.
+    """
+    always_included = ('id',)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.requested_fields()
+        if requested:
+            for name in list(fields):
+                if name not in requested and name not in self.always_included:
+                    del fields[name]
+        return fields
+
+    def requested_fields(self):
+        # Only the serializer at the root of the response, or the child of a root list
+        parent = self.parent
+        if parent is not None and not (isinstance(parent, serializers.ListSerializer) and parent.parent is None):
+            return None
+        request = self.context.get('request')
+        return requested_fields(request) if request is not None else None
+
+
 ###################################################
 #               Category Serializer               #
 ###################################################
@@ -25,22 +62,51 @@ class CategorySerializer(serializers.ModelSerializer):
 ###################################################
 #               Subcategory Serializer            #
 ###################################################
-class SubcategorySerializer(serializers.ModelSerializer):
+class SubcategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)  # Nest Category serializer
 
     class Meta:
         model = Subcategory
-        fields = ['id', 'name', 'description', 'slug']
+        fields = ['id', 'name', 'description', 'slug', 'category']
 
 ###################################################
 #               Product Serializer                #
 ###################################################
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     categories = CategorySerializer(many=True, read_only=True)  # Nest Category serializer
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'slug', 'image']
+        fields = ['id', 'name', 'description', 'price', 'slug', 'categories']
+
+
+class ProductDetailSerializer(ProductSerializer):
+    recommendations = serializers.SerializerMethodField()
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ['recommendations']
+
+    def get_recommendations(self, obj):
+        # Reads the neighbours precomputed by store/recommendations.py in one query, unless prefetched
+        recommendations = getattr(obj, 'active_recommendations', None)
+        if recommendations is None:
+            recommendations = active_recommendations_of(obj)
+        return [
+            {'id': rec.recommended.id, 'name': rec.recommended.name, 'slug': rec.recommended.slug,
+             'price': str(rec.recommended.price), 'score': rec.score}
+            for rec in recommendations
+        ]
+
+
+def active_recommendations_of(product=None):
+    """ The recommendations ProductDetailSerializer lists, of product or for a Prefetch """
+    queryset = ProductRecommendation.objects.select_related('recommended').filter(recommended__is_active=True)
+    return queryset.filter(product=product) if product is not None else queryset
+
+
+def prefetch_active_recommendations():
+    """ Prefetch for ProductDetailSerializer, e.g. for async views that cannot query while serializing """
+    return Prefetch('recommendations', queryset=active_recommendations_of(), to_attr='active_recommendations')
 
 
 ###################################################
@@ -116,6 +182,37 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class OrderSummarySerializer(SparseFieldsetMixin, serializers.Serializer):
+    """ Order history row, read from a values() projection rather than model instances """
+    order_number = serializers.CharField()
+    created_at = serializers.DateTimeField()
+    status = serializers.CharField()
+    total = serializers.DecimalField(max_digits=10, decimal_places=2)
+    item_count = serializers.IntegerField()
+
+
+class OrderLineSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', default=None)
+    product_slug = serializers.CharField(source='product.slug', default=None)
+    price = serializers.DecimalField(source='product.price', max_digits=10, decimal_places=2, default=None)
+
+    class Meta:
+        model = CartItem
+        fields = ['id', 'product_name', 'product_slug', 'price', 'quantity']
+
+
+class OrderDetailSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    items = OrderLineSerializer(source='cart_items', many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            'order_number', 'created_at', 'status', 'payment_status', 'tracking_number', 'items',
+            'total', 'amount_discount', 'amount_shipping', 'amount_tax', 'shipping_name',
+            'address_line_1', 'address_line_2', 'city', 'state', 'postal_code', 'country',
+        ]
+
+
 ###################################################
 #               Coupon Serializer                 #
 ###################################################
@@ -181,13 +278,12 @@ class ReturnSerializer(serializers.ModelSerializer):
 ###################################################
 #               Popular Product Serializer        #
 ###################################################
-class PopularProductSerializer(serializers.ModelSerializer):
+class PopularProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)  # Nest Product serializer
 
     class Meta:
         model = PopularProduct
-        #fields = '__all__'
-        fields = ['name', 'description', 'price']
+        fields = ['product', 'window', 'score', 'view_count', 'cart_count', 'buys_count']
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -199,13 +295,3 @@ class UpdateUserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['first_name', 'last_name', 'email']
-
-class OrderSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Order
-        fields = '__all__'
-
-class ProductSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Product
-        fields = ['id', 'name', 'description', 'price', 'categories']
\ No newline at end of file
@@ -1,15 +1,28 @@
 import requests
 import json
+import logging
 from .models import Product, ProductVariant, ProductImage, Category
+from django.conf import settings
 from django.utils.text import slugify
 from django.db import transaction
+from .inventory import set_stock
+from .metrics import SyncRun, track_upstream
+
+try:
+    import httpx  # Only needed by the async methods
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+SHOPIFY_TIMEOUT = 30
 
 class ShopifyAPI:
     def __init__(self, shop_name, access_token, collection_id):
         self.shop_name = shop_name
         self.access_token = access_token
         self.collection_id  = collection_id 
-        self.base_url = f"https://{self.shop_name}.myshopify.com/admin/api/2024-07"
+        self.base_url = settings.SHOPIFY_API_BASE.format(shop=self.shop_name)
 
     def get_headers(self):
         return {
@@ -19,7 +32,8 @@ class ShopifyAPI:
 
     def get_products(self):
         url = f"{self.base_url}/products.json"
-        response = requests.get(url, headers=self.get_headers())
+        with track_upstream('shopify', 'products.list'):
+            response = requests.get(url, headers=self.get_headers())
         if response.status_code == 200:
             return response.json()
         else:
@@ -27,12 +41,31 @@ class ShopifyAPI:
 
     def create_order(self, order_data):
         url = f"{self.base_url}/orders.json"
-        response = requests.post(url, headers=self.get_headers(), data=json.dumps(order_data))
+        with track_upstream('shopify', 'orders.create'):
+            response = requests.post(url, headers=self.get_headers(), data=json.dumps(order_data))
         if response.status_code == 201:
             return response.json()
         else:
             raise Exception(f"Failed to create order: {response.status_code} {response.text}")
 
+    async def aget_products(self):
+        """ get_products() for async callers """
+        async with httpx.AsyncClient(timeout=SHOPIFY_TIMEOUT) as client:
+            with track_upstream('shopify', 'products.list'):
+                response = await client.get(f"{self.base_url}/products.json", headers=self.get_headers())
+        if response.status_code == 200:
+            return response.json()
+        raise Exception(f"Failed to retrieve data: {response.status_code} {response.text}")
+
+    async def acreate_order(self, order_data):
+        """ create_order() for async callers """
+        async with httpx.AsyncClient(timeout=SHOPIFY_TIMEOUT) as client:
+            with track_upstream('shopify', 'orders.create'):
+                response = await client.post(f"{self.base_url}/orders.json", headers=self.get_headers(), content=json.dumps(order_data))
+        if response.status_code == 201:
+            return response.json()
+        raise Exception(f"Failed to create order: {response.status_code} {response.text}")
+
     @transaction.atomic
     def load_products(self):
         # Securely obtain sensitive data
@@ -40,12 +73,14 @@ class ShopifyAPI:
         access_token = self.access_token
         collection_id = self.collection_id   # Consider passing this as a parameter if dynamic
 
-        url = f"https://{shop}.myshopify.com/admin/api/2024-07/products.json"
+        url = f"{self.base_url}/products.json"
         params = {
             "collection_id": collection_id
         }
 
-        response = requests.get(url, headers=self.get_headers(), params=params)
+        sync = SyncRun('shopify')  # Stage timings and row counts, recorded as metrics at the end
+        with sync.stage('fetch'), track_upstream('shopify', 'products.list'):
+            response = requests.get(url, headers=self.get_headers(), params=params)
 
         if response.status_code == 200:
             data = response.json()
@@ -59,17 +94,18 @@ class ShopifyAPI:
                 slug = slugify(name)
                 tags = product_data['tags']  # Shopify tags to be used as categories
 
-                product, created = Product.objects.update_or_create(
-                    shopify_id=shopify_id,
-                    defaults={
-                        'name': name,
-                        'slug': slug,
-                        'vendor': vendor,
-                        'description': description,
-                        'price': product_data['variants'][0]['price'],
-                        'discount_price': product_data['variants'][0].get('compare_at_price', 0.00),
-                    }
-                )
+                with sync.stage('products', rows=1):
+                    product, created = Product.objects.update_or_create(
+                        shopify_id=shopify_id,
+                        defaults={
+                            'name': name,
+                            'slug': slug,
+                            'vendor': vendor,
+                            'description': description,
+                            'price': product_data['variants'][0]['price'],
+                            'discount_price': product_data['variants'][0].get('compare_at_price') or 0.00,  # Shopify sends null for no sale
+                        }
+                    )
 
                 # Handle tags as categories
                 tag_list = tags.split(",")
@@ -77,17 +113,18 @@ class ShopifyAPI:
                     category_name = tag.strip()
                     category_slug = slugify(category_name)
 
-                    category, _ = Category.objects.update_or_create(
-                        name=category_name,
-                        defaults={
-                            'slug': category_slug,
-                            'description': f"Category for {category_name}",
-                            'meta_keywords': category_name,
-                            'meta_description': f"{category_name} meta description",
-                        }
-                    )
+                    with sync.stage('categories', rows=1):
+                        category, _ = Category.objects.update_or_create(
+                            name=category_name,
+                            defaults={
+                                'slug': category_slug,
+                                'description': f"Category for {category_name}",
+                                'meta_keywords': category_name,
+                                'meta_description': f"{category_name} meta description",
+                            }
+                        )
 
-                    product.categories.add(category)
+                        product.categories.add(category)
 
                 # Extract and save variants
                 for variant_data in product_data['variants']:
@@ -97,16 +134,17 @@ class ShopifyAPI:
                     compare_at_price = variant_data.get('compare_at_price')
                     inventory_quantity = variant_data['inventory_quantity']
 
-                    ProductVariant.objects.update_or_create(
-                        variant_id=variant_id,
-                        product=product,
-                        defaults={
-                            'title': variant_title,
-                            'price': variant_price,
-                            'compare_at_price': compare_at_price,
-                            'inventory_quantity': inventory_quantity,
-                        }
-                    )
+                    with sync.stage('variants', rows=1):
+                        variant, _ = ProductVariant.objects.update_or_create(
+                            variant_id=variant_id,
+                            product=product,
+                            defaults={
+                                'title': variant_title,
+                                'price': variant_price,
+                                'compare_at_price': compare_at_price,
+                            }
+                        )
+                        set_stock(variant.pk, inventory_quantity)  # Shopify's count does not know about our holds
 
                 # Extract and save images
                 for image_data in product_data['images']:
@@ -114,16 +152,19 @@ class ShopifyAPI:
                     variant_ids = image_data.get('variant_ids', [])
 
                     for variant_id in variant_ids:
-                        variant = ProductVariant.objects.filter(variant_id=variant_id, product=product).first()
+                        with sync.stage('images', rows=1):
+                            variant = ProductVariant.objects.filter(variant_id=variant_id, product=product).first()
 
-                        # Create image only if it doesn't already exist
-                        ProductImage.objects.get_or_create(
-                            product=product,
-                            image_url=image_url,
-                            variant=variant
-                        )
+                            # Create image only if it doesn't already exist
+                            ProductImage.objects.get_or_create(
+                                product=product,
+                                image_url=image_url,
+                                variant=variant
+                            )
 
-                print(f"{'Created' if created else 'Updated'} product: {product.name}")
+                logger.info('%s product: %s', 'Created' if created else 'Updated', product.name)
 
         else:
-            print(f"Error: {response.status_code}, {response.text}")
\ No newline at end of file
+            logger.error('Shopify products request failed: %s, %s', response.status_code, response.text)
+
+        sync.record()
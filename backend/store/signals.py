@@ -0,0 +1,72 @@
+"""
+Cache invalidation hooks, connected in StoreConfig.ready().
+
+QuerySet.update() and bulk_create() send no signals; code that changes
+products that way calls purge_products() itself.
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import coupons
+from .models import Category, Coupon, Product, ProductImage, ProductVariant, Subcategory
+from .responsecache import category_key, product_key, response_cache, subcategory_key
+
+
+@receiver([post_save, post_delete], sender=Coupon)
+def invalidate_coupon(sender, instance, **kwargs):
+    coupons.invalidate(instance)
+
+
+@receiver(post_save, sender=Product)
+def purge_product(sender, instance, **kwargs):
+    # Responses listing the product carry its key; a product that just became
+    # listable is in none of them yet, so its collections are purged as well
+    keys = [product_key(instance.pk), 'products']
+    if instance.is_featured:
+        keys.append('featured')
+    keys.extend(category_key(slug) for slug in instance.categories.values_list('slug', flat=True))
+    response_cache.purge(keys)
+
+
+@receiver(post_delete, sender=Product)
+def purge_deleted_product(sender, instance, **kwargs):
+    response_cache.purge([product_key(instance.pk)])
+
+
+@receiver([post_save, post_delete], sender=ProductVariant)
+@receiver([post_save, post_delete], sender=ProductImage)
+def purge_product_part(sender, instance, **kwargs):
+    if instance.product_id:
+        response_cache.purge([product_key(instance.product_id)])
+
+
+def purge_products(product_ids):
+    """ purge_product() for products changed without signals, e.g. by QuerySet.update() """
+    product_ids = list(product_ids)
+    keys = [product_key(pk) for pk in product_ids] + ['products', 'featured']
+    slugs = Category.objects.filter(products__in=product_ids).values_list('slug', flat=True).distinct()
+    keys.extend(category_key(slug) for slug in slugs)
+    response_cache.purge(keys)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def purge_product_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:  # instance is a Category, pk_set holds product ids
+        keys = [category_key(instance.slug)] + [product_key(pk) for pk in pk_set or ()]
+    else:
+        keys = [product_key(instance.pk)]
+        if pk_set:
+            keys.extend(category_key(slug) for slug in Category.objects.filter(pk__in=pk_set).values_list('slug', flat=True))
+    response_cache.purge(keys)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def purge_category(sender, instance, **kwargs):
+    response_cache.purge([category_key(instance.slug)])
+
+
+@receiver([post_save, post_delete], sender=Subcategory)
+def purge_subcategory(sender, instance, **kwargs):
+    response_cache.purge([category_key(instance.category.slug), subcategory_key(instance.pk)])
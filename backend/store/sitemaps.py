@@ -0,0 +1,143 @@
+"""
+Sharded XML sitemaps written ahead of time.
+
+Each section (products, subcategories, categories) is split into shards by
+primary key range, SITEMAP_SHARD_SIZE ids per shard, so a shard never holds
+more than the 50k URLs the protocol allows and a row never moves between
+shards. One grouped query per section returns the row count and latest
+updated_at of every shard. A shard is rewritten only when that signature
+differs from the one recorded in the manifest at its last build. Shards are
+written pre-gzipped, and the index is rewritten on every run.
+"""
+import json
+import os
+import re
+
+from django.conf import settings
+from django.db.models import Count, F, IntegerField, Max
+from django.db.models.functions import Cast
+from django.urls import reverse
+
+from .files import atomic_gzip_writer
+from .models import Category, Product, Subcategory
+
+SITEMAP_SHARD_SIZE = 50000  # Protocol limit of URLs per sitemap file
+SITEMAP_CHUNK_SIZE = 5000
+MANIFEST_NAME = 'manifest.json'
+INDEX_NAME = 'sitemap.xml.gz'
+SHARD_NAME_RE = re.compile(r'^sitemap-[a-z]+-\d+\.xml\.gz$')
+
+URLSET_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+URLSET_FOOTER = '</urlset>\n'
+INDEX_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+INDEX_FOOTER = '</sitemapindex>\n'
+
+
+def product_rows():
+    return Product.objects.active().only('pk', 'slug', 'updated_at')
+
+
+def subcategory_rows():
+    return Subcategory.objects.active().select_related('category').only(
+        'pk', 'slug', 'updated_at', 'category__slug', 'category__updated_at'
+    )
+
+
+def category_rows():
+    return Category.objects.only('pk', 'slug', 'updated_at')
+
+
+# Section name -> (rows it lists, fields whose latest value dates a shard). A subcategory
+# URL contains its category slug, so a category edit also marks its subcategories' shard stale.
+SECTIONS = {
+    'products': (product_rows, ['updated_at']),
+    'subcategories': (subcategory_rows, ['updated_at', 'category__updated_at']),
+    'categories': (category_rows, ['updated_at']),
+}
+
+
+def shard_name(section, shard):
+    return f'sitemap-{section}-{shard}.xml.gz'
+
+
+def shard_signatures(section):
+    """ {shard number: [row count, latest change]} for every non-empty shard of a section """
+    rows, dated = SECTIONS[section]
+    shard = Cast((F('pk') - 1) / SITEMAP_SHARD_SIZE, IntegerField())
+    aggregates = {f'latest_{i}': Max(field) for i, field in enumerate(dated)}
+    signatures = {}
+    grouped = rows().order_by().annotate(shard=shard).values('shard').annotate(n=Count('pk'), **aggregates)
+    for row in grouped:
+        latest = max(row[key] for key in aggregates if row[key] is not None)
+        signatures[row['shard']] = [row['n'], latest.isoformat()]
+    return signatures
+
+
+def write_shard(path, section, shard):
+    rows, _ = SECTIONS[section]
+    first = shard * SITEMAP_SHARD_SIZE + 1
+    queryset = rows().filter(pk__gte=first, pk__lt=first + SITEMAP_SHARD_SIZE).order_by('pk')
+    site_url = settings.SITE_URL.rstrip('/')
+    with atomic_gzip_writer(path) as fh:
+        fh.write(URLSET_HEADER)
+        for obj in queryset.iterator(chunk_size=SITEMAP_CHUNK_SIZE):
+            fh.write(
+                f'<url><loc>{site_url}{obj.get_absolute_url()}</loc>'
+                f'<lastmod>{obj.updated_at.date().isoformat()}</lastmod></url>\n'
+            )
+        fh.write(URLSET_FOOTER)
+
+
+def write_index(root, manifest):
+    site_url = settings.SITE_URL.rstrip('/')
+    with atomic_gzip_writer(os.path.join(root, INDEX_NAME)) as fh:
+        fh.write(INDEX_HEADER)
+        for name, (_, latest) in sorted(manifest.items()):
+            fh.write(
+                f'<sitemap><loc>{site_url}{reverse("store:sitemap_shard", args=[name])}</loc>'
+                f'<lastmod>{latest[:10]}</lastmod></sitemap>\n'
+            )
+        fh.write(INDEX_FOOTER)
+
+
+def load_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST_NAME)) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+
+def build_sitemaps(full=False, root=None):
+    """
+    Rewrite the shards whose rows changed since the last build (all of them
+    with full=True), drop shards that became empty and rewrite the index.
+    Returns a dict of counts for reporting.
+    """
+    root = str(root or settings.SITEMAP_ROOT)
+    previous = load_manifest(root)
+    manifest, written = {}, 0
+
+    for section in SECTIONS:
+        for shard, signature in shard_signatures(section).items():
+            name = shard_name(section, shard)
+            manifest[name] = signature
+            path = os.path.join(root, name)
+            if not full and previous.get(name) == signature and os.path.exists(path):
+                continue
+            write_shard(path, section, shard)
+            written += 1
+
+    removed = 0
+    for name in set(previous) - set(manifest):
+        path = os.path.join(root, name)
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+
+    write_index(root, manifest)
+    tmp = os.path.join(root, f'{MANIFEST_NAME}.tmp')
+    with open(tmp, 'w') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(root, MANIFEST_NAME))
+    return {'shards': len(manifest), 'written': written, 'removed': removed}
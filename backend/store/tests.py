@@ -1,3 +1,1158 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock, skipUnless
+from uuid import UUID
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+
+from . import coupons, logs, metrics, productcache, profiler, recommendations, renderers, routers
+from .admin import ProductAdmin
+from .batch import build_subrequest, response_result
+from .checkout import checkout_session_params, get_line_items
+from .feeds import iter_feed
+from .inventory import InsufficientStock, release_expired, release_orders, reserve_order, set_stock
+from .middleware import ProfilerMiddleware
+from .models import (
+    CartItem, Category, Coupon, InventoryReservation, Order, PopularProduct, Product, ProductImage,
+    ProductRecommendation, ProductReview, ProductVariant, ProductViewLog, RequestProfile, StripeCharge, Subcategory,
+)
+from .popularity import rollup_popular_products
+from .productcache import get_products
+from .queries import QueryBudgetTestMixin
+from .responsecache import VERSION_PREFIX, product_key, response_cache
+from .sitemaps import build_sitemaps, write_shard
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked on SQLite')
+class HotQueryPlanTests(TestCase):
+    """
+    The hot read paths must be served by an index. Each test fails if SQLite
+    plans a full table scan, e.g. after a migration drops an index or a view
+    changes its filter so the index no longer matches.
+    """
+
+    def assertUsesIndex(self, queryset, index_name=None):
+        table = queryset.model._meta.db_table
+        plan = queryset.explain()
+        full_scan = re.search(rf'\bSCAN {re.escape(table)}\b(?! USING)', plan)
+        self.assertIsNone(full_scan, f'Full scan of {table}:\n{plan}')
+        if index_name:
+            self.assertIn(index_name, plan)
+
+    def test_active_product_listing(self):
+        self.assertUsesIndex(Product.objects.filter(is_active=True)[:10], 'product_active_created_idx')
+
+    def test_featured_products(self):
+        # Without ANALYZE statistics SQLite may serve this from either partial index
+        self.assertUsesIndex(Product.objects.filter(is_featured=True, is_active=True))
+        self.assertUsesIndex(Product.objects.filter(is_featured=True), 'product_featured_idx')
+
+    def test_open_order_for_session(self):
+        self.assertUsesIndex(Order.objects.filter(session='abc', ordered=False), 'order_open_session_idx')
+
+    def test_open_cart_item_for_session(self):
+        self.assertUsesIndex(
+            CartItem.objects.filter(product_id=1, session='abc', ordered=False), 'cartitem_open_session_idx'
+        )
+
+    def test_order_history_page(self):
+        self.assertUsesIndex(Order.objects.filter(user_id=1).order_by('-created_at', '-id')[:20], 'order_user_created_idx')
+
+    def test_abandoned_carts(self):
+        cutoff = timezone.now() - timedelta(days=30)
+        self.assertUsesIndex(Order.objects.filter(ordered=False, last_updated__lt=cutoff), 'order_abandoned_idx')
+
+    def test_recent_views_of_product(self):
+        since = timezone.now() - timedelta(days=7)
+        self.assertUsesIndex(
+            ProductViewLog.objects.filter(product_id=1, viewed_at__gte=since), 'viewlog_product_viewed_idx'
+        )
+
+    def test_approved_reviews_of_product(self):
+        self.assertUsesIndex(
+            ProductReview.objects.filter(product_id=1, is_approved=True), 'review_product_approved_idx'
+        )
+
+    def test_expired_reservations(self):
+        self.assertUsesIndex(
+            InventoryReservation.objects.filter(status=InventoryReservation.HELD, expires_at__lte=timezone.now()),
+            'reservation_status_expiry_idx',
+        )
+
+    def test_popular_products_top_n(self):
+        self.assertUsesIndex(PopularProduct.objects.filter(window='7d').order_by('-score')[:20], 'popular_window_score_idx')
+
+
+@override_settings(VIEW_LOG_BUFFERED=False)
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    """
+    Each endpoint stays within the query_budget declared on its view. The
+    fixtures have several rows per relation, so an N+1 shows up as going over.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = Category.objects.bulk_create([Category(name=f'Category {i}', slug=f'category-{i}') for i in range(3)])
+        Subcategory.objects.bulk_create([
+            Subcategory(name=f'Subcategory {i}', slug=f'subcategory-{i}', category=categories[0]) for i in range(3)
+        ])
+        products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', slug=f'product-{i}', description='', price=10, is_featured=i < 3)
+            for i in range(12)
+        ])
+        for product in products:
+            product.categories.set(categories)
+        ProductRecommendation.objects.bulk_create([
+            ProductRecommendation(product=products[0], recommended=product, rank=rank, score=1.0)
+            for rank, product in enumerate(products[1:5], start=1)
+        ])
+        PopularProduct.objects.bulk_create([PopularProduct(product=product, window='7d', score=1.0) for product in products])
+        cls.user = User.objects.create_user('shopper', password='secret')
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        for _ in range(3):
+            order = Order.objects.create(user=cls.user, ip_address='127.0.0.1')
+            order.cart_items.add(*[CartItem.objects.create(product=product, quantity=1) for product in products[:3]])
+        cls.order_number = order.order_number
+
+    def test_catalog_endpoints(self):
+        for url in [
+            reverse('store:navbar-data'),
+            reverse('store:active_products'),
+            reverse('store:featured_products'),
+            reverse('store:category_products', kwargs={'slug': 'category-0'}),
+            reverse('store:subcategory_list', kwargs={'category_slug': 'category-0'}),
+            reverse('store:subcategory_detail', kwargs={'category_slug': 'category-0', 'slug': 'subcategory-1'}),
+            reverse('store:product_detail', kwargs={'slug': 'product-0'}),
+            reverse('store:bulk_products') + '?ids=1,2,3&slugs=product-5,product-6',
+            reverse('store:search') + '?q=Product',
+        ]:
+            with self.subTest(url=url):
+                self.assertQueryBudget(url)
+
+    def test_async_catalog_endpoints(self):
+        for url in [
+            reverse('store:async_active_products'),
+            reverse('store:async_featured_products'),
+            reverse('store:async_category_products', kwargs={'slug': 'category-0'}),
+            reverse('store:async_product_detail', kwargs={'slug': 'product-0'}),
+        ]:
+            with self.subTest(url=url):
+                self.assertQueryBudget(url)
+
+    def test_async_product_detail_matches_sync(self):
+        for query in ('', '?fields=name,recommendations', '?fields=name'):
+            with self.subTest(query=query):
+                sync = self.client.get(reverse('store:product_detail', kwargs={'slug': 'product-0'}) + query)
+                async_ = self.client.get(reverse('store:async_product_detail', kwargs={'slug': 'product-0'}) + query)
+                self.assertEqual(async_.json(), sync.json())
+                self.assertEqual(set(async_['Surrogate-Key'].split()), set(sync['Surrogate-Key'].split()))
+
+    def test_order_history(self):
+        self.client.force_login(self.user)
+        self.assertQueryBudget(reverse('store:order_history'))
+        self.assertQueryBudget(reverse('store:order_detail', kwargs={'order_number': self.order_number}))
+
+    def test_popular_products(self):
+        self.client.force_login(self.admin)
+        self.assertQueryBudget(reverse('store:popular_products'))
+
+
+STRIPE_EVENTS = Path(__file__).resolve().parent / 'fixtures' / 'stripe_events'
+WEBHOOK_SECRET = 'whsec_test'
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class StripeWebhookTests(TestCase):
+    """
+    Replays the recorded checkout.session.completed event through the signed
+    webhook endpoint and through replay_stripe_events.
+    """
+
+    fixture_path = STRIPE_EVENTS / 'checkout_session_completed.json'
+
+    def setUp(self):
+        product = Product.objects.create(name='Widget', slug='widget', description='', price=10)
+        self.variant = ProductVariant.objects.create(
+            product=product, variant_id='widget', title='Default', price=10, inventory_quantity=5
+        )
+        self.order = Order.objects.create(session='k3p9xv2q8m1z7w4t6y5r0u', ip_address='127.0.0.1')
+        self.order.cart_items.add(CartItem.objects.create(product=product, variant=self.variant, quantity=2))
+        reserve_order(self.order)
+        self.events = json.loads(self.fixture_path.read_text())
+
+    def post_event(self, payload, secret=WEBHOOK_SECRET):
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            reverse('store:stripe_webhook'), payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+    def assertOrderCompleted(self):
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.ordered)
+        self.assertEqual(self.order.payment_status, 'paid')
+        self.assertEqual(self.order.total, Decimal('64.98'))
+        self.assertEqual(self.order.city, 'Austin')
+        self.assertEqual(StripeCharge.objects.filter(order=self.order).count(), 1)
+        self.assertFalse(InventoryReservation.objects.filter(order=self.order, status=InventoryReservation.HELD).exists())
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.inventory_quantity, 3)
+
+    def test_signed_webhook(self):
+        payload = json.dumps(self.events[0])
+        self.assertEqual(self.post_event(payload).status_code, 200)
+        self.assertOrderCompleted()
+        self.assertEqual(self.post_event(payload).status_code, 200)  # A re-delivery is a no-op
+        self.assertOrderCompleted()
+
+    def test_bad_signature(self):
+        response = self.post_event(json.dumps(self.events[0]), secret='whsec_other')
+        self.assertEqual(response.status_code, 400)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.ordered)
+
+    def test_replay_command(self):
+        out = StringIO()
+        call_command('replay_stripe_events', str(self.fixture_path), stdout=out)
+        self.assertIn('Applied 1 of 1 events', out.getvalue())
+        self.assertOrderCompleted()
+        call_command('replay_stripe_events', str(self.fixture_path), stdout=out)
+        self.assertIn('Applied 0 of 1 events', out.getvalue())
+
+    def test_async_payment(self):
+        event = self.events[0]
+        session = event['data']['object']
+        session['payment_status'] = 'unpaid'
+        self.assertEqual(self.post_event(json.dumps(event)).status_code, 200)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.ordered)
+        self.assertEqual(self.order.stripe_session_id, session['id'])
+        self.assertFalse(StripeCharge.objects.exists())
+
+        session['payment_status'] = 'paid'
+        succeeded = dict(event, id='evt_async_succeeded', type='checkout.session.async_payment_succeeded')
+        self.assertEqual(self.post_event(json.dumps(succeeded)).status_code, 200)
+        self.assertOrderCompleted()
+
+    def test_async_payment_failed(self):
+        event = self.events[0]
+        event['data']['object']['payment_status'] = 'unpaid'
+        self.post_event(json.dumps(event))
+        failed = dict(event, id='evt_async_failed', type='checkout.session.async_payment_failed')
+        self.post_event(json.dumps(failed))
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.ordered)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.inventory_quantity, 5)
+
+
+class InventoryReservationTests(TestCase):
+    """ The guarded stock update, hold expiry and release paths, and the stock sync """
+
+    def setUp(self):
+        self.product = Product.objects.create(name='Widget', slug='widget', description='', price=10)
+        self.variant = ProductVariant.objects.create(
+            product=self.product, variant_id='widget', title='Default', price=10, inventory_quantity=3
+        )
+
+    def make_order(self, quantity, session='cart'):
+        order = Order.objects.create(session=session, ip_address='127.0.0.1')
+        order.cart_items.add(CartItem.objects.create(product=self.product, quantity=quantity))
+        return order
+
+    def assertStock(self, quantity):
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.inventory_quantity, quantity)
+
+    def test_guarded_update(self):
+        reserve_order(self.make_order(2, 'first'))
+        self.assertStock(1)
+        with self.assertRaises(InsufficientStock):
+            reserve_order(self.make_order(2, 'second'))
+        self.assertStock(1)
+        self.assertEqual(InventoryReservation.objects.count(), 1)
+
+    def test_shortfall_rolls_back_the_whole_order(self):
+        other = ProductVariant.objects.create(
+            product=Product.objects.create(name='Gadget', slug='gadget', description='', price=5),
+            variant_id='gadget', title='Default', price=5, inventory_quantity=0,
+        )
+        order = self.make_order(1)
+        order.cart_items.add(CartItem.objects.create(product=other.product, quantity=1))
+        with self.assertRaises(InsufficientStock):
+            reserve_order(order)
+        self.assertStock(3)
+        self.assertFalse(InventoryReservation.objects.exists())
+
+    def test_unchanged_cart_keeps_its_hold(self):
+        order = self.make_order(1)
+        self.assertEqual(reserve_order(order), reserve_order(order))
+        self.assertStock(2)
+
+    def test_expired_hold_is_reserved_afresh(self):
+        order = self.make_order(1)
+        expired = reserve_order(order, ttl=timedelta(seconds=-1))
+        expires_at = reserve_order(order)
+        self.assertGreater(expires_at, timezone.now())
+        self.assertGreater(expires_at, expired)
+        self.assertStock(2)
+        self.assertEqual(InventoryReservation.objects.filter(status=InventoryReservation.HELD).count(), 1)
+
+    def test_release_expired(self):
+        reserve_order(self.make_order(1, 'expired'), ttl=timedelta(seconds=-1))
+        reserve_order(self.make_order(1, 'live'))
+        self.assertEqual(release_expired(batch_size=1), 1)
+        self.assertStock(2)
+
+    def test_release_orders(self):
+        order = self.make_order(2)
+        reserve_order(order)
+        self.assertEqual(release_orders([order]), 1)
+        self.assertEqual(release_orders([order]), 0)  # Already released
+        self.assertStock(3)
+
+    def test_set_stock_subtracts_open_holds(self):
+        order = self.make_order(2)
+        reserve_order(order)
+        set_stock(self.variant.pk, 10)
+        self.assertStock(8)
+        release_orders([order])
+        self.assertStock(10)
+
+    def test_new_hold_gets_a_new_idempotency_key(self):
+        order = self.make_order(1)
+        request = RequestFactory().post('/api/checkout/')
+        first = checkout_session_params(request, order, [], reserve_order(order, ttl=timedelta(seconds=-1)))
+        retried = checkout_session_params(request, order, [], reserve_order(order))
+        self.assertNotEqual(first['idempotency_key'], retried['idempotency_key'])
+        self.assertNotEqual(first['expires_at'], retried['expires_at'])
+
+
+class LineItemCacheTests(TestCase):
+    def test_price_change_is_not_served_from_cache(self):
+        product = Product.objects.create(name='Widget', slug='widget', description='', price=10)
+        order = Order.objects.create(session='cart', ip_address='127.0.0.1')
+        order.cart_items.add(CartItem.objects.create(product=product, quantity=1))
+        cached = get_line_items(order)
+        self.assertEqual(cached[0]['price_data']['unit_amount'], 1000)
+        product.price = 12
+        product.save()
+        order = Order.objects.get(pk=order.pk)  # As the next request loads it
+        repriced = get_line_items(order)
+        self.assertEqual(repriced[0]['price_data']['unit_amount'], 1200)
+
+        # The same hold with new prices must not reuse the Stripe idempotency key
+        request, expires_at = RequestFactory().post('/api/checkout/'), timezone.now()
+        self.assertNotEqual(
+            checkout_session_params(request, order, cached, expires_at)['idempotency_key'],
+            checkout_session_params(request, order, repriced, expires_at)['idempotency_key'],
+        )
+
+    def test_checkout_total_follows_the_cart(self):
+        Product.objects.create(name='Widget', slug='widget', description='', price=Decimal('19.99'))
+        session = self.client.session
+        session.save()
+        for _ in range(2):  # The cart views never save the order, so Order.total stays 0
+            self.client.post(
+                reverse('store:add_to_cart', kwargs={'slug': 'widget'}),
+                HTTP_SESSION_KEY=session.session_key, HTTP_X_REAL_IP='127.0.0.1',
+            )
+        response = self.client.get(reverse('store:checkout_api'))
+        self.assertEqual(Decimal(str(response.json()['total'])), Decimal('39.98'))
+
+
+class CouponTests(TestCase):
+    def setUp(self):
+        coupons.coupon_cache.clear()
+        coupons.negative_cache.clear()
+        self.coupon = Coupon.objects.create(
+            code='save5', description='Five off', discount=5.0, expiration_date=timezone.now() + timedelta(days=1),
+            is_approved=True,
+        )
+
+    def test_unknown_codes_are_cached_apart_from_coupons(self):
+        self.assertEqual(coupons.resolve_coupon(' Save5 '), self.coupon)
+        with self.assertNumQueries(1):
+            self.assertIsNone(coupons.resolve_coupon('bogus'))
+            self.assertIsNone(coupons.resolve_coupon('BOGUS'))
+        with mock.patch.object(coupons.negative_cache, 'max_size', 2):
+            for i in range(10):
+                coupons.resolve_coupon(f'bogus{i}')
+        self.assertEqual(len(coupons.negative_cache._entries), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(coupons.resolve_coupon('SAVE5'), self.coupon)
+
+    def later(self, seconds):
+        """ Move the coupon cache's clock, and the database lookup's, seconds ahead """
+        clock = mock.patch('store.coupons.time.time', return_value=time.time() + seconds)
+        now = mock.patch('store.coupons.timezone.now', return_value=timezone.now() + timedelta(seconds=seconds))
+        for patch in (clock, now):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_entries_expire(self):
+        Coupon.objects.create(
+            code='soon', description='', discount=1, expiration_date=timezone.now() + timedelta(seconds=60),
+            is_approved=True,
+        )
+        for code in ('SAVE5', 'SOON'):
+            coupons.resolve_coupon(code)
+        self.later(61)
+        with self.assertNumQueries(1):
+            self.assertEqual(coupons.resolve_coupon('SAVE5'), self.coupon)  # Within COUPON_CACHE_TTL
+            self.assertIsNone(coupons.resolve_coupon('SOON'))  # Past its own expiration_date
+        self.later(coupons.COUPON_CACHE_TTL + 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(coupons.resolve_coupon('SAVE5'), self.coupon)
+
+    def test_misses_expire(self):
+        self.assertIsNone(coupons.resolve_coupon('LATER'))
+        Coupon.objects.bulk_create([Coupon(
+            code='LATER', description='', discount=1, expiration_date=timezone.now() + timedelta(days=1),
+            is_approved=True,
+        )])  # Sends no signal
+        self.assertIsNone(coupons.resolve_coupon('LATER'))
+        self.later(coupons.COUPON_NEGATIVE_TTL + 1)
+        self.assertEqual(coupons.resolve_coupon('LATER').code, 'LATER')
+
+    def test_saving_and_deleting_invalidate(self):
+        self.assertEqual(coupons.resolve_coupon('SAVE5'), self.coupon)
+        self.coupon.is_approved = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coupon.save()
+        self.assertIsNone(coupons.resolve_coupon('SAVE5'))
+
+        self.assertIsNone(coupons.resolve_coupon('LATER'))
+        later = Coupon.objects.create(
+            code='later', description='', discount=1, expiration_date=timezone.now() + timedelta(days=1),
+            is_approved=True,
+        )
+        self.assertEqual(coupons.resolve_coupon('LATER'), later)
+        later.delete()
+        self.assertIsNone(coupons.resolve_coupon('LATER'))
+
+    def test_changes_in_other_processes_empty_the_cache(self):
+        self.assertEqual(coupons.resolve_coupon('SAVE5'), self.coupon)
+        Coupon.objects.filter(pk=self.coupon.pk).update(is_approved=False)  # Sends no signal here
+        with self.assertNumQueries(0):
+            self.assertEqual(coupons.resolve_coupon('SAVE5'), self.coupon)
+        caches['default'].set(coupons.GENERATION_KEY, 'saved-elsewhere', None)  # As another worker's save does
+        self.assertIsNone(coupons.resolve_coupon('SAVE5'))
+
+    def test_migration_normalizes_stored_codes(self):
+        normalize_codes = import_module('store.migrations.0005_normalize_coupon_codes').normalize_codes
+        expires = timezone.now() + timedelta(days=1)
+        mixed = Coupon.objects.create(code='x', description='', discount=1, expiration_date=expires)
+        clash = Coupon.objects.create(code='y', description='', discount=1, expiration_date=expires)
+        Coupon.objects.filter(pk=mixed.pk).update(code=' Summer10 ')  # As saved before codes were normalized
+        Coupon.objects.filter(pk=clash.pk).update(code='save5')
+        normalize_codes(apps, None)
+        self.assertEqual(
+            dict(Coupon.objects.values_list('pk', 'code')),
+            {self.coupon.pk: 'SAVE5', mixed.pk: 'SUMMER10', clash.pk: 'save5'},
+        )
+
+    def test_checkout_charges_the_coupon(self):
+        Product.objects.create(name='Widget', slug='widget', description='', price=Decimal('19.99'))
+        session = self.client.session
+        session.save()
+        self.client.post(
+            reverse('store:add_to_cart', kwargs={'slug': 'widget'}),
+            HTTP_SESSION_KEY=session.session_key, HTTP_X_REAL_IP='127.0.0.1',
+        )
+        self.assertEqual(self.client.post(reverse('store:apply_coupon'), {'code': 'save5'}).status_code, 200)
+        page = self.client.get(reverse('store:checkout_api')).json()
+        self.assertEqual([Decimal(str(page[key])) for key in ('subtotal', 'discount', 'total')],
+                         [Decimal('19.99'), Decimal('5'), Decimal('14.99')])
+
+        stripe_coupon = f'store-{self.coupon.pk}-500'
+        stripe_session = mock.Mock(id='cs_test', url='https://checkout.stripe.com/c/pay/cs_test')
+        with mock.patch('stripe.Coupon.create') as create_coupon, \
+                mock.patch('stripe.checkout.Session.create', return_value=stripe_session) as create_session:
+            for _ in range(2):
+                self.assertEqual(self.client.post(reverse('store:checkout_api')).status_code, 303)
+        create_coupon.assert_called_once()
+        self.assertEqual(create_coupon.call_args.kwargs['id'], stripe_coupon)
+        self.assertEqual(create_coupon.call_args.kwargs['amount_off'], 500)
+        self.assertEqual(create_session.call_args.kwargs['discounts'], [{'coupon': stripe_coupon}])
+
+        with mock.patch('stripe.Coupon.create_async') as create_coupon, \
+                mock.patch('stripe.checkout.Session.create_async', return_value=stripe_session) as create_session:
+            self.assertEqual(self.client.post(reverse('store:async_checkout')).status_code, 303)
+        create_coupon.assert_not_called()  # Already made by the sync checkout
+        self.assertEqual(create_session.call_args.kwargs['discounts'], [{'coupon': stripe_coupon}])
+
+    def test_order_total_applies_the_coupon(self):
+        product = Product.objects.create(name='Widget', slug='widget', description='', price=Decimal('19.99'))
+        order = Order.objects.create(session='shopper', ip_address='127.0.0.1')
+        order.cart_items.add(CartItem.objects.create(product=product, quantity=2))
+        order.coupon = self.coupon
+        order.save()
+        order.refresh_from_db()
+        self.assertEqual(order.total, Decimal('34.98'))
+
+
+class PopularityRollupTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Widget', slug='widget', description='', price=10)
+
+    def pay(self, quantity, ordered_at):
+        order = Order.objects.create(ip_address='127.0.0.1', ordered=True, ordered_at=ordered_at)
+        order.cart_items.add(CartItem.objects.create(product=self.product, quantity=quantity, ordered=True))
+
+    def buys(self):
+        return PopularProduct.objects.get(product=self.product, window='24h').buys_count
+
+    def test_late_committed_order_is_counted(self):
+        now = timezone.now()
+        self.pay(2, now - timedelta(minutes=10))
+        rollup_popular_products(now)
+        rollup_popular_products(now + timedelta(minutes=1))
+        self.assertEqual(self.buys(), 2)
+        # Paid before the last run, but committed after it read the orders
+        self.pay(1, now + timedelta(seconds=30))
+        rollup_popular_products(now + timedelta(minutes=2))
+        self.assertEqual(self.buys(), 3)
+        rollup_popular_products(now + timedelta(minutes=3))
+        self.assertEqual(self.buys(), 3)
+
+    def test_late_committed_cart_item_is_counted(self):
+        now = timezone.now()
+        CartItem.objects.create(pk=100, product=self.product)
+        rollup_popular_products(now)
+        # Given a lower id, but committed after the last run read the highest one
+        CartItem.objects.create(pk=50, product=self.product)
+        rollup_popular_products(now + timedelta(minutes=1))
+        self.assertEqual(PopularProduct.objects.get(product=self.product, window='24h').cart_count, 2)
+        rollup_popular_products(now + timedelta(minutes=2))
+        self.assertEqual(PopularProduct.objects.get(product=self.product, window='24h').cart_count, 2)
+
+
+@skipUnless(recommendations.np is not None and recommendations.sparse is not None, 'Needs numpy and scipy')
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.products = [
+            Product.objects.create(name=name, slug=name.lower(), description='', price=10)
+            for name in ('Tent', 'Stove', 'Lamp')
+        ]
+        self.state_path = Path(self.enterContext(TemporaryDirectory())) / 'recommendations.npz'
+
+    def pay(self, *products):
+        order = Order.objects.create(ip_address='127.0.0.1', ordered=True, ordered_at=timezone.now())
+        order.cart_items.add(*[CartItem.objects.create(product=product, ordered=True) for product in products])
+
+    def test_deleted_products_are_not_written(self):
+        tent, stove, lamp = self.products
+        for _ in range(2):
+            self.pay(tent, stove, lamp)
+        recommendations.build_recommendations(full=True, path=self.state_path)
+        self.assertEqual(ProductRecommendation.objects.filter(product=tent).count(), 2)
+
+        lamp.delete()  # Still in the saved counts
+        for _ in range(2):
+            self.pay(tent, stove)
+        recommendations.build_recommendations(path=self.state_path)
+        self.assertEqual(list(ProductRecommendation.objects.filter(product=tent).values_list('recommended', flat=True)), [stove.pk])
+        self.assertFalse(ProductRecommendation.objects.exclude(recommended__in=Product.objects.all()).exists())
+
+    def stored(self):
+        return list(ProductRecommendation.objects.order_by('product', 'rank').values_list('product', 'recommended', 'score'))
+
+    def test_incremental_build_matches_a_full_build(self):
+        tent, stove, lamp = self.products
+        for _ in range(2):
+            self.pay(tent, stove)
+        recommendations.build_recommendations(full=True, path=self.state_path)
+
+        mat = Product.objects.create(name='Mat', slug='mat', description='', price=10)
+        for _ in range(3):
+            self.pay(tent, lamp, mat)
+        self.pay(stove, lamp)  # Every product is touched, so every row is rescored
+        recommendations.build_recommendations(path=self.state_path)
+        incremental, state = self.stored(), recommendations.CooccurrenceState.load(self.state_path)
+
+        full_path = self.state_path.with_name('full.npz')
+        recommendations.build_recommendations(full=True, path=full_path)
+        full = recommendations.CooccurrenceState.load(full_path)
+        self.assertEqual(state.index.tolist(), full.index.tolist())
+        self.assertEqual(state.counts.toarray().tolist(), full.counts.toarray().tolist())
+        self.assertEqual(state.n_orders, full.n_orders)
+        self.assertEqual(incremental, self.stored())
+
+
+@override_settings(SITE_URL='https://shop.example.com')
+class SitemapTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch('store.sitemaps.SITEMAP_SHARD_SIZE', 2))
+        category = Category.objects.create(name='Outdoors', slug='outdoors')
+        Subcategory.objects.create(name='Tents', slug='tents', category=category)
+        self.products = [
+            Product.objects.create(name=f'Product {i}', slug=f'product-{i}', description='', price=10) for i in range(5)
+        ]
+        self.root = Path(self.enterContext(TemporaryDirectory()))
+
+    def read(self, root):
+        return {path.name: gzip.decompress(path.read_bytes()).decode() for path in root.glob('*.gz')}
+
+    def test_incremental_build_matches_a_full_build(self):
+        build_sitemaps(root=self.root)
+        self.products[0].name = 'Renamed'
+        self.products[0].save()
+        self.products[1].is_active = False
+        self.products[1].save()
+        added = Product.objects.create(name='Product 5', slug='product-5', description='', price=10)
+        with mock.patch('store.sitemaps.write_shard', wraps=write_shard) as write:
+            build_sitemaps(root=self.root)
+        changed = {(product.pk - 1) // 2 for product in (self.products[0], self.products[1], added)}
+        self.assertEqual({call.args[1:] for call in write.call_args_list}, {('products', shard) for shard in changed})
+        self.assertLess(len(changed), len(list(self.root.glob('sitemap-products-*'))))
+
+        full_root = self.root / 'full'
+        full_root.mkdir()
+        build_sitemaps(full=True, root=full_root)
+        self.assertEqual(self.read(self.root), self.read(full_root))
+
+    def test_emptied_shards_are_removed(self):
+        build_sitemaps(root=self.root)
+        last = Product.objects.create(name='Product 5', slug='product-5', description='', price=10)
+        build_sitemaps(root=self.root)
+        name = f'sitemap-products-{(last.pk - 1) // 2}.xml.gz'
+        self.assertIn(name, self.read(self.root))
+        if (last.pk - 1) % 2:
+            Product.objects.filter(pk=last.pk - 1).update(is_active=False)
+        last.is_active = False
+        last.save()
+        self.assertEqual(build_sitemaps(root=self.root)['removed'], 1)
+        self.assertNotIn(name, self.read(self.root))
+        self.assertNotIn(name, self.read(self.root)['sitemap.xml.gz'])
+
+
+@override_settings(VIEW_LOG_BUFFERED=False)
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Outdoors', slug='outdoors', description='Camping')
+        self.product = Product.objects.create(name='Tent', slug='tent', description='Sleeps two', price='99.50')
+        self.product.categories.add(category)
+        self.url = reverse('store:product_detail', kwargs={'slug': 'tent'})
+
+    def test_listed_fields_and_id_are_kept(self):
+        self.assertEqual(self.client.get(self.url + '?fields=name,price').json(), {
+            'id': self.product.pk, 'name': 'Tent', 'price': '99.50',
+        })
+
+    def test_unknown_fields_are_ignored(self):
+        self.assertEqual(self.client.get(self.url + '?fields=name,bogus').json(), {'id': self.product.pk, 'name': 'Tent'})
+        self.assertEqual(self.client.get(self.url + '?fields=bogus').json(), {'id': self.product.pk})
+        self.assertEqual(set(self.client.get(self.url + '?fields=,').json()), set(self.client.get(self.url).json()))
+
+    def test_nested_serializers_are_returned_whole(self):
+        data = self.client.get(self.url + '?fields=categories').json()
+        self.assertEqual(set(data), {'id', 'categories'})
+        self.assertEqual(data['categories'][0]['description'], 'Camping')
+        # Dotted names are not supported: they are unknown top-level fields
+        self.assertEqual(self.client.get(self.url + '?fields=categories.name').json(), {'id': self.product.pk})
+
+    def test_lists_trim_each_item_and_keep_pagination(self):
+        for url in (reverse('store:active_products'), reverse('store:async_active_products')):
+            with self.subTest(url=url):
+                data = self.client.get(url + '?fields=slug').json()
+                self.assertIn('next', data)
+                self.assertEqual(data['results'], [{'id': self.product.pk, 'slug': 'tent'}])
+        data = self.client.get(reverse('store:bulk_products') + '?slugs=tent&fields=slug').json()
+        self.assertEqual(data['results'], [{'id': self.product.pk, 'slug': 'tent'}])
+
+
+@skipUnless(renderers.orjson is not None, 'Needs orjson')
+class FastJSONRendererTests(TestCase):
+    def test_output_matches_the_stock_renderer(self):
+        data = {
+            'price': Decimal('9.90'),
+            'zero': Decimal('0.00'),
+            'at': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc),
+            'naive': datetime(2024, 5, 1, 12, 30),
+            'day': date(2024, 5, 1),
+            'time': dt_time(8, 15, 30, 250000),
+            'duration': timedelta(hours=1, seconds=5),
+            'id': UUID('12345678-1234-5678-1234-567812345678'),
+            'label': gettext_lazy('Products'),
+            'separators': 'a\u2028b\u2029c',
+            'unicode': 'Caf\u00e9',
+            1: 'non-string key',
+            'nested': [{'price': Decimal('1.5')}, None, True, 2.5],
+        }
+        fast = renderers.FastJSONRenderer().render(data)
+        self.assertEqual(fast, JSONRenderer().render(data))
+        self.assertIn(b'"price":9.9,', fast)  # As DRF's encoder; serializer fields send strings
+        self.assertIn(b'"at":"2024-05-01T12:30:15.123456Z"', fast)
+        self.assertNotIn('\u2028'.encode(), fast)
+
+    def test_none_renders_nothing(self):
+        self.assertEqual(renderers.FastJSONRenderer().render(None), b'')
+
+    def test_indented_output_falls_back(self):
+        data = {'price': Decimal('9.90')}
+        self.assertEqual(
+            renderers.FastJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'),
+        )
+
+
+class GenerateCatalogTests(TestCase):
+    counts = {'categories': 3, 'subcategories': 5, 'products': 20, 'users': 10, 'reviews': 30, 'views': 50, 'orders': 15}
+
+    def generate(self, seed=0, **options):
+        with mock.patch('django.utils.timezone.now', return_value=datetime(2024, 5, 1, tzinfo=dt_timezone.utc)), \
+                mock.patch('store.management.commands.generate_catalog.response_cache.purge'):
+            call_command('generate_catalog', seed=seed, stdout=StringIO(), **self.counts, **options)
+        return self.snapshot()
+
+    def snapshot(self):
+        """ The generated rows, by their generated names rather than primary keys """
+        return {
+            'categories': list(Category.objects.order_by('slug').values_list('slug', 'name', 'created_at')),
+            'subcategories': list(Subcategory.objects.order_by('slug').values_list('slug', 'category__slug', 'is_active')),
+            'products': list(Product.objects.order_by('slug').values_list(
+                'slug', 'vendor', 'price', 'discount_price', 'is_active', 'is_featured', 'created_at', 'updated_at',
+            )),
+            'categories of products': sorted(Product.categories.through.objects.values_list('product__slug', 'category__slug')),
+            'variants': sorted(ProductVariant.objects.values_list('product__slug', 'title', 'inventory_quantity')),
+            'users': list(User.objects.order_by('username').values_list('username', 'first_name', 'date_joined')),
+            'reviews': sorted(ProductReview.objects.values_list('product__slug', 'user__username', 'rating', 'date')),
+            'views': sorted(ProductViewLog.objects.values_list('product__slug', 'user__username', 'ip_address', 'viewed_at'), key=str),
+            'orders': list(Order.objects.order_by('order_number').values_list(
+                'order_number', 'user__username', 'ordered', 'status', 'total', 'created_at', 'ordered_at',
+            )),
+            'cart items': sorted(Order.cart_items.through.objects.values_list(
+                'order__order_number', 'cartitem__product__slug', 'cartitem__variant__title', 'cartitem__quantity',
+            )),
+        }
+
+    def test_row_counts(self):
+        rows = self.generate()
+        for name, count in self.counts.items():
+            with self.subTest(name=name):
+                self.assertEqual(len(rows[name]), count)
+        self.assertGreaterEqual(len(rows['variants']), self.counts['products'])
+        self.assertEqual({slug for slug, _ in rows['categories of products']}, {row[0] for row in rows['products']})
+        self.assertEqual(len({order for order, *_ in rows['cart items']}), self.counts['orders'])
+
+    def test_same_seed_gives_the_same_data(self):
+        first = self.generate(seed=7)
+        with self.assertRaises(CommandError):
+            self.generate(seed=7)  # Already present
+        self.assertEqual(self.generate(seed=7, flush=True), first)
+        self.assertNotEqual(self.generate(seed=8, flush=True)['products'], first['products'])
+
+
+class GoogleFeedTests(TestCase):
+    def test_products_without_a_discount(self):
+        Product.objects.create(name='No discount', slug='no-discount', description='', price=10, discount_price=None)
+        Product.objects.create(name='Zero discount', slug='zero-discount', description='', price=10, discount_price=0)
+        Product.objects.create(name='On sale', slug='on-sale', description='', price=10, discount_price=8)
+        feed = ''.join(iter_feed('http://testserver'))
+        self.assertEqual(feed.count('<item>'), 3)
+        self.assertEqual(re.findall(r'<g:sale_price>(.*?)</g:sale_price>', feed), ['8.00 USD'])
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Widget', slug='widget', description='', price=10)
+        self.key = product_key(self.product.pk)
+        self.request = RequestFactory().get('/api/products/widget/')
+        response_cache.cache.clear()
+
+    def store(self):
+        response_cache.set(self.request, HttpResponse('cached'), [self.key])
+
+    def test_evicted_version_is_a_miss(self):
+        self.store()
+        with self.captureOnCommitCallbacks(execute=True):
+            response_cache.purge([self.key])
+        response_cache.cache.delete(VERSION_PREFIX + self.key)  # As a full cache would cull it
+        self.assertIsNone(response_cache.get(self.request))
+
+    def test_variant_and_image_changes_purge_the_product(self):
+        for create in (
+            lambda: ProductVariant.objects.create(product=self.product, variant_id='v1', title='Default', price=10),
+            lambda: ProductImage.objects.create(product=self.product, image_url='https://example.com/widget.png'),
+        ):
+            self.store()
+            self.assertIsNotNone(response_cache.get(self.request))
+            with self.captureOnCommitCallbacks(execute=True):
+                create()
+            self.assertIsNone(response_cache.get(self.request))
+
+    def test_replica_reads_are_not_stored_right_after_a_purge(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response_cache.purge([self.key])
+        self.assertFalse(response_cache.set(self.request, HttpResponse('stale?'), [self.key], replica_read=True))
+        self.assertTrue(response_cache.set(self.request, HttpResponse('fresh'), [self.key]))  # Read on the primary
+        later = time.time() + settings.REPLICA_PIN_SECONDS + 1
+        with mock.patch('store.responsecache.time.time', return_value=later):
+            self.assertTrue(response_cache.set(self.request, HttpResponse('caught up'), [self.key], replica_read=True))
+
+    def test_admin_bulk_action_purges(self):
+        self.store()
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductAdmin(Product, admin.site).make_inactive(None, Product.objects.filter(pk=self.product.pk))
+        self.assertIsNone(response_cache.get(self.request))
+
+
+class ProductCacheTests(TestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.product = Product.objects.create(name='Widget', slug='widget', description='', price=10)
+
+    def test_inactive_products_are_missing(self):
+        Product.objects.create(name='Retired', slug='retired', description='', price=10, is_active=False)
+        by_id, by_slug = get_products(slugs=['widget', 'retired'])
+        self.assertEqual(list(by_slug), ['widget'])
+
+    def test_purge_during_load_is_not_cached_over(self):
+        serialize = productcache.ProductSerializer
+
+        def purge_while_serializing(*args, **kwargs):
+            response_cache._purge([product_key(self.product.pk)])  # A save that commits mid-load
+            return serialize(*args, **kwargs)
+
+        with mock.patch.object(productcache, 'ProductSerializer', side_effect=purge_while_serializing):
+            get_products(ids=[self.product.pk])
+        self.assertEqual(productcache.cached_entries([self.product.pk]), {})
+        get_products(ids=[self.product.pk])
+        self.assertIn(self.product.pk, productcache.cached_entries([self.product.pk]))
+
+
+class BatchTests(TransactionTestCase):
+    """ A TransactionTestCase: concurrent sub-requests read from other threads, outside the test's transaction """
+
+    def test_subrequests_drop_the_outer_body(self):
+        request = RequestFactory().post('/api/batch/', '{"requests": []}', content_type='application/json')
+        request.session, request.user = {}, AnonymousUser()
+        sub = build_subrequest(request, '/api/products/?page=2')
+        self.assertNotIn('CONTENT_LENGTH', sub.META)
+        self.assertNotIn('CONTENT_TYPE', sub.META)
+        self.assertNotIn('wsgi.input', sub.META)
+        self.assertEqual(sub.META['QUERY_STRING'], 'page=2')
+
+    def test_batch(self):
+        Product.objects.create(name='Widget', slug='widget', description='', price=10)
+        response = self.client.post(
+            reverse('store:batch'), {'requests': ['/api/products/', '/api/navbar/', '/nowhere/']},
+            content_type='application/json',
+        )
+        self.assertEqual([result['status'] for result in response.json()['responses']], [200, 200, 404])
+        self.assertEqual(response.json()['responses'][0]['body']['count'], 1)
+
+    def test_only_api_views_are_run(self):
+        with mock.patch('store.views.iter_feed') as iter_feed, mock.patch('store.views.metrics.render') as render:
+            response = self.client.post(
+                reverse('store:batch'), {'requests': ['/google_base.xml/', '/metrics', '/robots.txt/']},
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.json()['responses']], [400, 400, 400])
+        iter_feed.assert_not_called()
+        render.assert_not_called()
+
+    def test_streaming_and_non_json_responses_are_not_read(self):
+        read = []
+
+        def chunks():
+            read.append(True)
+            yield b'<feed/>'
+
+        self.assertEqual(response_result(StreamingHttpResponse(chunks(), content_type='application/xml'))[0], 415)
+        self.assertEqual(read, [])
+        self.assertEqual(response_result(HttpResponse('<p>', content_type='text/html'))[0], 415)
+        self.assertEqual(response_result(HttpResponse('{"a": 1}', content_type='application/json')), (200, {'a': 1}))
+
+
+@skipUnless(metrics.prometheus_client is not None, 'Needs prometheus_client')
+class MetricsViewTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.shopper = User.objects.create_user('shopper', password='secret')
+
+    @override_settings(METRICS_TOKEN='')
+    def test_staff_only_without_a_token(self):
+        self.assertEqual(self.client.get(reverse('store:metrics')).status_code, 403)
+        self.client.force_login(self.shopper)
+        self.assertEqual(self.client.get(reverse('store:metrics')).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('store:metrics')).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='scrape')
+    def test_token_is_required_when_set(self):
+        self.assertEqual(self.client.get(reverse('store:metrics')).status_code, 401)
+        self.assertEqual(self.client.get(reverse('store:metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.client.get(reverse('store:metrics'), HTTP_AUTHORIZATION='Bearer scrape').status_code, 200)
+
+
+class AsyncCheckoutCsrfTests(TestCase):
+    """ The async checkout applies CSRF checks like the DRF CheckoutAPIView """
+
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+
+    def test_anonymous_clients_are_not_checked(self):
+        for name in ('checkout_api', 'async_checkout'):
+            with self.subTest(name=name):
+                self.assertEqual(self.client.post(reverse(f'store:{name}')).status_code, 400)  # No open order
+
+    def test_session_users_need_a_token(self):
+        self.client.force_login(User.objects.create_user('shopper', password='secret'))
+        for name in ('checkout_api', 'async_checkout'):
+            with self.subTest(name=name):
+                self.assertEqual(self.client.post(reverse(f'store:{name}')).status_code, 403)
+
+
+@override_settings(VIEW_LOG_BUFFERED=False)
+class ProfilerTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.shopper = User.objects.create_user('shopper', password='secret')
+        Product.objects.create(name='Tent', slug='tent', description='', price=10)
+        self.url = reverse('store:product_detail', kwargs={'slug': 'tent'})
+
+    def profiled(self, response):
+        self.assertEqual(response.status_code, 200)
+        return response.has_header('X-Profile-Id')
+
+    def test_only_staff_can_ask_with_the_query_flag(self):
+        self.assertFalse(self.profiled(self.client.get(self.url + '?_profile=1')))
+        self.client.force_login(self.shopper)
+        self.assertFalse(self.profiled(self.client.get(self.url + '?_profile=1')))
+        self.assertFalse(RequestProfile.objects.exists())
+
+        self.client.force_login(self.staff)
+        for url in (self.url, reverse('store:async_product_detail', kwargs={'slug': 'tent'})):
+            with self.subTest(url=url):
+                response = self.client.get(url + '?_profile=1')
+                self.assertTrue(self.profiled(response))
+                profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+                self.assertEqual((profile.user, profile.path, profile.status_code), (self.staff, url, 200))
+
+    def test_signed_token_profiles_any_client(self):
+        self.assertTrue(self.profiled(self.client.get(self.url, HTTP_X_PROFILE_TOKEN=profiler.make_profile_token())))
+        self.assertFalse(self.profiled(self.client.get(self.url, HTTP_X_PROFILE_TOKEN='profile:forged')))
+        with override_settings(PROFILE_TOKEN_MAX_AGE=-1):
+            self.assertFalse(self.profiled(self.client.get(self.url, HTTP_X_PROFILE_TOKEN=profiler.make_profile_token())))
+
+    def test_sampler_stops_when_the_view_raises(self):
+        def view(request):
+            raise RuntimeError('view failed')
+
+        async def async_view(request):
+            raise RuntimeError('view failed')
+
+        async def auser():
+            return self.staff
+
+        samplers = []
+
+        def start_sampler(**kwargs):
+            samplers.append(profiler.StackSampler(threading.get_ident(), 0.001).start())
+            return samplers[-1]
+
+        for get_response in (view, async_view):
+            with self.subTest(get_response=get_response.__name__):
+                request = RequestFactory().get('/?_profile=1')
+                request.user, request.auser = self.staff, auser
+                with mock.patch('store.middleware.profiler.start_sampler', side_effect=start_sampler), \
+                        self.assertRaises(RuntimeError):
+                    response = ProfilerMiddleware(get_response)(request)
+                    if asyncio.iscoroutine(response):
+                        asyncio.run(response)
+                self.assertFalse(samplers[-1]._thread.is_alive())
+        self.assertEqual(len(samplers), 2)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(REQUEST_PROFILE_KEEP=2)
+    def test_only_the_newest_profiles_are_kept(self):
+        self.client.force_login(self.staff)
+        ids = [int(self.client.get(self.url + '?_profile=1')['X-Profile-Id']) for _ in range(4)]
+        self.assertEqual(sorted(RequestProfile.objects.values_list('pk', flat=True)), ids[-2:])
+
+
+class LogQueueTests(SimpleTestCase):
+    def record(self, msg, **extra):
+        return logging.makeLogRecord({'name': 'store.test', 'levelno': logging.INFO, 'levelname': 'INFO', 'msg': msg, **extra})
+
+    def test_full_queue_drops_and_reports_records(self):
+        handler = logs.NonBlockingQueueHandler(queue.Queue(2))
+        for i in range(4):
+            handler.handle(self.record(f'line {i}'))
+        self.assertEqual((handler.dropped, handler.unreported), (2, 2))
+
+        handler.queue.get_nowait()
+        handler.handle(self.record('no room left for the warning'))
+        self.assertEqual(handler.unreported, 2)
+        self.assertEqual([handler.queue.get_nowait().msg for _ in range(2)], ['line 1', 'no room left for the warning'])
+
+        handler.handle(self.record('line 5'))
+        queued = [handler.queue.get_nowait() for _ in range(2)]
+        self.assertEqual([record.msg for record in queued], ['line 5', 'Log queue full, dropped 2 records'])
+        self.assertEqual(queued[1].levelname, 'WARNING')
+        self.assertEqual((handler.dropped, handler.unreported), (2, 0))
+
+    def test_json_formatter_fields(self):
+        try:
+            raise ValueError('bad value')
+        except ValueError:
+            record = self.record('paid %s', args=('ORD-1',), exc_info=sys.exc_info(), order_id=7, amount=Decimal('9.90'))
+        # As the listener sees it: after the queue handler's prepare()
+        prepared = logs.NonBlockingQueueHandler(queue.Queue()).prepare(record)
+        entry = json.loads(logs.JsonFormatter().format(prepared))
+        self.assertEqual(set(entry), {'time', 'level', 'logger', 'message', 'order_id', 'amount', 'exc'})
+        self.assertEqual(
+            (entry['level'], entry['logger'], entry['message'], entry['order_id'], entry['amount']),
+            ('INFO', 'store.test', 'paid ORD-1', 7, '9.90'),
+        )
+        self.assertRegex(entry['time'], r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3}\+00:00$')
+        self.assertIn('ValueError: bad value', entry['exc'])
+        self.assertIsNotNone(record.exc_info)  # The original record is left for other handlers
+
+
+class AccessLogTests(TestCase):
+    def setUp(self):
+        Product.objects.create(name='Tent', slug='tent', description='', price=10)
+        self.url = reverse('store:active_products')  # access_log_sample_rate = 0.1
+
+    def get(self, url, draw):
+        with mock.patch('store.middleware.random.random', return_value=draw):
+            return self.client.get(url)
+
+    def test_successful_requests_are_sampled_by_view(self):
+        with self.assertNoLogs('store.access', 'INFO'):
+            self.get(self.url, 0.5)
+        with self.assertLogs('store.access', 'INFO') as logged:
+            self.get(self.url, 0.05)
+        record = logged.records[0]
+        self.assertEqual((record.method, record.path, record.status, record.view), ('GET', self.url, 200, 'store:active_products'))
+        self.assertEqual(record.sample_rate, 0.1)
+
+    def test_unsampled_views_are_always_logged(self):
+        with self.assertLogs('store.access', 'INFO') as logged:
+            self.get(reverse('store:robots_txt'), 0.99)
+        self.assertEqual(logged.records[0].sample_rate, 1.0)
+
+    def test_errors_and_slow_requests_are_always_logged(self):
+        with self.assertLogs('store.access', 'INFO') as logged:
+            self.get(reverse('store:product_detail', kwargs={'slug': 'missing'}), 0.99)
+        self.assertEqual((logged.records[0].status, logged.records[0].sample_rate), (404, 1.0))
+        with override_settings(ACCESS_LOG_SLOW_MS=0), self.assertLogs('store.access', 'INFO') as logged:
+            self.get(self.url, 0.99)
+        self.assertEqual((logged.records[0].status, logged.records[0].sample_rate), (200, 1.0))
+
+
+class ReplicaRoutingTests(TestCase):
+    """
+    Routing against SQLite replica files, as DATABASE_REPLICAS configures
+    them: replica1 is a copy of the primary's schema without its data, and
+    replica2 a file that did not exist.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = TemporaryDirectory()
+        primary = connections['default']
+        for alias in ('replica1', 'replica2'):
+            path = Path(cls.tmp.name) / f'{alias}.sqlite3'
+            connections[alias] = primary.__class__({**primary.settings_dict, 'NAME': str(path)}, alias)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'")
+            schema = ';'.join(sql for sql, in cursor.fetchall())
+        target = sqlite3.connect(connections['replica1'].settings_dict['NAME'])
+        try:
+            target.executescript(schema)
+        finally:
+            target.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in ('replica1', 'replica2'):
+            connections[alias].close()
+            del connections[alias]
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        health = mock.patch.object(routers, 'replica_health', routers.ReplicaHealth())
+        health.start()
+        self.addCleanup(health.stop)
+        response_cache.cache.clear()
+        Product.objects.create(name='Widget', slug='widget', description='', price=10)
+
+    def read(self, pinned=False, write=False):
+        token = routers.begin_request(pinned=pinned)
+        try:
+            routers.current_state().use_replica = True
+            if write:
+                Product.objects.create(name='Gadget', slug='gadget', description='', price=10)
+            return routers.PrimaryReplicaRouter().db_for_read(Product), Product.objects.count()
+        finally:
+            routers.end_request(token)
+
+    @override_settings(DATABASE_REPLICA_ALIASES=['replica1'])
+    def test_reads_go_to_a_healthy_replica(self):
+        self.assertEqual(self.read(), ('replica1', 0))  # The replica has not caught up
+        self.assertEqual(self.read(pinned=True), (routers.PRIMARY, 1))
+
+    @override_settings(DATABASE_REPLICA_ALIASES=['replica1'])
+    def test_reads_after_a_write_go_to_the_primary(self):
+        self.assertEqual(self.read(write=True), (routers.PRIMARY, 2))
+
+    @override_settings(DATABASE_REPLICA_ALIASES=['replica2'])
+    def test_empty_replica_falls_back_to_the_primary(self):
+        self.assertEqual(self.read(), (routers.PRIMARY, 1))
+        self.assertIn('replica2', routers.replica_health.down_until)
+
+    @override_settings(DATABASE_REPLICA_ALIASES=['replica1'])
+    def test_lagging_replica_reads_are_not_cached_after_a_purge(self):
+        url = reverse('store:active_products')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Gadget', slug='gadget', description='', price=10)  # Purges 'products'
+        for _ in range(2):
+            response = self.client.get(url)
+            self.assertEqual((response.json()['count'], response['X-Cache']), (0, 'MISS'))  # Not replayed yet
+        later = time.time() + settings.REPLICA_PIN_SECONDS + 1
+        with mock.patch('store.responsecache.time.time', return_value=later):
+            self.client.get(url)
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+    @override_settings(DATABASE_REPLICA_ALIASES=['replica1'])
+    def test_pin_cookie_keeps_reads_on_the_primary(self):
+        self.assertEqual(self.client.get(reverse('store:active_products')).json()['count'], 0)
+        response_cache.cache.clear()
+        self.client.cookies[routers.PIN_COOKIE] = str(int(time.time()) + 60)
+        self.assertEqual(self.client.get(reverse('store:active_products')).json()['count'], 1)
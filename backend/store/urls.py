@@ -1,43 +1,37 @@
-from django.urls import path, include
-from rest_framework.routers import DefaultRouter
+from django.urls import path
+from . import async_views
 from .views import (
-    ProductViewSet, CategoryViewSet, SubcategoryViewSet, ProductReviewViewSet,
-    OrderViewSet, PopularProductViewSet, UserProfileViewSet, 
-    HomeView, SearchResultsView, UserProfileLoginView, Logout, 
-    ForgotPasswordView, OrderSuccessView, cart, google_base, robots_txt
+    ActiveProductListView, FeaturedProductListView, CategoryProductListView, ProductDetailView,
+    SubcategoryDetailView, SubcategoryListView, SearchResultsView, UserLoginAPI,
+    ForgotPasswordView, OrderSuccessAPI, StripeWebhookView, google_base, robots_txt, sitemap_index, sitemap_shard,
     UserProfileView, SignupView, LogoutView, UserProfileUpdateView,
     PasswordChangeView, ForgotPasswordView, ConfirmThePasswordResetView,
-    OrderHistoryView, SearchResultsView, navbar_data
+    OrderHistoryView, OrderDetailView, SearchResultsView, navbar_data, ApplyCouponView,
+    PopularProductListAPIView, ResponseCacheStatsView, BulkProductView, BatchView, metrics_view,
+    AddToCartView, CheckoutAPIView,
 )
 
 app_name = 'store'
 
-# Create a router and register the viewsets with it
-router = DefaultRouter()
-router.register(r'products', ProductViewSet, basename='products')
-router.register(r'categories', CategoryViewSet, basename='categories')
-router.register(r'subcategories', SubcategoryViewSet, basename='subcategories')
-router.register(r'product-reviews', ProductReviewViewSet, basename='product-reviews')
-router.register(r'orders', OrderViewSet, basename='orders')
-router.register(r'popular-products', PopularProductViewSet, basename='popular-products')
-router.register(r'profile', UserProfileViewSet, basename='profile')
-
-# Add the remaining URLs outside the router
 urlpatterns = [
-    path('', HomeView.as_view(), name='home'),  # Home view
+    path('', ActiveProductListView.as_view(), name='home'),  # The catalog is the home page of the API
     path('api/navbar/', navbar_data, name='navbar-data'),
     path('search/', SearchResultsView.as_view(), name='search'),  # Search functionality
-    path('login/', UserProfileLoginView.as_view(), name='login'),  # Login view
-    path('logout/', Logout.as_view(), name='logout'),  # Logout view
+    path('login/', UserLoginAPI.as_view(), name='login'),  # Token login
+    path('logout/', LogoutView.as_view(), name='logout'),  # Logout view
     path('passwordreset/', ForgotPasswordView.as_view(), name='passwordreset'),  # Password reset
-    path('order/success/', OrderSuccessView.as_view(), name='order_success'),  # Order success page
-    path('cart/', cart.view_cart, name='cart'),  # Cart functionality
-    path('add-to-cart/<slug>/', cart.add_to_cart, name='add-to-cart'),
-    path('remove-from-cart/<slug>/', cart.remove_from_cart, name='remove-from-cart'),
-    path('checkout/', cart.checkout, name='checkout'),  # Checkout page
-    path('order-summary/', cart.view_cart, name='order-summary'),
+    path('order/success/', OrderSuccessAPI.as_view(), name='order_success'),  # Order success page
+    path('api/stripe/webhook/', StripeWebhookView.as_view(), name='stripe_webhook'),  # Stripe events
+    path('add-to-cart/<slug>/', AddToCartView.as_view(), name='add-to-cart'),
+    path('checkout/', CheckoutAPIView.as_view(), name='checkout'),  # Checkout page
+    path('api/cart/add/<slug:slug>/', AddToCartView.as_view(), name='add_to_cart'),
+    path('api/cart/coupon/', ApplyCouponView.as_view(), name='apply_coupon'),
+    path('api/checkout/', CheckoutAPIView.as_view(), name='checkout_api'),
     path('google_base.xml/', google_base, name='google_base'),  # Google base
     path('robots.txt/', robots_txt, name='robots_txt'),  # Robots.txt
+    path('sitemap.xml', sitemap_index, name='sitemap_index'),  # Sitemap index
+    path('sitemaps/<str:filename>', sitemap_shard, name='sitemap_shard'),  # Gzipped sitemap shards
+    path('metrics', metrics_view, name='metrics'),  # Prometheus
     path('api/profile/', UserProfileView.as_view(), name='profile'),
     path('api/signup/', SignupView.as_view(), name='signup'),
     path('api/logout/', LogoutView.as_view(), name='logout'),
@@ -46,12 +40,22 @@ urlpatterns = [
     path('api/password/reset/', ForgotPasswordView.as_view(), name='password_reset'),
     path('api/password/reset/confirm/<uidb64>/<token>/', ConfirmThePasswordResetView.as_view(), name='password_reset_confirm'),
     path('api/orders/', OrderHistoryView.as_view(), name='order_history'),
+    path('api/orders/<str:order_number>/', OrderDetailView.as_view(), name='order_detail'),
     path('api/search/', SearchResultsView.as_view(), name='search'),
     path('api/products/', ActiveProductListView.as_view(), name='active_products'),
     path('api/products/featured/', FeaturedProductListView.as_view(), name='featured_products'),
+    path('api/products/popular/', PopularProductListAPIView.as_view(), name='popular_products'),
+    path('api/products/bulk/', BulkProductView.as_view(), name='bulk_products'),
+    path('api/cache/stats/', ResponseCacheStatsView.as_view(), name='response_cache_stats'),
+    path('api/batch/', BatchView.as_view(), name='batch'),
     path('api/categories/<slug:slug>/products/', CategoryProductListView.as_view(), name='category_products'),
     path('api/categories/<slug:category_slug>/subcategories/<slug:slug>/', SubcategoryDetailView.as_view(), name='subcategory_detail'),
     path('api/categories/<slug:category_slug>/subcategories/', SubcategoryListView.as_view(), name='subcategory_list'),
     path('api/products/<slug:slug>/', ProductDetailView.as_view(), name='product_detail'),
-    path('', include(router.urls)),  # Include all router-generated URLs
-]
\ No newline at end of file
+    # Async (ASGI) variants of the hot endpoints
+    path('api/async/products/', async_views.product_list, name='async_active_products'),
+    path('api/async/products/featured/', async_views.featured_products, name='async_featured_products'),
+    path('api/async/products/<slug:slug>/', async_views.product_detail, name='async_product_detail'),
+    path('api/async/categories/<slug:slug>/products/', async_views.category_products, name='async_category_products'),
+    path('api/async/checkout/', async_views.checkout, name='async_checkout'),
+]
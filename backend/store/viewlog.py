@@ -0,0 +1,139 @@
+"""
+Buffered ProductViewLog writer.
+
+One INSERT per product page view serializes all traffic on the SQLite write
+lock. record_view() only appends to an in-process buffer. A background thread
+writes the buffer with bulk_create once it holds VIEW_LOG_BATCH_SIZE rows or
+every VIEW_LOG_FLUSH_INTERVAL seconds, and once more at interpreter exit.
+Past half of VIEW_LOG_MAX_BUFFER new views are sampled, and at the limit they
+are dropped, so a slow database never blocks a request.
+viewed_at is stamped when the row is written, at most one flush interval late.
+"""
+import atexit
+import logging
+import os
+import random
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from .models import ProductViewLog
+
+logger = logging.getLogger(__name__)
+
+VIEW_LOG_BATCH_SIZE = 500
+VIEW_LOG_FLUSH_INTERVAL = 2.0
+VIEW_LOG_MAX_BUFFER = 20000
+VIEW_LOG_SAMPLE_RATE = 0.1  # Share of views kept while the buffer is over half full
+
+
+class ViewLogBuffer:
+    def __init__(self, batch_size=VIEW_LOG_BATCH_SIZE, flush_interval=VIEW_LOG_FLUSH_INTERVAL,
+                 max_buffer=VIEW_LOG_MAX_BUFFER, sample_rate=VIEW_LOG_SAMPLE_RATE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.sample_rate = sample_rate
+        self.written = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._thread = None
+
+    def record(self, product_id, user_id=None, ip_address=None, tracking_id=''):
+        """ Queue one view; never blocks on the database. Returns False if the view was not kept """
+        self._ensure_started()
+        depth = len(self._pending)
+        if depth >= self.max_buffer:
+            self.dropped += 1
+            return False
+        if depth >= self.max_buffer // 2 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return False
+
+        view = ProductViewLog(
+            product_id=product_id, user_id=user_id, ip_address=ip_address or None, tracking_id=tracking_id or ''
+        )
+        with self._lock:
+            self._pending.append(view)
+        if depth + 1 >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """ Write everything buffered so far and return the number of rows written """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, deque()
+            if not batch:
+                return 0
+            try:
+                ProductViewLog.objects.bulk_create(batch, batch_size=self.batch_size)
+            except DatabaseError:
+                self.dropped += len(batch)
+                logger.exception('Dropped %d product view logs', len(batch))
+                return 0
+            finally:
+                connection.close_if_unusable_or_obsolete()
+            self.written += len(batch)
+            return len(batch)
+
+    def _ensure_started(self):
+        # Workers forked from a preloaded master do not inherit the thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pending = deque()
+            self._thread = threading.Thread(target=self._run, name='view-log-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Product view log flush failed')
+
+
+view_log_buffer = ViewLogBuffer()
+atexit.register(view_log_buffer.flush)
+
+
+def client_ip(request):
+    return request.META.get('HTTP_X_REAL_IP') or request.META.get('REMOTE_ADDR')
+
+
+def record_view(request, product_id):
+    """ Log a product view for the current request """
+    user_id = request.user.pk if request.user.is_authenticated else None
+    tracking_id = request.session.get('visitor_id', '') if hasattr(request, 'session') else ''
+    if settings.VIEW_LOG_BUFFERED:
+        view_log_buffer.record(product_id, user_id, client_ip(request), tracking_id)
+    else:
+        ProductViewLog.objects.create(
+            product_id=product_id, user_id=user_id, ip_address=client_ip(request) or None, tracking_id=tracking_id
+        )
+
+
+async def arecord_view(request, product_id):
+    """ record_view() for async views; never touches the database from the event loop """
+    user = await request.auser()
+    user_id = user.pk if user.is_authenticated else None
+    tracking_id = await request.session.aget('visitor_id', '') if hasattr(request, 'session') else ''
+    if settings.VIEW_LOG_BUFFERED:
+        view_log_buffer.record(product_id, user_id, client_ip(request), tracking_id)
+    else:
+        await ProductViewLog.objects.acreate(
+            product_id=product_id, user_id=user_id, ip_address=client_ip(request) or None, tracking_id=tracking_id
+        )
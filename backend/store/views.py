@@ -1,13 +1,19 @@
+import os
 import time
 import hashlib
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
 from uuid import uuid4
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.shortcuts import get_object_or_404, redirect
 from django.contrib import messages
 from django.conf import settings
-from django.urls import reverse_lazy
-from django.http import HttpResponse
-from django.db.models import Q
+from django.urls import reverse, reverse_lazy
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 import stripe
 
 from rest_framework import generics, serializers, status
@@ -17,13 +23,34 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.decorators import api_view
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
 
+from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth.views import PasswordResetView, PasswordResetConfirmView
 
 from .models import ProductReview, Product, PopularProduct, CartItem, Order, Subcategory, Category, UserProfile
-from .serializers import ProductReviewSerializer, PopularProductSerializer, ProductSerializer, SubcategorySerializer, OrderSerializer, UserProfileSerializer, UpdateUserProfileSerializer
+from .serializers import ProductReviewSerializer, PopularProductSerializer, ProductSerializer, ProductDetailSerializer, SubcategorySerializer, OrderSummarySerializer, OrderDetailSerializer, UserProfileSerializer, UpdateUserProfileSerializer, requested_fields
+from .payments import construct_event, process_events
+from .checkout import (
+    coupon_discount, create_checkout_session, get_line_items, get_open_order, line_items_total, order_coupon,
+)
+from .inventory import InsufficientStock, reserve_order, release_orders
+from .coupons import resolve_coupon
+from .viewlog import record_view
+from .popularity import WINDOWS
+from .feeds import iter_feed
+from .files import accepts_gzip, gunzip_chunks, serve_file
+from .sitemaps import INDEX_NAME, SHARD_NAME_RE
+from .productcache import get_products
+from .batch import BatchError, run_batch
+from .responsecache import SurrogateKeyMixin, category_key, product_ids, product_key, response_cache, subcategory_key
+from .routers import replica_reads
+from .queries import query_budget
+from .logs import access_log_sample
+from . import metrics
 
 # Other specific imports based on microservice usage
 from rest_framework.decorators import api_view
@@ -31,6 +58,9 @@ from rest_framework.response import Response
 from .models import Category
 
 
+@replica_reads
+@query_budget(2)
+@access_log_sample(0.1)
 @api_view(['GET'])
 def navbar_data(request):
     # Fetch categories from the Category model
@@ -79,6 +109,7 @@ class SessionView(APIView):
             return Response({"message": "Existing session", "session_key": request.session.session_key})
 
 class AddToCartView(APIView):
+    @transaction.atomic  # One write transaction (BEGIN IMMEDIATE on SQLite) for the read-modify-write
     def post(self, request, slug):
         # Get the session key from the session service
         session_key = request.headers.get('Session-Key')
@@ -93,6 +124,8 @@ class AddToCartView(APIView):
         existing_order = Order.objects.filter(session=session_key, ordered=False).first()
 
         if existing_order:
+            # Bump the order version so cached checkout line items are rebuilt
+            Order.objects.filter(pk=existing_order.pk).update(last_updated=timezone.now())
             if existing_order.cart_items.filter(product__slug=slug).exists():
                 order_item.quantity += 1
                 order_item.save()
@@ -137,105 +170,188 @@ class GenerateOrderNumberView(APIView):
     
 
 class OrderSuccessAPI(APIView):
+    """ Local status read; the order itself is completed by StripeWebhookView """
     def get(self, request, *args, **kwargs):
         session_id = request.GET.get('session_id')
-        session = stripe.checkout.Session.retrieve(session_id)
-        order = Order.objects.get(session=session['metadata']['session_number'])
-        order.ordered = True
-        order.save()
-        return Response({'message': 'Order successfully completed'})
-
-class ActiveProductListView(generics.ListAPIView):
-    queryset = Product.objects.filter(is_active=True)
-    serializer_class = ProductSerializer
-    pagination_class = None  # Add custom pagination if needed
+        order = Order.objects.filter(stripe_session_id=session_id).values(
+            'order_number', 'ordered', 'status', 'payment_status'
+        ).first() if session_id else None
 
-    def get(self, request, *args, **kwargs):
-        print(50 * '8', '\n', request.META.get('HTTP_X_REAL_IP'), "Just Visited US", '\n', 50 * '8')
-        
-        if request.user.is_authenticated:
-            print('pure user ==>', request.user)
-            print('pure username ==>', request.user.username)
-        else:
-            print("<== User is not Authenticated ==>")
-        
-        return super().get(request, *args, **kwargs)
+        if order is None or not order['ordered']:
+            # Stripe has not delivered checkout.session.completed yet, the client should poll
+            return Response({'message': 'Payment is being confirmed', 'ordered': False}, status=status.HTTP_202_ACCEPTED)
+        return Response({'message': 'Order successfully completed', **order})
 
-    def get_queryset(self):
-        return Product.objects.filter(is_active=True)
 
-    def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
-        featured_products = Product.objects.filter(is_featured=True, is_active=True)
-        response.data['featured_products'] = ProductSerializer(featured_products, many=True).data
-        return response
+class StripeWebhookView(APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request, *args, **kwargs):
+        try:
+            event = construct_event(request.body, request.META.get('HTTP_STRIPE_SIGNATURE'))
+        except (ValueError, stripe.error.SignatureVerificationError):
+            return Response({"error": "Invalid payload or signature"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            process_events([event])
+        except IntegrityError:
+            pass  # A concurrent delivery of the same event was applied first
+        return Response({"received": True})
 
 class ProductDetailAPI(generics.RetrieveAPIView):
+    use_replica = True
+    query_budget = 3
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     lookup_field = 'slug'
 
-class FeaturedProductListView(generics.ListAPIView):
-    queryset = Product.objects.filter(is_featured=True, is_active=True)
+class FeaturedProductListView(SurrogateKeyMixin, generics.ListAPIView):
+    use_replica = True
+    query_budget = 3
+    access_log_sample_rate = 0.1
+    queryset = Product.objects.filter(is_featured=True, is_active=True).prefetch_related('categories')
     serializer_class = ProductSerializer
     pagination_class = None  # Add custom pagination if needed
 
-class CategoryProductListView(generics.ListAPIView):
+    def get_surrogate_keys(self, response):
+        return super().get_surrogate_keys(response) + ['featured']
+
+class CategoryProductListView(SurrogateKeyMixin, generics.ListAPIView):
+    use_replica = True
+    query_budget = 6
+    access_log_sample_rate = 0.1
     serializer_class = ProductSerializer
 
     def get_queryset(self):
-        category_slug = self.kwargs['slug']
-        category = get_object_or_404(Category, slug=category_slug)
-        return Product.objects.filter(categories=category, is_active=True)
+        self.category = get_object_or_404(Category, slug=self.kwargs['slug'])
+        return Product.objects.filter(categories=self.category, is_active=True).prefetch_related('categories')
 
     def list(self, request, *args, **kwargs):
         response = super().list(request, *args, **kwargs)
-        category = get_object_or_404(Category, slug=self.kwargs['slug'])
+        if isinstance(response.data, list):  # Unpaginated: wrap so the extra sections fit
+            response.data = {'results': response.data}
+        category = self.category
         response.data['category'] = {
             "id": category.id,
             "name": category.name,
             "description": category.description
         }
-        response.data['featured_products'] = ProductSerializer(Product.objects.filter(is_featured=True), many=True).data
+        featured_products = Product.objects.filter(is_featured=True).prefetch_related('categories')
+        response.data['featured_products'] = ProductSerializer(featured_products, many=True).data
         return response
 
-class SubcategoryDetailView(generics.RetrieveAPIView):
+    def get_surrogate_keys(self, response):
+        keys = super().get_surrogate_keys(response) + [category_key(self.kwargs['slug']), 'featured']
+        return keys + [product_key(pk) for pk in product_ids(response.data.get('featured_products', []))]
+
+class SubcategoryDetailView(SurrogateKeyMixin, generics.RetrieveAPIView):
+    use_replica = True
+    query_budget = 3
     serializer_class = SubcategorySerializer
 
+    def get_surrogate_keys(self, response):
+        return [category_key(self.kwargs['category_slug']), subcategory_key(response.data['id'])]
+
     def get_object(self):
         category_slug = self.kwargs.get('category_slug')
         subcategory_slug = self.kwargs.get('slug')
         return get_object_or_404(Subcategory, category__slug=category_slug, slug=subcategory_slug)
 
 
-class SubcategoryListView(generics.ListAPIView):
+class SubcategoryListView(SurrogateKeyMixin, generics.ListAPIView):
+    use_replica = True
+    query_budget = 3
     serializer_class = SubcategorySerializer
 
+    def get_surrogate_keys(self, response):
+        return [category_key(self.kwargs['category_slug'])]
+
     def get_queryset(self):
         category_slug = self.kwargs.get('category_slug')
         category = get_object_or_404(Category, slug=category_slug)
         return category.subcategories.all()
 
 
-class ProductDetailView(generics.RetrieveAPIView):
+class BulkProductView(SurrogateKeyMixin, APIView):
+    """
+    Up to BULK_LOOKUP_LIMIT products by ?ids=1,2 and/or ?slugs=a,b, in request
+    order (ids first), read through the per-product cache. Unknown ids and slugs
+    are listed under "missing". ?fields= trims each product as on other endpoints.
+    """
+    use_replica = True
+    query_budget = 3
+    access_log_sample_rate = 0.1
+    BULK_LOOKUP_LIMIT = 100
+
+    def get(self, request, *args, **kwargs):
+        ids = self.split_param('ids')
+        slugs = self.split_param('slugs')
+        if len(ids) + len(slugs) > self.BULK_LOOKUP_LIMIT:
+            raise serializers.ValidationError({'detail': f'At most {self.BULK_LOOKUP_LIMIT} ids and slugs per request'})
+        bad_ids = [value for value in ids if not value.isdigit()]
+        ids = [int(value) for value in ids if value.isdigit()]
+
+        by_id, by_slug = get_products(ids, slugs)
+        results = [by_id[pk] for pk in ids if pk in by_id] + [by_slug[slug] for slug in slugs if slug in by_slug]
+        fields = requested_fields(request)
+        if fields:
+            results = [{k: v for k, v in item.items() if k in fields or k == 'id'} for item in results]
+        return Response({
+            'results': results,
+            'missing': {
+                'ids': bad_ids + [pk for pk in ids if pk not in by_id],
+                'slugs': [slug for slug in slugs if slug not in by_slug],
+            },
+        })
+
+    def split_param(self, name):
+        values = []
+        for raw in self.request.query_params.getlist(name):
+            values.extend(value.strip() for value in raw.split(',') if value.strip())
+        return list(dict.fromkeys(values))  # Drop repeats, keep request order
+
+    def get_surrogate_keys(self, response):
+        keys = [product_key(item['id']) for item in response.data['results']]
+        if response.data['missing']['ids'] or response.data['missing']['slugs']:
+            keys.append('products')  # A missing product may be created later
+        return keys
+
+class ProductDetailView(SurrogateKeyMixin, generics.RetrieveAPIView):
+    use_replica = True
+    query_budget = 5
+    access_log_sample_rate = 0.1
     queryset = Product.objects.all()
-    serializer_class = ProductSerializer
+    serializer_class = ProductDetailSerializer
     lookup_field = 'slug'
 
-    def get(self, request, *args, **kwargs):
-        print(50 * '^|^', '\n', "User accessing product details", '\n', 50 * '^|^')
-        return super().get(request, *args, **kwargs)
+    def get_surrogate_keys(self, response):
+        return super().get_surrogate_keys(response) + [
+            product_key(pk) for pk in product_ids(response.data.get('recommendations', []))
+        ]
 
-class ActiveProductListView(generics.ListAPIView):
-    queryset = Product.objects.filter(is_active=True)
-    serializer_class = ProductSerializer
-    pagination_class = StandardResultsSetPagination  # Custom pagination
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        record_view(request, response.data['id'])
+        response.viewed_product_id = response.data['id']  # Still logged when served from the response cache
+        return response
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+class ActiveProductListView(SurrogateKeyMixin, generics.ListAPIView):
+    use_replica = True
+    query_budget = 4
+    access_log_sample_rate = 0.1
+    queryset = Product.objects.filter(is_active=True).prefetch_related('categories')
+    serializer_class = ProductSerializer
+    pagination_class = StandardResultsSetPagination  # Custom pagination
+
+    def get_surrogate_keys(self, response):
+        return super().get_surrogate_keys(response) + ['products']
+
 class UserProfileView(generics.RetrieveAPIView):
     serializer_class = UserProfileSerializer
     permission_classes = [IsAuthenticated]
@@ -317,24 +433,99 @@ class ConfirmThePasswordResetView(PasswordResetConfirmView):
         return super().form_valid(form)
 
 
+class OrderHistoryPagination(BasePagination):
+    """
+    Keyset pagination on (created_at, id), newest first. Every page is an index
+    range scan from the cursor, so deep pages cost the same as the first one.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            page_size = min(int(request.query_params[self.page_size_query_param]), self.max_page_size)
+        except (KeyError, ValueError):
+            page_size = self.page_size
+        page_size = max(page_size, 1)
+
+        cursor = self.decode_cursor(request)
+        if cursor:
+            created_at, pk = cursor
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+        rows = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+        self.next_cursor = self.encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+        return rows[:page_size]
+
+    def get_paginated_response(self, data):
+        next_url = None
+        if self.next_cursor:
+            next_url = replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+        return Response({'next': next_url, 'results': data})
+
+    def encode_cursor(self, row):
+        raw = f"{row['created_at'].isoformat()}|{row['id']}"
+        return urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_at, pk = urlsafe_b64decode(encoded.encode()).decode().split('|')
+            return datetime.fromisoformat(created_at), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+
 class OrderHistoryView(generics.ListAPIView):
-    serializer_class = OrderSerializer
+    use_replica = True
+    query_budget = 3
+    serializer_class = OrderSummarySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderHistoryPagination
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).order_by('-created_at')
-    
+        # Units per order, evaluated only for the rows of the current page
+        item_count = Order.cart_items.through.objects.filter(order_id=OuterRef('pk')).values('order_id').annotate(
+            total=Sum('cartitem__quantity')
+        ).values('total')
+        return Order.objects.filter(user=self.request.user).values(
+            'id', 'order_number', 'created_at', 'status', 'total'
+        ).annotate(item_count=Coalesce(Subquery(item_count), 0))
+
+
+class OrderDetailView(generics.RetrieveAPIView):
+    use_replica = True
+    query_budget = 4
+    serializer_class = OrderDetailSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'order_number'
+
+    def get_queryset(self):
+        return Order.objects.filter(user=self.request.user).prefetch_related(
+            Prefetch('cart_items', queryset=CartItem.objects.select_related('product'))
+        )
+
 
 # Checkout APIView
 class CheckoutAPIView(APIView):
     def get(self, request, *args, **kwargs):
-        session_key = request.session.session_key
-        order_items = CartItem.objects.filter(session=session_key, ordered=False)
-        if order_items.exists():
-            order = Order.objects.get(session=session_key, ordered=False)
+        order = get_open_order(request.session.session_key)
+        line_items = get_line_items(order) if order else None
+        if line_items:
+            subtotal = line_items_total(line_items)  # Order.total is only brought up to date on save
+            discount = coupon_discount(order_coupon(order), subtotal)
             context = {
-                'order_items': order_items,
-                'order': order,
+                'order_number': order.order_number,
+                'subtotal': subtotal,
+                'discount': discount,
+                'total': subtotal - discount,
+                'line_items': line_items,
                 'stripe_public_key': settings.STRIPE_PUBLIC_KEY
             }
             return Response(context, status=status.HTTP_200_OK)
@@ -342,72 +533,47 @@ class CheckoutAPIView(APIView):
             return Response({"error": "You do not have an active order"}, status=status.HTTP_400_BAD_REQUEST)
 
     def post(self, request, *args, **kwargs):
-        session_key = request.session.session_key
         try:
-            order = Order.objects.get(session=session_key, ordered=False)
-            order_items = order.order_items.all()
-
-            if order_items.exists():
-                line_items = []
-                for item in order_items:
-                    line_items.append({
-                        'name': item.product.name,
-                        'description': item.product.description,
-                        'images': [item.product.image.url],
-                        'amount': int(item.product.price * 100),
-                        'currency': 'usd',
-                        'quantity': item.quantity,
-                        'adjustable_quantity': {
-                            'enabled': True,
-                            'minimum': 1,
-                            'maximum': 10,
-                        },
-                    })
-
-                session = stripe.checkout.Session.create(
-                    billing_address_collection="required",
-                    customer_creation="always",
-                    payment_method_types=['card'],
-                    mode='payment',
-                    line_items=line_items,
-                    success_url=request.build_absolute_uri(reverse_lazy('checkout_success')),
-                    cancel_url=request.build_absolute_uri(reverse_lazy('checkout')),
-                    shipping_options=[
-                        {
-                            'shipping_rate_data': {
-                                'type': 'fixed_amount',
-                                'fixed_amount': {'amount': 0, 'currency': 'usd'},
-                                'display_name': 'Free shipping',
-                                'delivery_estimate': {
-                                    'minimum': {'unit': 'business_day', 'value': 5},
-                                    'maximum': {'unit': 'business_day', 'value': 7},
-                                },
-                            }
-                        },
-                        {
-                            'shipping_rate_data': {
-                                'type': 'fixed_amount',
-                                'fixed_amount': {'amount': 15 * 100, 'currency': 'usd'},
-                                'display_name': 'Next day air',
-                                'delivery_estimate': {
-                                    'minimum': {'unit': 'business_day', 'value': 1},
-                                    'maximum': {'unit': 'business_day', 'value': 1},
-                                },
-                            }
-                        },
-                    ]
-                )
-
+            order = get_open_order(request.session.session_key)
+            if order is None:
+                return Response({"error": "No active order found"}, status=status.HTTP_400_BAD_REQUEST)
+
+            line_items = get_line_items(order)
+            if line_items:
+                expires_at = reserve_order(order)
+                try:
+                    session = create_checkout_session(request, order, line_items, expires_at)
+                except Exception:
+                    release_orders([order])
+                    raise
                 return Response({"checkout_url": session.url}, status=status.HTTP_303_SEE_OTHER)
             else:
                 return Response({"error": "You do not have an active order"}, status=status.HTTP_400_BAD_REQUEST)
 
-        except Order.DoesNotExist:
-            return Response({"error": "No active order found"}, status=status.HTTP_400_BAD_REQUEST)
+        except InsufficientStock:
+            return Response({"error": "Some items in your cart are out of stock"}, status=status.HTTP_409_CONFLICT)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class ApplyCouponView(APIView):
+    def post(self, request, *args, **kwargs):
+        coupon = resolve_coupon(request.data.get('code'))
+        if coupon is None:
+            return Response({"error": "Invalid or expired coupon"}, status=status.HTTP_400_BAD_REQUEST)
+
+        order = get_open_order(request.session.session_key)
+        if order is None:
+            return Response({"error": "No active order found"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Bumping last_updated gives the order a new checkout version
+        Order.objects.filter(pk=order.pk).update(coupon=coupon, last_updated=timezone.now())
+        return Response({"code": coupon.code, "description": coupon.description, "discount": coupon.discount})
+
+
 class SearchResultsView(generics.ListAPIView):
+    use_replica = True
+    query_budget = 3
+    access_log_sample_rate = 0.1
     serializer_class = ProductSerializer
 
     def get_queryset(self):
@@ -415,14 +581,50 @@ class SearchResultsView(generics.ListAPIView):
         if query:
             return Product.objects.filter(
                 Q(name__icontains=query) | Q(categories__name__icontains=query)
-            )
+            ).distinct().prefetch_related('categories')
         return Product.objects.none()
 
 # Popular Product List APIView
-class PopularProductListAPIView(ListAPIView):
-    queryset = PopularProduct.objects.all()
+class PopularProductListAPIView(generics.ListAPIView):
+    """ Top-N read of the rollup, served by the (window, -score) index """
+    use_replica = True
+    query_budget = 4
     serializer_class = PopularProductSerializer
     permission_classes = [IsAdminUser]
+    pagination_class = None
+    default_limit = 20
+    max_limit = 100
+
+    def get_queryset(self):
+        window = self.request.query_params.get('window', '7d')
+        if window not in WINDOWS:
+            raise serializers.ValidationError({'window': f"Choose one of {', '.join(WINDOWS)}"})
+        try:
+            limit = min(int(self.request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+        return PopularProduct.objects.filter(window=window, product__is_active=True).select_related(
+            'product'
+        ).prefetch_related('product__categories').order_by('-score')[:limit]
+
+# Page bootstrap: several GETs in one round-trip
+class BatchView(APIView):
+    """ POST {"requests": ["/api/navbar/", "/api/products/featured/?fields=id,name"]} """
+
+    def post(self, request, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            results = run_batch(request, request.data.get('requests'), exclude={request.path})
+        except BatchError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'responses': results, 'duration_ms': round((time.perf_counter() - started) * 1000, 2)})
+
+# Response cache counters for this worker
+class ResponseCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(response_cache.stats())
 
 # Product Review APIView
 class ProductReviewCreateAPIView(APIView):
@@ -439,14 +641,46 @@ class ProductReviewCreateAPIView(APIView):
 # Robots.txt view
 def robots_txt(request):
     content = "User-agent: *\nDisallow: /admin/\nDisallow: /accounts/\nDisallow: /static/\nDisallow: /media/"
+    content += f"\n\nSitemap: {settings.SITE_URL.rstrip('/')}{reverse('store:sitemap_index')}\n"
     return HttpResponse(content, content_type='text/plain')
 
+# Sitemap index and shards written by `manage.py build_sitemaps`
+def sitemap_index(request):
+    path = os.path.join(settings.SITEMAP_ROOT, INDEX_NAME)
+    if not os.path.exists(path):
+        raise Http404('Sitemaps have not been built yet')
+    if accepts_gzip(request):
+        return serve_file(request, path, 'application/xml', content_encoding='gzip')
+    return StreamingHttpResponse(gunzip_chunks(path), content_type='application/xml')
+
+def sitemap_shard(request, filename):
+    path = os.path.join(settings.SITEMAP_ROOT, filename)
+    if not SHARD_NAME_RE.match(filename) or not os.path.exists(path):
+        raise Http404('No such sitemap')
+    return serve_file(request, path, 'application/gzip')
+
+# Prometheus scrape endpoint (store/metrics.py)
+def metrics_view(request):
+    if metrics.prometheus_client is None:
+        return HttpResponse('prometheus_client is not installed\n', status=503, content_type='text/plain')
+    token = settings.METRICS_TOKEN
+    if token:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=401)
+    elif not request.user.is_staff:  # No token configured: staff sessions only
+        return HttpResponse(status=403)
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
+
 # Google Base XML API
 def google_base(request):
-    products = Product.active.all()
-    template = loader.get_template("marketing/google_base.xml")
-    xml = template.render({'products': products})
-    return HttpResponse(xml, content_type="application/xml")
+    path = settings.GOOGLE_FEED_PATH
+    if not os.path.exists(path):
+        # No build yet: render on the fly, one product at a time
+        return StreamingHttpResponse(iter_feed(), content_type='application/xml')
+    if accepts_gzip(request):
+        return serve_file(request, path, 'application/xml', content_encoding='gzip')
+    return StreamingHttpResponse(gunzip_chunks(path), content_type='application/xml')
 
 
 # Implement db cacheing
\ No newline at end of file
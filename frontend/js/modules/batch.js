@@ -0,0 +1,17 @@
+// Fetch several API GETs in one round-trip through /api/batch/
+export function fetchBatch(paths) {
+    const apiBaseUrl = '/api';
+    const csrfToken = (document.cookie.match(/(?:^|; )csrftoken=([^;]*)/) || [])[1] || '';
+
+    return fetch(`${apiBaseUrl}/batch/`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrfToken
+        },
+        body: JSON.stringify({ requests: paths })
+    })
+        .then(response => response.json())
+        .then(data => data.responses)
+        .catch(error => console.log('Error fetching batch:', error));
+}
@@ -35,3 +35,14 @@ function renderProducts(products) {
         productList.appendChild(productItem);
     });
 }
+
+// Resolve many products in one request instead of one detail call each
+export function fetchProductsBySlugs(slugs) {
+    const apiBaseUrl = '/api';
+    const params = new URLSearchParams({ slugs: slugs.join(',') });
+
+    return fetch(`${apiBaseUrl}/products/bulk/?${params}`)
+        .then(response => response.json())
+        .then(data => data.results)
+        .catch(error => console.log('Error fetching products:', error));
+}